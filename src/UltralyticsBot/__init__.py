@@ -7,6 +7,7 @@ Requires: discord.py, pyyaml, numpy, requests, opencv-python
 """
 
 from pathlib import Path
+from functools import cache
 
 import yaml
 
@@ -14,30 +15,41 @@ ROOT = Path(__file__).parent
 PROJ_ROOT = ROOT.parent.parent
 GH = "https://github.com/Burhan-Q/Ultralytics_DiscordBot"
 
-# Secrets config
-SECRETS:dict = yaml.safe_load((PROJ_ROOT / 'SECRETS/codes.yaml').read_text('utf-8'))
-BOT_TOKEN = SECRETS['apikey']
-BOT_ID = SECRETS['botID']
-HUB_KEY = SECRETS['inferkey']
-OWNER_ID = SECRETS['ownerID']
-DEV_GUILD = SECRETS['devGuild']
-DEV_CH = SECRETS['devCh']
-
-# Commands config
-CMDS:dict = yaml.safe_load((PROJ_ROOT / 'cfg/commands.yaml').read_text('utf-8'))
-
-# Inference request config
-REQ_CFG:dict = yaml.safe_load((PROJ_ROOT / 'cfg/req.yaml').read_text('utf-8'))
-DEFAULT_INFER = REQ_CFG['default']
-REQ_ENDPOINT = REQ_CFG.get('endpoint') or SECRETS.get('endpoint')
-REQ_LIM = REQ_CFG['limits']
-RESPONSE_KEYS = tuple(REQ_CFG['response'])
-MAX_REQ = REQ_CFG['max_req']
-MODELS = REQ_CFG['models']
-
-# Docker config
-DOCKER_CFG = yaml.safe_load((PROJ_ROOT / 'compose.yaml').read_text('utf-8'))
-REPO_DIR = DOCKER_CFG['services']['bot']['build']['args']['REPO_DIR'].strip().lower()
+def _read(file:str) -> dict:
+    return yaml.load((PROJ_ROOT / file).read_text('utf-8'), Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) # C parser when libyaml is available
+
+@cache
+def _cfg(name:str) -> dict:
+    return _read(CFG_FILES[name])
+
+def _config_store():
+    from UltralyticsBot.utils.config import ConfigStore # imports logging, which needs this module
+    return ConfigStore(PROJ_ROOT / CFG_FILES['req'], PROJ_ROOT / CFG_FILES['cmds'], lambda: _cfg('secrets'))
+
+# Config files are only read when one of their values is first imported, see `__getattr__()`
+CFG_FILES = {'secrets':'SECRETS/codes.yaml', 'cmds':'cfg/commands.yaml', 'req':'cfg/req.yaml', 'docker':'compose.yaml'}
+LAZY_CFG = {
+    # Secrets config
+    'SECRETS':lambda: _cfg('secrets'),
+    'BOT_TOKEN':lambda: _cfg('secrets')['apikey'],
+    'BOT_ID':lambda: _cfg('secrets')['botID'],
+    'HUB_KEY':lambda: _cfg('secrets')['inferkey'],
+    'OWNER_ID':lambda: _cfg('secrets')['ownerID'],
+    'DEV_GUILD':lambda: _cfg('secrets')['devGuild'],
+    'DEV_CH':lambda: _cfg('secrets')['devCh'],
+    # Inference request and commands config, see `utils/config.py`
+    'CONFIG':lambda: _config_store(),
+    # Docker config
+    'DOCKER_CFG':lambda: _cfg('docker'),
+    'REPO_DIR':lambda: _cfg('docker')['services']['bot']['build']['args']['REPO_DIR'].strip().lower(),
+}
+
+def __getattr__(name:str):
+    """Loads config value `name` on first access and keeps it as module attribute."""
+    if name not in LAZY_CFG:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = LAZY_CFG[name]()
+    return value
 
 ASSETS = PROJ_ROOT / 'assets'
 
@@ -45,4 +57,4 @@ ASSETS = PROJ_ROOT / 'assets'
 YOLOv5_REGEX = r"^yolov5(n|s|m|l|x)(u|6u)?$"
 YOLOv8_REGEX = r"^yolov8(n|s|m|l|x)(-cls|-seg|-pose|-obb)?$"
 
-__all__ = 'ROOT', 'PROJ_ROOT', 'SECRETS', 'CMDS', 'REQ_CFG', 'ASSETS', 'BOT_TOKEN', 'BOT_ID', 'HUB_KEY', 'DEFAULT_INFER', 'REQ_ENDPOINT', 'REQ_LIM', 'RESPONSE_KEYS', 'GH', 'YOLOv5_REGEX', 'YOLOv8_REGEX', 'MODELS'
+__all__ = 'ROOT', 'PROJ_ROOT', 'SECRETS', 'CONFIG', 'ASSETS', 'BOT_TOKEN', 'BOT_ID', 'HUB_KEY', 'GH', 'YOLOv5_REGEX', 'YOLOv8_REGEX'
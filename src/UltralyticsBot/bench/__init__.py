@@ -0,0 +1,5 @@
+'''
+Title: UltralyticsBot/bench
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+'''
@@ -0,0 +1,98 @@
+"""
+Title: bench/corpus.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy, opencv-python
+"""
+from dataclasses import dataclass
+
+import cv2 as cv
+import numpy as np
+
+from UltralyticsBot import CONFIG
+
+SEED = 0 # keep corpus identical between runs so results are comparable
+IMG_SIZES = ((480, 640), (1080, 1920), (3000, 4000)) # height, width
+IMG_FORMATS = ('.jpg', '.png', '.webp', '.bmp')
+IMG_CHANNELS = (1, 3, 4)
+DETECTIONS = (0, 1, 10, 100, 500)
+TASKS = ('detect', 'segment', 'pose', 'obb', 'classify')
+SEG_POINTS = 64 # polygon vertices per instance
+N_KPTS = 17
+CLASS_NAMES = ('person', 'bicycle', 'car', 'motorcycle', 'bus', 'truck', 'traffic light', 'stop sign', 'dog', 'cat')
+
+@dataclass(frozen=True)
+class SynthImage:
+    name:str
+    height:int
+    width:int
+    channels:int
+    ext:str
+    data:bytes
+
+def synth_image(height:int, width:int, channels:int=3, seed:int=SEED) -> np.ndarray:
+    """Generates repeatable image with noise and filled shapes, so encoders do real work instead of compressing flat color."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (height // 8, width // 8, 3), np.uint8)
+    img = cv.resize(img, (width, height), interpolation=cv.INTER_LINEAR)
+    for _ in range(12):
+        x1, x2 = np.sort(rng.integers(0, width, 2))
+        y1, y2 = np.sort(rng.integers(0, height, 2))
+        _ = cv.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+    if channels == 1:
+        img = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    elif channels == 4:
+        img = cv.cvtColor(img, cv.COLOR_BGR2BGRA)
+    return img
+
+def image_corpus(sizes:tuple=IMG_SIZES, formats:tuple=IMG_FORMATS, channels:tuple=IMG_CHANNELS) -> dict[str, SynthImage]:
+    """Builds encoded images for every combination of size, format, and channel count that the encoder supports."""
+    corpus = dict()
+    for si, (h, w) in enumerate(sizes):
+        for ch in channels:
+            img = synth_image(h, w, ch, SEED + si)
+            for ext in formats:
+                if ext == '.bmp' and ch == 4: # 32-bit BMP is poorly supported by decoders, skip
+                    continue
+                ok, enc = cv.imencode(ext, img)
+                if ok:
+                    name = f"{w}x{h}_{ch}ch{ext}"
+                    corpus[name] = SynthImage(name, h, w, ch, ext, enc.tobytes())
+    return corpus
+
+def _rounded(arr:np.ndarray) -> list[float]:
+    return np.round(arr, 5).tolist()
+
+def canned_response(n_dets:int, seed:int=SEED, task:str='detect') -> dict:
+    """Generates HUB-style JSON response with `n_dets` detections in normalized xcycwh format, with `segments`, `keypoints`, or rotated `box` added for segment, pose, and obb tasks. Classify returns top 5 classes."""
+    rng = np.random.default_rng(seed + n_dets)
+    n_dets = min(n_dets, 5) if task == 'classify' else n_dets
+    wh = rng.uniform(0.02, 0.4, (n_dets, 2))
+    xy = rng.uniform(0, 1, (n_dets, 2)) * (1 - wh) + (wh / 2)
+    cls = rng.integers(0, len(CLASS_NAMES), n_dets)
+    conf = rng.uniform(0.25, 1.0, n_dets)
+    data = [dict(zip(CONFIG.get().response, (CLASS_NAMES[c], round(float(cf), 5), int(c), *(round(float(v), 5) for v in (*p, *s)))))
+            for c, cf, p, s in zip(cls, conf, xy, wh)]
+    
+    if task == 'segment': # ellipse inscribed in box
+        t = np.linspace(0, 2 * np.pi, SEG_POINTS, endpoint=False)
+        for d, p, s in zip(data, xy, wh):
+            d['segments'] = {'x':_rounded(p[0] + np.cos(t) * s[0] / 2), 'y':_rounded(p[1] + np.sin(t) * s[1] / 2)}
+    
+    elif task == 'pose':
+        for d, p, s in zip(data, xy, wh):
+            k = rng.uniform(-0.5, 0.5, (N_KPTS, 2)) * s + p
+            d['keypoints'] = {'x':_rounded(k[:, 0]), 'y':_rounded(k[:, 1]), 'visible':_rounded(rng.uniform(0, 1, N_KPTS))}
+    
+    elif task == 'obb': # rotate box corners about center
+        for d, p, s, a in zip(data, xy, wh, rng.uniform(0, np.pi, n_dets)):
+            rot = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+            c = (np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * s / 2) @ rot.T + p
+            d['box'] = {f"{ax}{i + 1}":round(float(v), 5) for i, pt in enumerate(np.clip(c, 0, 1)) for ax, v in zip('xy', pt)}
+    
+    return {'data': data, 'message': 'Inference complete.', 'success': True}
+
+def response_corpus(detections:tuple=DETECTIONS) -> dict[int, dict]:
+    """Canned responses keyed by number of detections."""
+    return {n:canned_response(n) for n in detections}
@@ -0,0 +1,254 @@
+"""
+Title: bench/load.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: discord.py, numpy
+"""
+import time
+import asyncio
+import itertools
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import numpy as np
+from discord import app_commands
+
+from UltralyticsBot import BOT_ID, CONFIG
+from UltralyticsBot.cmds import actions
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.upstream import UpstreamClient, UpstreamBusy
+from UltralyticsBot.utils.msgs import IMG_ERR_MSG
+from UltralyticsBot.bench.corpus import image_corpus
+from UltralyticsBot.bench.mock_hub import MockHUB, MockConfig
+from UltralyticsBot.bench.pipeline import unpaced_client, UNPACED
+from UltralyticsBot.jobs.broker import make_broker
+from UltralyticsBot.jobs.worker import start_process_workers, start_thread_workers
+
+###-----FAKE DISCORD OBJECTS-----###
+
+SNOWFLAKES = itertools.count(1) # IDs for fake messages and interactions, used as log request IDs
+
+@dataclass
+class FakeUser:
+    id:int = 0
+    name:str = 'loadtest'
+
+@dataclass
+class FakeAttachment:
+    """Minimal stand-in for `discord.Attachment`, only attributes used by `ReqMessage`."""
+    url:str
+    height:int
+    width:int
+    size:int
+    content_type:str = 'image/png'
+    proxy_url:str = None
+
+@dataclass
+class FakeMessage:
+    """Minimal stand-in for `discord.Message`, records replies instead of sending."""
+    content:str
+    attachments:list = field(default_factory=list)
+    mentions:list = field(default_factory=list)
+    author:FakeUser = field(default_factory=FakeUser)
+    guild = None
+    replies:list = field(default_factory=list)
+    id:int = field(default_factory=lambda: next(SNOWFLAKES))
+
+    async def reply(self, content:str=None, **kwargs):
+        self.replies.append((content, kwargs))
+        return self
+
+    async def edit(self, **kwargs):
+        self.replies.append((None, kwargs))
+        return self
+
+class FakeResponse:
+    async def defer(self, **kwargs) -> None:
+        ...
+
+class FakeFollowup:
+    def __init__(self) -> None:
+        self.sent = list()
+
+    async def send(self, content:str=None, **kwargs):
+        self.sent.append((content, kwargs))
+        return FakeMessage(content or '', replies=self.sent)
+
+@dataclass
+class FakeInteraction:
+    """Minimal stand-in for `discord.Interaction`, records followup messages instead of sending."""
+    user:FakeUser = field(default_factory=FakeUser)
+    guild = None
+    response:FakeResponse = field(default_factory=FakeResponse)
+    followup:FakeFollowup = field(default_factory=FakeFollowup)
+    id:int = field(default_factory=lambda: next(SNOWFLAKES))
+
+###-----LOAD GENERATOR-----###
+
+@contextmanager
+def endpoint_override(url:str):
+    """Points the predict commands to `url` instead of configured endpoint for the duration of the context."""
+    original = CONFIG.replace(endpoint=url)
+    try:
+        yield
+    finally:
+        CONFIG.set(original)
+
+@contextmanager
+def reply_mode(progressive:bool|None):
+    """Sets progressive replies on or off for the duration of the context, `None` keeps configured mode."""
+    original = CONFIG.replace(reply={**CONFIG.get().reply, 'progressive':progressive}) if progressive is not None else None
+    try:
+        yield
+    finally:
+        _ = CONFIG.set(original) if original is not None else None
+
+@contextmanager
+def cache_mode(enabled:bool=False):
+    """Result cache for the duration of the context, disabled or when `enabled` an empty cache in temporary directory, so repeated corpus images don't measure the cache and the bot's own cache is never read or written. Yields `cache` config for job worker processes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg = {**CONFIG.get().cache, 'enabled':enabled, 'path':(Path(tmp) / 'results.sqlite3').as_posix()}
+        original = actions.RESULT_CACHE, actions.NEAR_DUP
+        actions.RESULT_CACHE, actions.NEAR_DUP = actions.result_cache(cfg)
+        try:
+            yield cfg
+        finally:
+            _ = actions.RESULT_CACHE.close() if actions.RESULT_CACHE is not None else None
+            actions.RESULT_CACHE, actions.NEAR_DUP = original
+
+@contextmanager
+def pace_mode(paced:bool=False):
+    """Upstream requests without pacing for the duration of the context, so load test measures the bot and not the rate limiter, or when `paced` through configured upstream client. Yields `upstream` config for job worker processes, `None` when paced."""
+    if paced:
+        yield None
+        return
+
+    with unpaced_client():
+        yield {**CONFIG.get().upstream, **UNPACED}
+
+@contextmanager
+def job_mode(broker:str|None, workers:int=2, cache:dict=None, upstream:dict=None):
+    """Sends predict commands through job `broker` ('memory' or 'sqlite') for the duration of the context, with worker thread or `workers` processes (SQLite queue in temporary directory) using `cache` and `upstream` config. `None` keeps configured mode."""
+    if broker is None:
+        yield
+        return
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg = {**CONFIG.get().jobs, 'enabled':True, 'broker':broker, 'path':(Path(tmp) / 'jobs.sqlite3').as_posix()}
+        original = actions.BROKER
+        actions.BROKER = make_broker(cfg)
+        if broker == 'memory':
+            _, stop = start_thread_workers(actions.BROKER, cfg['concurrency'])
+        else:
+            procs = start_process_workers(cfg, workers, cache, upstream)
+        try:
+            yield
+        finally:
+            actions.BROKER = original
+            _ = stop.set() if broker == 'memory' else [(p.terminate(), p.join()) for p in procs]
+
+def is_error(text:str|None) -> bool:
+    return text is None or text == IMG_ERR_MSG or text.startswith('Error')
+
+async def slash_request(img_url:str, model:str='yolov8n') -> tuple[str, float]:
+    """Runs `/predict` through `im_predict`, returns outcome as one of 'ok', 'error' (error reply sent), or 'crash' (exception raised) and latency."""
+    inter = FakeInteraction()
+    t0 = time.perf_counter()
+    try:
+        await actions.im_predict(inter, img_url, model=app_commands.Choice(name=model, value=model))
+        replies = [c for c,_ in inter.followup.sent if c is not None] # edits and separately sent images have no content
+        outcome = 'error' if not any(replies) or any(is_error(c) for c in replies) else 'ok'
+    except Exception as e:
+        Loggr.error(f"im_predict raised {e!r}")
+        outcome = 'crash'
+    return outcome, time.perf_counter() - t0
+
+async def message_request(img_url:str, attach:tuple[int,int,int], mention:bool=False) -> tuple[str, float]:
+    """Sends `$predict` (or bot mention when `mention=True`) message with image attachment (height, width, bytes) through `msg_predict`. NOTE: attachments are used since `URL_RGX` does not match IP address hosts of the mock server."""
+    if mention:
+        msg = FakeMessage(f"<@{BOT_ID}>", attachments=[FakeAttachment(img_url, *attach, proxy_url=img_url)], mentions=[FakeUser(BOT_ID)])
+    else:
+        msg = FakeMessage('$predict', attachments=[FakeAttachment(img_url, *attach, proxy_url=img_url)])
+    t0 = time.perf_counter()
+    try:
+        await actions.msg_predict(msg)
+        replies = [c for c,_ in msg.replies if c is not None]
+        outcome = 'error' if not any(replies) or any(is_error(c) for c in replies) else 'ok'
+    except Exception as e:
+        Loggr.error(f"msg_predict raised {e!r}")
+        outcome = 'crash'
+    return outcome, time.perf_counter() - t0
+
+async def drive(hub:MockHUB, n_requests:int, concurrency:int, slash_ratio:float=0.5, seed:int=0) -> dict:
+    """Issues `n_requests` mixed slash-command and message predictions with up to `concurrency` in flight, reply timings are time to first reply and full reply as recorded by `actions.send_reply`."""
+    rng = np.random.default_rng(seed)
+    names = list(hub.images)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i:int):
+        img = hub.images[names[i % len(names)]]
+        url = hub.img_url(img.name)
+        async with sem:
+            if rng.random() < slash_ratio:
+                return await slash_request(url)
+            return await message_request(url, (img.height, img.width, len(img.data)), mention=bool(i % 2))
+
+    with endpoint_override(hub.endpoint()):
+        replies_before = {k:len(v) for k,v in METRICS.timings.items()}
+        cache_before = {k:METRICS.counters[f'cache.{k}'] for k in ('hits', 'misses')}
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(n_requests)))
+        elapsed = time.perf_counter() - t0
+        reply_ms = {k:list(METRICS.timings[k])[replies_before.get(k, 0):] for k in ('reply.first_ms', 'reply.full_ms')}
+        cache = {k:METRICS.counters[f'cache.{k}'] - n for k,n in cache_before.items()} # only counted in this process, not job worker processes
+
+    outcomes = [r[0] for r in results]
+    lat = np.array([r[1] for r in results]) * 1e3
+    return {'requests':n_requests,
+            **{o:outcomes.count(o) for o in ('ok', 'error', 'crash')},
+            'throughput':round(n_requests / elapsed, 3),
+            'latency_ms':{q:round(float(np.percentile(lat, int(q[1:]))), 3) for q in ('p50', 'p95', 'p99')},
+            'progressive':CONFIG.get().reply['progressive'],
+            'jobs':type(actions.BROKER).__name__ if actions.BROKER is not None else None,
+            'cache':cache if actions.RESULT_CACHE is not None else None,
+            'paced':actions.HUB_CLIENT.bucket.rate < UNPACED['rate'],
+            **{k.split('.')[-1]:{q:round(float(np.percentile(v, int(q[1:]))), 3) if v else None for q in ('p50', 'p95', 'p99')} for k,v in reply_ms.items()},
+            'server':hub.stats.as_dict()}
+
+def run_load(n_requests:int=100, concurrency:int=8, cfg:MockConfig=None, slash_ratio:float=0.5, progressive:bool=None, jobs:str=None, cache:bool=False, paced:bool=False) -> dict:
+    """Starts mock HUB server and drives load through `msg_predict` and `im_predict`, returns summary. Progressive replies are on or off with `progressive`, and commands are run by job workers through `jobs` broker ('memory' or 'sqlite'), configured modes are used when `None`. Result cache is off unless `cache`, then starts empty in temporary directory. Upstream requests aren't paced or retried unless `paced`, then use configured `upstream` rate limit."""
+    images = image_corpus(sizes=((480, 640), (1080, 1920)), formats=('.jpg', '.png'), channels=(3,))
+    with MockHUB(images, cfg) as hub, reply_mode(progressive), cache_mode(cache) as cache_cfg, pace_mode(paced) as upstream, job_mode(jobs, cache=cache_cfg, upstream=upstream):
+        Loggr.info(f"Mock HUB serving at {hub.base_url} with {hub.cfg}")
+        return asyncio.run(drive(hub, n_requests, concurrency, slash_ratio))
+
+def breaker_check(n_checks:int=3) -> dict:
+    """
+    Regression check that circuit breaker leaves half-open when trial request is not sent (rate limited) or raises unexpected error, otherwise every later request is rejected until restart. Each case opens breaker, fails the trial request, then sends request to mock HUB which must be allowed. Returns outcome of each case, raises ``AssertionError`` when breaker is stuck.
+    """
+    images = image_corpus(sizes=((480, 640),), formats=('.jpg',), channels=(3,))
+    out = dict()
+    with MockHUB(images) as hub:
+        for case in ('rate_limited', 'unexpected_error'):
+            client = UpstreamClient(retries=0, max_wait=0.0, rate=10.0, burst=1, fail_threshold=1, cooldown=0.0)
+            for _ in range(n_checks):
+                time.sleep(2 / client.bucket.rate) # refill token
+                client.breaker.failure() # open, trial allowed at once since no cooldown
+                _ = client.bucket.reserve() if case == 'rate_limited' else None # drained, trial isn't sent
+                try:
+                    client.post(hub.endpoint() if case == 'rate_limited' else 'http://', data={})
+                except UpstreamBusy as e:
+                    assert case == 'rate_limited' and str(e).startswith('rate limited'), f"{case} trial rejected with {e!r}"
+                except Exception as e:
+                    assert case == 'unexpected_error', f"{case} trial raised {e!r}"
+                assert client.breaker.state != client.breaker.HALF_OPEN, f"Circuit breaker stuck half-open after {case} trial"
+                time.sleep(2 / client.bucket.rate) # refill token
+                resp = client.post(hub.endpoint(), data={}) # raises `UpstreamBusy` when stuck
+                assert client.breaker.state == client.breaker.CLOSED, f"Circuit breaker {client.breaker.state} after {resp.status_code} response"
+            out[case] = 'ok'
+        out['server'] = hub.stats.as_dict()
+    return out
@@ -0,0 +1,173 @@
+"""
+Title: bench/mock_hub.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy
+"""
+import json
+import time
+import threading
+from email import policy
+from email.parser import BytesParser
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import numpy as np
+
+from UltralyticsBot import CONFIG
+from UltralyticsBot.bench.stub import StubHandler, StubServer
+from UltralyticsBot.bench.corpus import SynthImage, canned_response
+
+@dataclass
+class MockConfig:
+    """
+    Attributes
+    ---
+    latency_ms - ``float``
+        Mean added response latency in milliseconds.
+
+    jitter_ms - ``float``
+        Standard deviation of added latency in milliseconds.
+
+    error_rate - ``float``
+        Fraction of requests (0.0 to 1.0) answered with HTTP 500.
+
+    rate_limit - ``int``
+        Requests allowed per `rate_window` seconds before replying HTTP 429, no limit when 0.
+
+    rate_window - ``float``
+        Length in seconds of rate limiting window.
+
+    detections - ``tuple[int,int]``
+        Inclusive range for number of detections in each reply.
+    """
+    latency_ms:float = 0.0
+    jitter_ms:float = 0.0
+    error_rate:float = 0.0
+    rate_limit:int = 0
+    rate_window:float = 60.0
+    detections:tuple[int,int] = (0, 20)
+    seed:int = 0
+
+@dataclass
+class MockStats:
+    requests:int = 0
+    ok:int = 0
+    errors:int = 0
+    limited:int = 0
+    bad_request:int = 0
+    lock:threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, key:str) -> None:
+        with self.lock:
+            self.requests += 1
+            setattr(self, key, getattr(self, key) + 1)
+
+    def as_dict(self) -> dict:
+        return {k:getattr(self, k) for k in ('requests', 'ok', 'errors', 'limited', 'bad_request')}
+
+def parse_multipart(content_type:str, body:bytes) -> tuple[dict[str,str], dict[str,bytes]]:
+    """Splits `multipart/form-data` body into form fields and files, same layout `requests.post(data=..., files=...)` sends."""
+    msg = BytesParser(policy=policy.HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    fields, files = dict(), dict()
+    for part in msg.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True)
+        if part.get_filename() is not None:
+            files[name] = payload
+        else:
+            fields[name] = payload.decode()
+    return fields, files
+
+class MockHandler(StubHandler):
+    """Handles inference requests like HUB API does, see `MockConfig` for simulated behavior."""
+    server:'MockHUB'
+
+    def send_json(self, code:int, reply:dict, headers:dict=None) -> None:
+        body = json.dumps(reply).encode()
+        self.send_response(code)
+        for k,v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        hub:MockHUB = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        limited, headers = hub.take_slot()
+        if limited:
+            hub.stats.add('limited')
+            return self.send_json(429, {'data':[], 'message':'Too many requests.', 'success':False}, headers)
+
+        try:
+            fields, files = parse_multipart(self.headers.get('Content-Type', ''), body)
+            assert 'image' in files and any(files['image']), "Missing image file in request."
+            conf = float(fields.get('confidence', CONFIG.get().default['confidence']))
+        except Exception as e:
+            hub.stats.add('bad_request')
+            return self.send_json(400, {'data':[], 'message':f"Bad request: {e}", 'success':False}, headers)
+
+        time.sleep(hub.delay())
+        if hub.failed():
+            hub.stats.add('errors')
+            return self.send_json(500, {'data':[], 'message':'Internal server error.', 'success':False}, headers)
+
+        reply = hub.reply(conf, urlparse(self.path).path.rpartition('/')[-1])
+        hub.stats.add('ok')
+        self.send_json(200, reply, headers)
+
+class MockHUB(StubServer):
+    """Local stand-in for the HUB inference API (and image host), accepts the same multipart requests as `inference_req` and replies with the same JSON keys."""
+    
+    def __init__(self, images:dict[str, SynthImage], cfg:MockConfig=None, host:str='127.0.0.1', port:int=0) -> None:
+        super().__init__(images, {}, host, port)
+        self.RequestHandlerClass = MockHandler
+        self.cfg = cfg or MockConfig()
+        self.stats = MockStats()
+        self._rng = np.random.default_rng(self.cfg.seed)
+        self._rng_lock = threading.Lock()
+        self._window = (time.monotonic(), 0) # window start, count
+
+    def endpoint(self, model:str='yolov8n') -> str:
+        return f"{self.base_url}/v1/predict/{model}"
+
+    def take_slot(self) -> tuple[bool, dict]:
+        """Fixed window rate limiting, returns if request is limited and rate limit headers to send."""
+        if not self.cfg.rate_limit:
+            return False, {}
+        with self._rng_lock:
+            start, count = self._window
+            now = time.monotonic()
+            if now - start >= self.cfg.rate_window:
+                start, count = now, 0
+            count += 1
+            self._window = (start, count)
+        reset = max(self.cfg.rate_window - (now - start), 0)
+        headers = {'X-RateLimit-Limit':self.cfg.rate_limit,
+                   'X-RateLimit-Remaining':max(self.cfg.rate_limit - count, 0),
+                   'X-RateLimit-Reset':f"{reset:.3f}"}
+        if count > self.cfg.rate_limit:
+            headers['Retry-After'] = f"{reset:.3f}"
+            return True, headers
+        return False, headers
+
+    def delay(self) -> float:
+        with self._rng_lock:
+            return max(self._rng.normal(self.cfg.latency_ms, self.cfg.jitter_ms) if self.cfg.jitter_ms else self.cfg.latency_ms, 0) / 1e3
+
+    def failed(self) -> bool:
+        with self._rng_lock:
+            return self._rng.random() < self.cfg.error_rate
+
+    def reply(self, conf:float, model:str) -> dict:
+        with self._rng_lock:
+            lo, hi = self.cfg.detections
+            n, seed = int(self._rng.integers(lo, hi + 1)), int(self._rng.integers(0, 2**16))
+        reply = canned_response(n, seed)
+        reply['data'] = [d for d in reply['data'] if d['confidence'] >= conf]
+        reply['message'] = f"Inference complete using {model}."
+        return reply
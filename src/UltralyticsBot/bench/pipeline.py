@@ -0,0 +1,161 @@
+"""
+Title: bench/pipeline.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: pyyaml, numpy, requests, opencv-python
+"""
+import time
+from pathlib import Path
+from functools import partial
+from contextlib import contextmanager
+
+import yaml
+import numpy as np
+
+from UltralyticsBot import PROJ_ROOT
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.msgs import ResponseMsg
+from UltralyticsBot.utils.general import ReqImage, attach_file
+from UltralyticsBot.cmds import actions
+from UltralyticsBot.cmds.actions import inference_req, process_result
+from UltralyticsBot.utils.upstream import UpstreamClient
+from UltralyticsBot.bench.stub import StubServer
+from UltralyticsBot.bench.corpus import image_corpus, response_corpus, canned_response, synth_image, SynthImage, DETECTIONS, TASKS
+
+BASELINE_FILE = PROJ_ROOT / 'cfg/bench_baseline.yaml'
+STAGES = ('fetch', 'resize', 'request', 'parse', 'render', 'encode') # in pipeline order
+TOLERANCE = 1.5 # allowed slowdown factor vs baseline before failing
+SLACK_MS = 1.0 # absolute allowance, keeps sub-millisecond stages from failing on noise
+UNPACED = {'rate':1e9, 'burst':10**9, 'retries':0} # upstream client settings without request pacing
+
+class StageTimer:
+    """Collects wall-clock duration (ms) for each named pipeline stage."""
+    def __init__(self) -> None:
+        self.times = {s:[] for s in STAGES}
+
+    @contextmanager
+    def stage(self, name:str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name].append((time.perf_counter() - t0) * 1e3)
+
+@contextmanager
+def unpaced_client():
+    """Swaps `HUB_CLIENT` for one without request pacing, so benchmark measures the pipeline and not the rate limiter."""
+    original = actions.HUB_CLIENT
+    actions.HUB_CLIENT = UpstreamClient(**UNPACED)
+    try:
+        yield
+    finally:
+        actions.HUB_CLIENT = original
+
+def run_case(server:StubServer, img:SynthImage, n_dets:int, timer:StageTimer, infer_size:int=640) -> None:
+    """Runs single image through the same steps as `/predict`, with HUB API replaced by `server`."""
+    with timer.stage('fetch'):
+        image = ReqImage(server.img_url(img.name))
+    assert not image.image_error, f"Failed to fetch or decode {img.name}"
+
+    with timer.stage('resize'):
+        infer_im, infer_data, infer_ratio = image.inference_img(infer_size)
+
+    with timer.stage('request'):
+        req = inference_req(infer_data, req2=server.endpoint(n_dets))
+        req.raise_for_status()
+
+    with timer.stage('parse'):
+        Reply = ResponseMsg(req, True, True, infer_ratio)
+
+    with timer.stage('render'):
+        anno_im, _ = Reply.start_msg(partial(process_result, img=infer_im, plot=True, class_pad=Reply.cls_pad), infer_ratio=infer_ratio)
+
+    with timer.stage('encode'):
+        _ = attach_file(anno_im)
+
+def summarize(timer:StageTimer, elapsed:float, n_cases:int) -> dict:
+    """Reduces stage timings to p50/p95 in milliseconds and overall throughput in images per second."""
+    stages = {s:{'p50':round(float(np.percentile(t, 50)), 3), 'p95':round(float(np.percentile(t, 95)), 3)} for s,t in timer.times.items() if any(t)}
+    return {'stages':stages, 'throughput':round(n_cases / elapsed, 3), 'cases':n_cases}
+
+def run_bench(rounds:int=1, infer_size:int=640, detections:tuple=DETECTIONS, warmup:int=1) -> dict:
+    """Replays the full synthetic corpus through the predict pipeline `rounds` times, returns summary."""
+    images, replies = image_corpus(), response_corpus(detections)
+    cases = [(img, n) for img in images.values() for n in detections]
+    Loggr.info(f"Benchmark running {len(cases)} cases for {rounds} round(s).")
+    
+    with StubServer(images, replies) as server, unpaced_client():
+        for img, n in cases[:warmup]:
+            run_case(server, img, n, StageTimer(), infer_size)
+
+        timer = StageTimer()
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for img, n in cases:
+                run_case(server, img, n, timer, infer_size)
+        elapsed = time.perf_counter() - t0
+    
+    return summarize(timer, elapsed, len(cases) * rounds)
+
+def load_baseline(file:Path=BASELINE_FILE) -> dict|None:
+    return yaml.safe_load(file.read_text('utf-8')) if file.exists() else None
+
+def save_baseline(results:dict, file:Path=BASELINE_FILE) -> None:
+    """Writes pipeline results to baseline file, keeping other entries (such as task reference timings)."""
+    baseline = load_baseline(file) or {}
+    baseline.update(results)
+    _ = file.write_text(yaml.safe_dump(baseline, sort_keys=False), encoding='utf-8')
+    Loggr.info(f"Saved benchmark baseline to {file.as_posix()}")
+
+def compare(results:dict, baseline:dict, tolerance:float=TOLERANCE, slack_ms:float=SLACK_MS) -> list[str]:
+    """Returns list of regressions, where stage p50/p95 exceeds baseline by more than `tolerance` or throughput drops below baseline / `tolerance`."""
+    regressions = list()
+    for s, base in baseline['stages'].items():
+        now = results['stages'].get(s)
+        if now is None:
+            continue
+        for q in ('p50', 'p95'):
+            if now[q] > (base[q] * tolerance) + slack_ms:
+                regressions.append(f"{s} {q} {now[q]:.3f} ms vs baseline {base[q]:.3f} ms")
+    if results['throughput'] < (baseline['throughput'] / tolerance):
+        regressions.append(f"throughput {results['throughput']:.3f} img/s vs baseline {baseline['throughput']:.3f} img/s")
+    return regressions
+
+def report(results:dict, baseline:dict|None=None) -> str:
+    """Formats results as fixed width table, with baseline values alongside when provided."""
+    lines = [f"{'stage'.ljust(8)} {'p50 ms'.rjust(10)} {'p95 ms'.rjust(10)} {'base p50'.rjust(10)} {'base p95'.rjust(10)}"]
+    for s, now in results['stages'].items():
+        base = (baseline or {}).get('stages', {}).get(s, {})
+        lines.append(f"{s.ljust(8)} {now['p50']:>10.3f} {now['p95']:>10.3f} {base.get('p50', float('nan')):>10.3f} {base.get('p95', float('nan')):>10.3f}")
+    lines.append(f"throughput {results['throughput']:.3f} img/s over {results['cases']} cases" + (f" (baseline {baseline['throughput']:.3f} img/s)" if baseline else ''))
+    return '\n'.join(lines)
+
+def run_task_bench(rounds:int=20, detections:tuple=DETECTIONS, tasks:tuple=TASKS, img_size:int=640) -> dict:
+    """Times `process_result` (decode, results table, and drawing) for each task, returns p50 (ms) keyed by task then number of detections."""
+    img = synth_image(img_size, img_size)
+    results = {t:{} for t in tasks}
+    for task in tasks:
+        for n in detections:
+            preds = canned_response(n, task=task)['data']
+            pad = 2 if not any(preds) else max(len(p['name']) for p in preds) + 2
+            times = list()
+            for _ in range(rounds + 1):
+                t0 = time.perf_counter()
+                _ = process_result(img, preds, True, pad, task)
+                times.append((time.perf_counter() - t0) * 1e3)
+            results[task][n] = round(float(np.percentile(times[1:], 50)), 3) # first is warmup
+    return results
+
+def compare_tasks(results:dict, reference:dict=None, tolerance:float=TOLERANCE, slack_ms:float=SLACK_MS, task_tolerance:dict=None) -> list[str]:
+    """Returns tasks and detection counts where latency exceeds detect latency by more than `tolerance`, or by more than `task_tolerance[task]` for tasks listed there (from baseline, for tasks drawing more than boxes). Compared against `reference` detect timings (from baseline) when provided, otherwise detect timings from `results`."""
+    detect = reference or results['detect']
+    task_tolerance = task_tolerance or {}
+    return [f"{task} with {n} detections {ms:.3f} ms vs detect {detect[n]:.3f} ms"
+            for task, by_n in results.items() for n, ms in by_n.items() if n in detect and ms > (detect[n] * task_tolerance.get(task, tolerance)) + slack_ms]
+
+def report_tasks(results:dict) -> str:
+    counts = list(next(iter(results.values())))
+    lines = ['task'.ljust(9) + ''.join(f"{n} dets".rjust(11) for n in counts)]
+    lines += [task.ljust(9) + ''.join(f"{by_n[n]:>11.3f}" for n in counts) for task, by_n in results.items()]
+    return '\n'.join(lines)
@@ -0,0 +1,90 @@
+"""
+Title: bench/stub.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: 
+"""
+import json
+import threading
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from UltralyticsBot.bench.corpus import SynthImage
+from UltralyticsBot.utils.lazy import lazy_import
+
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
+
+@lru_cache(maxsize=64)
+def rendition(img:SynthImage, width:int, height:int) -> bytes:
+    """Resized copy of `img` as JPEG, like Discord media proxy with `width` and `height` query values."""
+    decoded = cv.imdecode(np.frombuffer(img.data, np.uint8), cv.IMREAD_COLOR)
+    return cv.imencode('.jpg', cv.resize(decoded, (width, height), interpolation=cv.INTER_AREA))[1].tobytes()
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves corpus images with `GET /img/<name>` (resized with `?width=<W>&height=<H>`) and canned API replies with `POST /predict?dets=<N>`."""
+    server:'StubServer'
+    protocol_version = 'HTTP/1.1' # keep-alive, avoids measuring TCP setup for every request
+    disable_nagle_algorithm = True # headers and body are written separately, Nagle + delayed ACK adds ~40 ms on keep-alive connections
+
+    def log_message(self, format:str, *args) -> None:
+        ... # silence per-request logging, it would dominate timing
+
+    def send_body(self, code:int, body:bytes, content_type:str) -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        img, query = self.server.images.get(url.path.rpartition('/img/')[-1]), parse_qs(url.query)
+        if img is None:
+            self.send_body(404, b'Not Found', 'text/plain')
+        elif 'width' in query and 'height' in query:
+            self.send_body(200, rendition(img, int(query['width'][0]), int(query['height'][0])), 'image/jpeg')
+        else:
+            self.send_body(200, img.data, f"image/{img.ext.strip('.')}")
+
+    def do_POST(self):
+        _ = self.rfile.read(int(self.headers.get('Content-Length', 0))) # drain multipart body
+        query = parse_qs(urlparse(self.path).query)
+        n_dets = int(query.get('dets', ['0'])[0])
+        body = self.server.replies.get(n_dets)
+        if body is None:
+            self.send_body(400, json.dumps({'data':[], 'message':f"No canned reply for {n_dets}", 'success':False}).encode(), 'application/json')
+        else:
+            self.send_body(200, body, 'application/json')
+
+class StubServer(ThreadingHTTPServer):
+    """Local HTTP server standing in for image hosts and the Ultralytics HUB API, runs on background thread."""
+    daemon_threads = True
+
+    def __init__(self, images:dict[str, SynthImage], replies:dict[int, dict], host:str='127.0.0.1', port:int=0) -> None:
+        super().__init__((host, port), StubHandler)
+        self.images = images
+        self.replies = {n:json.dumps(r).encode() for n,r in replies.items()} # serialize once, not per request
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def img_url(self, name:str) -> str:
+        return f"{self.base_url}/img/{name}"
+
+    def endpoint(self, n_dets:int) -> str:
+        return f"{self.base_url}/predict?dets={n_dets}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='bench-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
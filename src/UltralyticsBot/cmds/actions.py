@@ -5,37 +5,64 @@ Date: 2023-10-29
 
 Requires: discord.py, pyyaml, numpy, requests, opencv-python
 """
+from __future__ import annotations
 
+import time
+import json
 import base64
+import asyncio
+from urllib.parse import urlparse
 from functools import partial
+from typing import Callable
 
 import discord
-import requests
-import numpy as np
 from discord import app_commands
 
-from UltralyticsBot import REQ_LIM, REQ_ENDPOINT, CMDS, RESPONSE_KEYS, HUB_KEY, DEFAULT_INFER, BOT_ID, OWNER_ID, GH, MODELS
-from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot import CONFIG, HUB_KEY, BOT_ID, OWNER_ID, GH, DEV_CH
+from UltralyticsBot.utils.logging import Loggr, REQUEST_ID
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.profiler import PROFILER
 from UltralyticsBot.cmds.client import MyClient
-from UltralyticsBot.utils.checks import model_chk
-from UltralyticsBot.utils.general import ReqImage, attach_file, files_age
-from UltralyticsBot.utils.plotting import nxy2xy, xcycwh2xyxy, rel_line_size, draw_all_boxes
-from UltralyticsBot.utils.msgs import IMG_ERR_MSG, API_ERR_MSG, NOT_OWNER, gen_line, ReqMessage, ResponseMsg, NEWLINE
-
+from UltralyticsBot.cmds.sync import sync_changed, format_changes
+from UltralyticsBot.utils.checks import model_chk, is_vid_link
+from UltralyticsBot.utils.general import ReqImage, bytes_file
+from UltralyticsBot.utils.upstream import UpstreamClient, UpstreamBusy
+from UltralyticsBot.utils.cache import ResultCache, NearDupIndex, cache_key, dhash
+from UltralyticsBot.utils.config import Config
+from UltralyticsBot.infer.backend import InferBackend, LocalResponse
+from UltralyticsBot.infer.hub import HUBBackend
+from UltralyticsBot.infer.local import ONNXBackend
+from UltralyticsBot.infer.batching import MicroBatcher
+from UltralyticsBot.infer.tiling import merge_tiles
+from UltralyticsBot.jobs.broker import MemoryBroker, make_broker
+from UltralyticsBot.utils.plotting import rel_line_size
+from UltralyticsBot.utils.results import decode, model_task
+from UltralyticsBot.utils.video import ClipTooLarge, fetch_clip, clip_info, sample_frames, take, inference_frame, fit, render_clip
+from UltralyticsBot.utils.msgs import IMG_ERR_MSG, API_ERR_MSG, API_BUSY_MSG, CLIP_SIZE_MSG, CLIP_ERR_MSG, CLIP_MSG, ReqMessage, ResponseMsg, NEWLINE, gen_clip_table
+from UltralyticsBot.utils.lazy import lazy_import, preload
+
+requests = lazy_import('requests')
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
+
+CFG = CONFIG.get() # at startup, for objects and commands created on import
 TEMPFILE = 'detect_res.png' # fallback
-LIMITS = {k:app_commands.Range[type(v['min']), v['min'], v['max']] for k,v in REQ_LIM.items()}
+LIMITS = {k:app_commands.Range[type(v['min']), v['min'], v['max']] for k,v in CFG.limits.items()}
 ACTIVITIES = {ki:k for ki,k in enumerate(['Reset', 'Playing', 'Streaming', 'Listening', 'Watching', 'Custom', 'Competing'],-1)}
 iACTIVITIES = {k:ki for ki,k in enumerate(['unknown','game','stream','listen','watch','custom','competing'],-1)}
+HUB_CLIENT = UpstreamClient.from_cfg(CFG.upstream)
+CLIP_SLOTS = asyncio.Semaphore(CFG.video['concurrency']) # clips processed at once, each sends up to `video.batch` frames for inference at once
 
 ###-----SUPPORT FUNCTIONS-----###
 
 def get_values(data:dict) -> list:
     """Return values for known response keys"""
-    return [data[k] for k in RESPONSE_KEYS]
+    return [data[k] for k in CONFIG.get().response]
 
-def inference_req(imgbytes:bytes, req2:str=REQ_ENDPOINT, **kwargs) -> requests.Response:
-    """Constructs JSON (as dictionary) request using image-bytes data and endpoint, will update request JSON (dictionary) with any values from `kwargs` if keywords are found in `DEFAULT_INFER` dictionary."""
-    req_dict = DEFAULT_INFER.copy()
+def inference_req(imgbytes:bytes, req2:str=None, **kwargs) -> requests.Response:
+    """Constructs JSON (as dictionary) request using image-bytes data and endpoint (configured endpoint when `None`), will update request JSON (dictionary) with any values from `kwargs` if keywords are found in default request config. Sent using `HUB_CLIENT`, which is blocking and can raise `UpstreamBusy`."""
+    req2 = req2 or CONFIG.get().endpoint
+    req_dict = CONFIG.get().default.copy()
     if any(kwargs):
         for k in kwargs:
             _ = req_dict.update({k:kwargs[k]}) if k in req_dict else None
@@ -44,43 +71,279 @@ def inference_req(imgbytes:bytes, req2:str=REQ_ENDPOINT, **kwargs) -> requests.R
     # req_dict['image'] = base64.b64encode(imgbytes).decode()
     _ = [req_dict.pop(i) for i in ["image", "key"]]
     # return requests.post(req2, json=req_dict)
-    return requests.post(req2, headers={}, data=req_dict, files={"image":imgbytes})
+    return HUB_CLIENT.post(req2, headers={}, data=req_dict, files={"image":imgbytes})
     # return req_dict # NOTE might need to change in future
 
-def process_result(img:np.ndarray, predictions:list, plot:bool, class_pad:int) -> tuple[np.ndarray, str]:
-    # Load image
+HUB_BACKEND = HUBBackend(inference_req)
+LOCAL_BACKEND = ONNXBackend.from_cfg(CFG.backend['local'])
+BATCHER = MicroBatcher.from_cfg(LOCAL_BACKEND, CFG.backend['batching']) if CFG.backend['batching']['enabled'] else None
+BROKER = make_broker(CFG.jobs) if CFG.jobs['enabled'] else None # predict commands queued for job workers
+
+def result_cache(cfg:dict) -> tuple[ResultCache|None, NearDupIndex|None]:
+    """Result cache and its near-duplicate index from `cache` config, each ``None`` when disabled."""
+    cache = ResultCache.from_cfg(cfg) if cfg['enabled'] else None
+    return cache, (NearDupIndex.from_cfg(cfg['near_dup']) if cache is not None and cfg['near_dup']['enabled'] else None)
+
+RESULT_CACHE, NEAR_DUP = result_cache(CFG.cache) # NEAR_DUP has keys of RESULT_CACHE by perceptual hash
+
+@CONFIG.subscribe
+def apply_config(old:Config, new:Config) -> None:
+    """Updates objects created from config when reloaded, settings in `config.RESTART_ONLY` are not applied."""
+    global HUB_CLIENT
+    if new.upstream != old.upstream:
+        HUB_CLIENT = UpstreamClient.from_cfg(new.upstream) # new rate limit and circuit breaker
+    if RESULT_CACHE is not None and new.cache['max_mb'] != old.cache['max_mb']:
+        RESULT_CACHE.resize(new.cache['max_mb'])
+    if BATCHER is not None:
+        BATCHER.max_batch, BATCHER.max_wait = max(int(new.backend['batching']['max_batch']), 1), new.backend['batching']['max_wait_ms'] / 1e3
+
+def pick_backend(model:str) -> InferBackend:
+    """Selects local backend when configured as default and model weights are available, otherwise HUB API."""
+    if CONFIG.get().backend['default'] == 'local' and LOCAL_BACKEND.supports(model):
+        return LOCAL_BACKEND
+    return HUB_BACKEND
+
+def prewarm_local() -> None:
+    """Imports predict dependencies and loads configured local models ahead of first request, models only when local backend is in use. Blocking, bot runs it in background thread after connecting."""
+    preload('numpy', 'cv2', 'requests')
+    if CONFIG.get().backend['default'] == 'local':
+        LOCAL_BACKEND.prewarm()
+
+async def run_inference(image:np.ndarray, imgbytes:bytes, model:str, conf:float, iou:float, size:int, **kwargs):
+    """Runs inference on backend for `model` without blocking event loop, local requests are micro-batched when enabled."""
+    backend = pick_backend(model)
+    if backend is LOCAL_BACKEND and BATCHER is not None:
+        return await BATCHER.submit(image, model, conf, iou, size)
+    return await asyncio.to_thread(backend.predict, image, imgbytes, model, conf, iou, size, **kwargs)
+
+def process_result(img:np.ndarray, predictions:list, plot:bool, class_pad:int, task:str='detect', inplace:bool=False) -> tuple[np.ndarray, str]:
+    """Decodes predictions for model `task` (detect, segment, pose, obb, classify), returns annotated image and results text. Draws on copy of `img` unless `inplace` is `True`, for when caller is last user of `img`."""
     imH, imW = img.shape[:2]
-    anno_img = np.copy(img)
-    line_size = rel_line_size(imH,imW)
+    result = decode(task, predictions, imH, imW)
+    msg = result.table(class_pad)
+    anno_img = result.draw(img if inplace else np.copy(img), rel_line_size(imH, imW)) if plot else img
+    return (anno_img, msg)
+
+def draw_result(img:np.ndarray, predictions:list, task:str='detect', inplace:bool=False) -> np.ndarray:
+    """Draws predictions for model `task` on copy of `img`, or on `img` when `inplace` is `True`."""
+    anno_img, _ = process_result(img, predictions, True, 0, task, inplace)
+    return anno_img
+
+def encode_result(img:np.ndarray, predictions:list, task:str='detect', key:str=None) -> bytes:
+    """Draws predictions on `img` and encodes as PNG, stored in `RESULT_CACHE` under `key` when provided. Blocking so run outside event loop. Only used as last step of predict, so `img` isn't copied."""
+    png = cv.imencode('.png', draw_result(img, predictions, task, inplace=True))[1].tobytes()
+    _ = RESULT_CACHE.put(key, png) if RESULT_CACHE is not None and key is not None else None
+    return png
+
+def annotate_frame(img:np.ndarray, predictions:list, task:str='detect', out_size:int=480) -> bytes:
+    """Draws predictions on `img` (in place) and encodes as JPEG scaled to fit `out_size`, so annotated clip frames are kept small until rendered. Blocking so run outside event loop."""
+    return cv.imencode('.jpeg', fit(draw_result(img, predictions, task, inplace=True), out_size), (cv.IMWRITE_JPEG_QUALITY, 90))[1].tobytes()
+
+async def cached_inference(image:np.ndarray, imgbytes:bytes, model:str, conf:float, iou:float, size:int, near_dup:bool=True, **kwargs) -> tuple[object, str]:
+    """
+    Returns inference reply from `RESULT_CACHE` for same image data and request values when available, or for near-duplicate image found by `NEAR_DUP` (predictions are fractions of image size, so boxes are rescaled to `image` when decoded), otherwise runs inference and stores successful replies. Also returns cache key for `imgbytes`. Near-duplicates are only used for whole images (`near_dup=True`), tiles of one image and consecutive clip frames look alike but have different detections.
+    """
+    key = cache_key(imgbytes, model, conf, iou, size)
+    if RESULT_CACHE is not None and (hit := await asyncio.to_thread(RESULT_CACHE.get, key)) is not None:
+        reply = json.loads(hit)
+        return LocalResponse(reply['data'], reply['message']), key
+    
+    near_dup = near_dup and NEAR_DUP is not None
+    phash, aspect = (dhash(image), image.shape[1] / image.shape[0]) if near_dup else (0, 1.0)
+    near = NEAR_DUP.find(phash, key, aspect) if near_dup else None
+    if near is not None and (hit := await asyncio.to_thread(RESULT_CACHE.get, near)) is not None:
+        METRICS.incr('cache.near_hits')
+        await asyncio.to_thread(RESULT_CACHE.put, key, hit) # exact hit next time
+        reply = json.loads(hit)
+        return LocalResponse(reply['data'], reply['message']), key
+    
+    req = await run_inference(image, imgbytes, model, conf, iou, size, **kwargs)
+    if RESULT_CACHE is not None and req.status_code == 200:
+        await asyncio.to_thread(RESULT_CACHE.put, key, json.dumps(req.json()).encode())
+        _ = NEAR_DUP.add(phash, key, aspect) if near_dup else None
+    return req, key
+
+async def tiled_inference(full_req:object, key:str, tiles:list[tuple[np.ndarray, bytes]], grid:np.ndarray, model:str, conf:float, iou:float, size:int, **kwargs) -> tuple[LocalResponse, str]:
+    """Runs inference for all `tiles` at once (HUB requests still wait for `HUB_CLIENT` rate limits) and merges detections with `full_req` reply for resized image, see `merge_tiles()`. Returns merged reply and cache key for tiled result."""
+    full_req.raise_for_status()
+    replies = await asyncio.gather(*(cached_inference(t, data, model, conf, iou, size, near_dup=False, **kwargs) for t, data in tiles))
+    for req, _ in replies:
+        req.raise_for_status()
+    METRICS.incr('predict.tiles', len(tiles))
+    with METRICS.timer('tiling.merge_ms'):
+        imH, imW = int(grid[:, 3].max()), int(grid[:, 2].max()) # last tiles end at tiled image edges
+        merged = merge_tiles(full_req.json()['data'], [req.json()['data'] for req, _ in replies], grid, imH, imW, float(iou), CONFIG.get().tiling['edge_px'])
+    return LocalResponse(merged, full_req.json()['message']), key + f":tiled{len(tiles)}"
+
+async def predict(image_url:str, dims:dict, model:str, conf:float, iou:float, size:int, show:bool, txt:bool, req2:str) -> tuple[str, Callable|None]:
+    """
+    Fetches image (`dims` are attachment height, width, size, and media proxy URL when known, resized rendition is fetched when image will be resized), runs inference (or uses cached result), and formats results. Returns reply text and function returning annotated image encoded as PNG, which is ``None`` on error or when `show=False`. Images over `tiling: min_mp` megapixels are also predicted in tiles for detect models, and animated images and videos use `predict_clip()`, when enabled. Used by predict commands and job workers.
+    """
+    if CONFIG.get().video['enabled'] and is_vid_link(image_url):
+        async with CLIP_SLOTS:
+            return await predict_clip(image_url, model, conf, iou, size, show, txt, req2)
+
+    tiling = CONFIG.get().tiling
+    tile_dims = tiling['enabled'] and model_task(model) == 'detect' and (dims.get('height') or 0) * (dims.get('width') or 0) >= tiling['min_mp'] * 1e6
+    image = await asyncio.to_thread(ReqImage, image_url, CONFIG.get().max_req / 1024 ** 2, None if tile_dims else int(size), **dims) # download and decode off event loop, tiles need native resolution
+    if image.image_error:
+        Loggr.debug(f"Issue fetching image from URL {image_url}")
+        return IMG_ERR_MSG, None
     
-    msg = ''
-    pred_boxes = np.zeros((1,5)) # x-center, y-center, width, height, class
-    # TODO add post processing based on model used Segment, Key-point, Pose, OBB
-    for p in predictions:
-        cls_name, conf, idx, *(x, y, w, h) = get_values(p)
-        x1, y1, x2, y2 = tuple(
-            nxy2xy(
-                xcycwh2xyxy(
-                    np.array((x, y, w, h))
-                    ),
-                    imH,
-                    imW
-                )
-            ) # n-xcycwh -> x1y1x2y2
-        pred_boxes = np.vstack(
-            [
-                pred_boxes,
-                np.array(
-                    (x1, y1, x2, y2, idx)
-                    )
-            ]
+    try:
+        tiled = tiling['enabled'] and model_task(model) == 'detect' and image.height * image.width >= tiling['min_mp'] * 1e6
+        max_tiles = tiling['max_tiles'] if pick_backend(model) is LOCAL_BACKEND else min(tiling['hub_tiles'], tiling['max_tiles']) # HUB tiles are rate limited requests
+        tiles, grid, _ = (await asyncio.to_thread(image.tile_imgs, int(size), tiling['overlap'], max_tiles)) if tiled else (None, None, None)
+        infer_im, infer_data, infer_ratio = await asyncio.to_thread(image.inference_img, int(size)) # resize and encode off event loop
+        req, key = await cached_inference(infer_im, infer_data, model, conf, iou, size, req2=req2)
+        if tiled:
+            req, key = await tiled_inference(req, key, tiles, grid, model, conf, iou, size, req2=req2)
+            del tiles
+        req.raise_for_status()
+        if req.status_code != 200: # Catch all other non-good return codes and make sure to reply
+            Loggr.debug(f"{API_ERR_MSG.format(req.status_code, req.reason)}")
+            return API_ERR_MSG.format(req.status_code, req.reason), None
+        
+        Reply = ResponseMsg(req, show, txt, infer_ratio, model_task(model))
+        _, text = Reply.start_msg(
+            partial(
+                process_result,
+                img=infer_im,
+                plot=False,
+                class_pad=Reply.cls_pad,
+                task=Reply.task
+                ),
+            infer_ratio=infer_ratio
             )
-        msg += gen_line(cls_name, class_pad, conf, x1, y1, x2, y2)
+        if not Reply.plot:
+            return text, None
+        png = await asyncio.to_thread(RESULT_CACHE.get, key + ':png') if RESULT_CACHE is not None else None
+        return text, ((lambda: png) if png is not None else partial(encode_result, infer_im, Reply.data, Reply.task, key + ':png'))
     
-    if plot:
-        anno_img = draw_all_boxes(anno_img, pred_boxes[1:], line_size)
+    except UpstreamBusy as e:
+        Loggr.warning(f"Inference API busy, {e}")
+        return API_BUSY_MSG, None
+
+    except requests.HTTPError as e:
+        Loggr.error(API_ERR_MSG.format(e.response.status_code, e.response.reason))
+        return API_ERR_MSG.format(e.response.status_code, e.response.reason), None
+
+    except Exception as e:
+        Loggr.error(f"Error during request: {e!r}")
+        return API_ERR_MSG.format(type(e).__name__, e), None
+
+async def predict_clip(clip_url:str, model:str, conf:float, iou:float, size:int, show:bool, txt:bool, req2:str) -> tuple[str, Callable|None]:
+    """
+    Predicts on frames sampled from animated image or video at `clip_url`, see `video` in `cfg/req.yaml`. Clip is streamed to temporary file and decoded one frame at a time, sampled frames are sent for inference `batch` at a time and only kept as small annotated JPEGs. Returns reply text with most of each class in single frame, and function returning annotated GIF (for GIF input) or video, which is ``None`` on error or when `show=False`.
+    """
+    cfg, task, name_k = CONFIG.get().video, model_task(model), CONFIG.get().response[0]
+    show = show or not txt # same as images, always reply with something
+    try:
+        path = await asyncio.to_thread(fetch_clip, clip_url, cfg['max_mb'])
+    except ClipTooLarge as e:
+        Loggr.debug(f"{e}, {clip_url}")
+        return CLIP_SIZE_MSG.format(cfg['max_mb']), None
+    except Exception as e:
+        Loggr.debug(f"Issue fetching clip from URL {clip_url}, {e!r}")
+        return IMG_ERR_MSG, None
+
+    annotated, counts, n, frames = list(), dict(), 0, None # counts is class name -> [most in single frame, frames with class]
+    try:
+        total, fps = await asyncio.to_thread(clip_info, path)
+        frames = sample_frames(path, cfg['stride'], cfg['max_frames'], cfg['scene_diff'], cfg['skip_diff'], int(fps * cfg['max_s']))
+        with METRICS.timer('clip.ms'):
+            while any(batch := await asyncio.to_thread(take, frames, cfg['batch'])):
+                prepped = await asyncio.to_thread(lambda: [inference_frame(f, int(size)) for _,f in batch])
+                replies = await asyncio.gather(*(cached_inference(im, data, model, conf, iou, size, near_dup=False, req2=req2) for im, data, _ in prepped))
+                for (idx, _), (im, _, _), (req, _) in zip(batch, prepped, replies):
+                    req.raise_for_status()
+                    preds = req.json()['data']
+                    names = [p[name_k] for p in preds]
+                    for k in set(names):
+                        c = counts.setdefault(k, [0, 0])
+                        c[0], c[1] = max(c[0], names.count(k)), c[1] + 1
+                    _ = annotated.append((idx, await asyncio.to_thread(annotate_frame, im, preds, task, cfg['out_size']))) if show else None
+                n += len(batch)
+                del batch, prepped
     
-    return (anno_img, msg)
+    except UpstreamBusy as e:
+        Loggr.warning(f"Inference API busy, {e}")
+        return API_BUSY_MSG, None
+
+    except requests.HTTPError as e:
+        Loggr.error(API_ERR_MSG.format(e.response.status_code, e.response.reason))
+        return API_ERR_MSG.format(e.response.status_code, e.response.reason), None
+
+    except cv.error as e: # corrupt or unsupported clip
+        Loggr.debug(f"Unable to decode clip from URL {clip_url}, {e!r}")
+        return CLIP_ERR_MSG, None
+
+    except Exception as e:
+        Loggr.error(f"Error during clip request: {e!r}")
+        return API_ERR_MSG.format(type(e).__name__, e), None
+    
+    finally:
+        _ = frames.close() if frames is not None else None
+        path.unlink(missing_ok=True)
+    
+    if n == 0:
+        return CLIP_ERR_MSG, None
+    METRICS.observe('clip.sampled', n)
+    text = CLIP_MSG.format(n, max(total, n)) + (NEWLINE + gen_clip_table(counts, n) if txt else '')
+    gif = urlparse(clip_url).path.lower().endswith('.gif')
+    return text, (partial(render_clip, annotated, fps, gif, cfg['upload_mb'], cfg['out_size']) if show else None)
+
+async def run_predict(**kwargs) -> tuple[str, Callable|None]:
+    """Runs `predict(**kwargs)` in this process, or as job for workers when `BROKER` is set. Returns reply text and function returning image attachment (or ``None``)."""
+    if BROKER is None:
+        text, encode = await predict(**kwargs)
+        return text, (lambda: bytes_file(encode())) if encode is not None else None
+    
+    job_id = await asyncio.to_thread(BROKER.submit, kwargs)
+    Loggr.debug(f"Queued job {job_id}") # worker logs use job ID as request ID
+    try:
+        text, png = await BROKER.wait(job_id, CONFIG.get().jobs['timeout'], CONFIG.get().jobs['poll_ms'])
+    except TimeoutError as e:
+        BROKER.cancel(job_id)
+        Loggr.warning(f"{e}")
+        return API_BUSY_MSG, None
+    return text, (partial(bytes_file, png) if png is not None else None)
+
+async def render_file(render:Callable) -> discord.File|None:
+    """Runs `render` in worker thread, returns ``None`` when it fails so reply can still be sent without image."""
+    try:
+        return await asyncio.to_thread(render)
+    except Exception as e:
+        METRICS.incr('reply.render_errors')
+        Loggr.error(f"Rendering reply image failed {e!r}")
+        return None
+
+async def send_reply(send:Callable, text:str, render:Callable|None, t0:float) -> None:
+    """
+    Replies with `text` and image attachment from `render` (when not `None`) using `send`, which takes content and keyword arguments, and should return sent message.
+
+    When `reply: progressive` is enabled in config, `text` is sent right away and message is edited with image once rendered, otherwise single reply is sent with both. When rendering fails only `text` is sent. Time to first reply and full reply (ms) from `t0` are recorded as `reply.first_ms` and `reply.full_ms`.
+    """
+    try:
+        if CONFIG.get().reply['progressive'] and render is not None:
+            sent = await send(text)
+            METRICS.observe('reply.first_ms', (time.perf_counter() - t0) * 1e3)
+            file = await render_file(render)
+            if file is None:
+                return
+            try:
+                await sent.edit(attachments=[file])
+            except discord.HTTPException as e:
+                Loggr.warning(f"Unable to add image to reply, sending separately. {e}")
+                file.reset()
+                await send(None, file=file)
+        else:
+            file = await render_file(render) if render is not None else None
+            _ = await (send(text) if file is None else send(text, file=file))
+            METRICS.observe('reply.first_ms', (time.perf_counter() - t0) * 1e3)
+    finally:
+        METRICS.observe('reply.full_ms', (time.perf_counter() - t0) * 1e3)
+        _ = PROFILER.request_done() if PROFILER.active else None
 
 def fetch_embed(embeds:dict, topic:str, sub_topic:str) -> discord.Embed:
     """Simply returns value for keys provided."""
@@ -92,49 +355,27 @@ def fetch_embed(embeds:dict, topic:str, sub_topic:str) -> discord.Embed:
 async def msg_predict(message:discord.Message):
     
     if message.content.startswith("$predict") or (BOT_ID in [m.id for m in message.mentions]):
-        text = file = None
+        t0 = time.perf_counter()
+        _ = REQUEST_ID.set(f"m{message.id}") # log records for this command, event handlers run as separate tasks
+        cfg = CONFIG.get()
         msg = ReqMessage(message)
-        image_url = msg.get_url()
         imH, imW, imSize = msg.media_info()
-
-        image = ReqImage(image_url, height=imH, width=imW, size=imSize)
-        if not image.image_error:
-        # infer_im, infer_data, infer_ratio = image.inference_img()
-
-            try:
-            # if not image.image_error:
-                infer_im, infer_data, infer_ratio = image.inference_img()
-                req = inference_req(infer_data, req2=REQ_ENDPOINT)
-                # req_d = inference_req(infer_data, req2=REQ_ENDPOINT) # NOTE may need to check request size
-                # req_sz = len(str(req_d).encode('utf-8'))
-                # if req_sz >= MAX_REQ:
-                #     reduce = (MAX_REQ - 100) / req_sz
-                #     infer_im, infer_data, infer_ratio = image.inference_img(Q=reduce)
-                req.raise_for_status()
-                Reply = ResponseMsg(req, True, False, infer_ratio)
-                file, text = Reply.start_msg(partial(process_result, img=infer_im, plot=True, class_pad=Reply.cls_pad), infer_ratio=infer_ratio)
-                file = attach_file(file)
-        
-            except requests.HTTPError:
-                Loggr.error(API_ERR_MSG.format(req.status_code, req.reason))
-                await message.reply(API_ERR_MSG.format(req.status_code, req.reason))
-
-            except Exception as e:
-                Loggr.error(f"Error during request: {e} with response {req.status_code} - {req.reason}")
-                await message.reply(API_ERR_MSG.format(e, ' '.join(['and', req.status_code, req.reason])))
-        
-        else:
-            req = file = None
-            text = IMG_ERR_MSG
-            Loggr.debug(f"Issue fetching image from URL {image_url}")
-
-        text = text if text is not None or text != '' else f"{Reply.message}\n"
-        
-        await message.reply(text, file=file)
+        text, render = await run_predict(
+            image_url=msg.get_url(),
+            dims={'height':imH, 'width':imW, 'size':imSize, 'proxy_url':msg.proxy_url},
+            model=cfg.default['model'],
+            conf=cfg.default['confidence'],
+            iou=cfg.default['iou'],
+            size=cfg.default['size'],
+            show=True,
+            txt=False,
+            req2=cfg.endpoint
+            )
+        await send_reply(message.reply, text, render, t0)
 
 ###-----Slash Commands-----###
 @app_commands.choices(
-    model=[app_commands.Choice(name=m, value=str(m).lower()) for m in MODELS]
+    model=[app_commands.Choice(name=m, value=str(m).lower()) for m in CFG.models]
 )
 @app_commands.describe(
     img_url='Valid HTTP/S link to a supported image type.',
@@ -152,78 +393,43 @@ async def im_predict(interaction:discord.Interaction,
         size:LIMITS['size']=640, # type: ignore
         model:app_commands.Choice[str]='yolov8n',
         ):
+        t0 = time.perf_counter()
+        _ = REQUEST_ID.set(f"i{interaction.id}")
         await interaction.response.defer(thinking=True) # permits longer response time
         
         model = model_chk(model.value)
-        image = ReqImage(img_url)
-        # infer_im, infer_data, infer_ratio = image.inference_img(int(size))
-        if not image.image_error:
-        
-            try:
-            # if not image.image_error:
-                infer_im, infer_data, infer_ratio = image.inference_img(int(size))
-                req = inference_req(
-                    infer_data,
-                    req2=REQ_ENDPOINT.replace("yolov8n", model.lower()),
-                    confidence=str(conf),
-                    iou=str(iou),
-                    size=str(size),
-                    model=str(model)
-                    )
-                req.raise_for_status()
-                if req.status_code != 200: # Catch all other non-good return codes and make sure to reply
-                    Loggr.debug(f"{API_ERR_MSG.format(req.status_code, req.reason)}")
-                    await interaction.followup.send(API_ERR_MSG.format(req.status_code, req.reason))
-                
-                else:
-                    Reply = ResponseMsg(req, show, True, infer_ratio)
-                    file, text = Reply.start_msg(
-                        partial(
-                            process_result, # NOTE will need to update for all model tasks
-                            img=infer_im,
-                            plot=show,
-                            class_pad=Reply.cls_pad
-                            ),
-                        infer_ratio=infer_ratio
-                        )
-                    file = attach_file(file) if show else None
-        
-            except requests.HTTPError as e:
-                Loggr.debug(f"Error during request: {e} with response {req.status_code} - {req.reason}")
-                await interaction.followup.send(API_ERR_MSG.format(req.status_code, req.reason))
-
-            except Exception as e:
-                Loggr.debug(f"Error during request: {e} with response {req.status_code} - {req.reason}")
-                await interaction.followup.send(API_ERR_MSG.format(e, ' '.join(['and', req.status_code, req.reason])))
-        
-        else:
-            req = file = None
-            text = IMG_ERR_MSG
-            Loggr.debug(f"Issue fetching image from URL {img_url}")
+        text, render = await run_predict(
+            image_url=img_url,
+            dims={},
+            model=model,
+            conf=conf,
+            iou=iou,
+            size=size,
+            show=show,
+            txt=True,
+            req2=CONFIG.get().endpoint.replace("yolov8n", model.lower())
+            )
         
-        if file is None:
-            await interaction.followup.send(content=text)
-        else:
-            await interaction.followup.send(content=text, file=file)
+        await send_reply(partial(interaction.followup.send, wait=True), text, render, t0)
 
 async def about(interaction:discord.Interaction):
-    msg = CMDS['Global']['about']['content']
+    msg = CONFIG.get().cmds['Global']['about']['content']
     await interaction.response.send_message(content=msg, suppress_embeds=True)
 
 async def commands(interaction:discord.Interaction):
-    msg = CMDS['Global']['commands']['content']
+    msg = CONFIG.get().cmds['Global']['commands']['content']
     await interaction.response.send_message(content=msg, suppress_embeds=True)
 
 async def help(interaction:discord.Interaction):
-    msg = CMDS['Global']['help']['content']
+    msg = CONFIG.get().cmds['Global']['help']['content']
     await interaction.response.send_message(content=msg, suppress_embeds=True)
     
 async def slash_example(interaction:discord.Interaction):
-    msg = CMDS['Global']['slashexample']['content']
+    msg = CONFIG.get().cmds['Global']['slashexample']['content']
     await interaction.response.send_message(content=msg, suppress_embeds=True)
 
 async def msgexample(interaction:discord.Interaction):
-    msg = CMDS['Global']['msgexample']['content']
+    msg = CONFIG.get().cmds['Global']['msgexample']['content']
     await interaction.response.send_message(content=msg, suppress_embeds=True)
 
 ###-----DEV COMMANDS-----###
@@ -253,8 +459,8 @@ class DEVMsgs:
         self.devID = devID
         self.is_dev = False
     
-    def init_cmds(self, cmd_list:list[str]=CMDS['DevMsgs']) -> None:
-        self.cmds = [c for c in cmd_list if c.startswith('$')]
+    def init_cmds(self, cmd_list:list[str]=None) -> None:
+        self.cmds = [c for c in (cmd_list or CONFIG.get().cmds['DevMsgs']) if c.startswith('$')]
     
     def verify(self) -> str|None:
         self.is_dev = self.devID == self.mesg.author.id
@@ -275,17 +481,39 @@ class DEVMsgs:
         await self.mesg.reply(response)
 
     async def cmd_sync(self, client:MyClient, *args, **kwargs):
-        """Attempts to sync commands either to server command was sent from or to all servers."""
-        target, *_ = self.mesg.guild.name if not any(args) else list(args)
+        """Attempts to sync commands either to server command was sent from or to all servers, skipped when unchanged since last sync unless `force` is included with `args`."""
+        force = 'force' in [a.lower() for a in args]
+        args = [a for a in args if a.lower() != 'force']
+        target, *_ = [self.mesg.guild.name] if not any(args) else list(args)
         guild = self.mesg.guild if not any(args) else None
         Loggr.info(f"Commands sync for {target} server(s).")
         try:
-            syncd = await client.tree.sync(guild=guild)
-            await self.mesg.reply(f"Synced commands {(NEWLINE+'- ').join([c.name for c in syncd])}")
+            changes = await sync_changed(client.tree, guild, force)
+            await self.mesg.reply(f"Commands for {target} {format_changes(changes)}")
         except Exception as e:
             Loggr.error(f"Exception {e} while syncing commands for {target}{f' with ID {guild.id}' if guild else ''}.")
             await self.mesg.reply(f"Error {e} occured while syncing, please open Issue at {GH} and include your Server-ID.")
 
+    async def profile(self, client:MyClient, *args, **kwargs):
+        """Samples stacks of all bot threads for next `N` predict requests or `T` seconds (`Ts` in `args`), whichever ends first, `profiler: requests` when neither given. Uploads collapsed stacks (for `flamegraph.pl` or speedscope.app) with summary of functions with most samples, to `DEV_CH` when `dev` is included with `args`. Job worker processes aren't sampled, which is noted in reply when jobs are enabled."""
+        cfg = CONFIG.get().profiler
+        args = [a.lower() for a in args]
+        seconds = next((float(a[:-1]) for a in args if a.endswith('s') and a[:-1].replace('.', '', 1).isdigit()), None)
+        n_requests = next((int(a) for a in args if a.isdigit()), None if seconds else cfg['requests'])
+        PROFILER.interval = cfg['interval_ms'] / 1e3
+        if not PROFILER.start(min(seconds or cfg['max_s'], cfg['max_s']), n_requests):
+            return await self.mesg.reply("Profiler already running.")
+        
+        limits = [f"next {n_requests} predict requests" if n_requests else None, f"{seconds:.0f} seconds" if seconds else None]
+        limits = ' or '.join(l for l in limits if l) + (', whichever ends first' if all(limits) else '')
+        workers = " Predict jobs run in worker processes, which aren't sampled." if BROKER is not None and not isinstance(BROKER, MemoryBroker) else ''
+        await self.mesg.reply(f"Profiling {limits}, at most {cfg['max_s']:.0f} seconds.{workers}")
+        await asyncio.to_thread(PROFILER.wait, cfg['max_s'] + 5)
+        _ = await asyncio.to_thread(PROFILER.stop)
+        summary = f"Profile {PROFILER.duration:.1f}s, {PROFILER.samples} samples.\n```\n{PROFILER.top(cfg['top'])}"[:1990] + "\n```"
+        channel = (client.get_channel(DEV_CH) if 'dev' in args else None) or self.mesg.channel # DEV_CH can be on shard in other process
+        await channel.send(summary, file=bytes_file(PROFILER.collapsed().encode(), '.folded', 'profile'))
+
     async def rm_cmd(self, client:MyClient, *args, **kwargs):
         """Attempts to remove command from server command was sent from or from all servers if `None`."""
         arg, *_ = args if any(args) else ''
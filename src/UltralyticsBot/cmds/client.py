@@ -5,50 +5,136 @@ Date: 2023-10-29
 
 Requires: discord.py
 """
+import asyncio
 import datetime
 
 import discord
 from discord import app_commands
 from discord.ext import tasks
 
-from UltralyticsBot import CMDS, DEV_CH
+from UltralyticsBot import CONFIG, DEV_CH
 from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.watchdog import WATCHDOG
+from UltralyticsBot.cmds.sync import sync_changed, format_changes
+from UltralyticsBot.utils.articles import poll_articles, new_discord_post
+from UltralyticsBot.utils.housekeeping import housekeep, DISK_LOCK
 from UltralyticsBot.utils.docs_data import docs_choices, load_docs_cache
 
 RUN_AT = datetime.time(hour=0, minute=0, second=0, tzinfo=datetime.timezone.utc) # time to refresh repo and docs
+DOCS_LAG = 300 # seconds other shard processes wait before reloading docs cache refreshed by primary
 
-class MyClient(discord.Client):
-    """Class for Discord application/bot with slash-commands, requires message content intents"""
-    def __init__(self, *, intents:discord.Intents):
-        super().__init__(intents=intents)
+def fetch_docs():
+    """Fetches docs and writes cache, while housekeeping can't remove repo clone."""
+    with DISK_LOCK:
+        return docs_choices(True)
+
+class MyClient(discord.AutoShardedClient):
+    """Class for Discord application/bot with slash-commands, requires message content intents. Runs all shards when `shard_ids` is `None`, otherwise only `shard_ids` out of `shard_count`, with `metrics_queue` receiving per-shard metrics for other process to aggregate. When `refresh_docs` is `True`, docs cache loaded at start is refreshed in background once connected."""
+    def __init__(self, *, intents:discord.Intents, shard_ids:list[int]=None, shard_count:int=None, metrics_queue=None, refresh_docs:bool=False):
+        super().__init__(intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+        self.metrics_queue = metrics_queue
+        self.refresh_on_start = refresh_docs
+        self.primary = shard_ids is None or 0 in shard_ids # refreshes docs cache shared with other processes
         self.tree = app_commands.CommandTree(self)
         self.docs_choices, self.docs_embeds = load_docs_cache()
         self.cmd_pop()
     
     async def setup(self):
-        """Sync commands, could take upto an hour to show up when bot is in lots of servers"""
+        """Sync global commands when changed since last sync, could take upto an hour to show up when bot is in lots of servers."""
         Loggr.info(f"Intitating client sync.")
-        await self.tree.sync()
+        try:
+            changes = await sync_changed(self.tree)
+            Loggr.info(f"Client sync done, {format_changes(changes)}.")
+        except Exception as e:
+            Loggr.error(f"Syncing exception {e}")
     
     async def setup_hook(self) -> None:
         # return await super().setup_hook()
         self.docs_update.start()
+        self.shard_report.start()
+        _ = asyncio.create_task(self.refresh_docs()) if self.refresh_on_start else None
+        _ = asyncio.create_task(self.setup()) if self.primary and CONFIG.get().sync['on_start'] else None
+        _ = self.articles_poll.start() if self.primary and CONFIG.get().articles['enabled'] else None
+        _ = self.housekeeping.start() if self.primary and CONFIG.get().housekeeping['enabled'] else None
+        _ = self.start_watchdog() if CONFIG.get().watchdog['enabled'] else None
+
+    def start_watchdog(self):
+        """Starts event loop watchdog with `watchdog` config, each shard process watches its own loop."""
+        wd = CONFIG.get().watchdog
+        WATCHDOG.interval, WATCHDOG.threshold, WATCHDOG.frames = wd['interval_ms'] / 1e3, wd['threshold_ms'] / 1e3, wd['frames']
+        return WATCHDOG.start()
     
+    async def refresh_docs(self):
+        """Updates Documentation commands once client is ready. Only primary process fetches docs and writes cache, others reload cache after `DOCS_LAG`."""
+        await self.wait_until_ready()
+        notice_ch = self.get_channel(DEV_CH) # None when channel is on shard in other process
+        if self.primary:
+            _ = await asyncio.to_thread(fetch_docs)
+        else:
+            await asyncio.sleep(DOCS_LAG)
+        self.docs_choices, self.docs_embeds = load_docs_cache()
+        _ = await notice_ch.send(content=f"Docs update task completed.") if notice_ch is not None else None
+
     @tasks.loop(time=RUN_AT)
     async def docs_update(self):
-        """Task loop to update Documentation commands."""
-        notice_ch = self.get_channel(DEV_CH)
+        """Task loop to update Documentation commands daily at `RUN_AT`."""
         Loggr.info(f"Running scheduled docs command.")
-        self.docs_choices, self.docs_embeds = docs_choices()
-        await notice_ch.send(content=f"Docs update task completed.")
+        await self.refresh_docs()
 
     @docs_update.before_loop
     async def before_my_task(self):
         await self.wait_until_ready()
+
+    @tasks.loop(seconds=CONFIG.get().shards['report_s'])
+    async def shard_report(self):
+        """Records latency and guild count for each shard, then sends metrics snapshot to `metrics_queue` or logs it when running in single process."""
+        for sid, latency in self.latencies:
+            METRICS.gauge(f"shard.{sid}.latency_ms", round(latency * 1e3, 3))
+        for sid in self.shards:
+            METRICS.gauge(f"shard.{sid}.guilds", sum(g.shard_id == sid for g in self.guilds))
+        
+        snap = METRICS.snapshot()
+        if self.metrics_queue is not None:
+            self.metrics_queue.put((self.shard_ids or sorted(self.shards), snap))
+        else:
+            Loggr.info(f"Shard metrics {snap}")
+
+    @tasks.loop(seconds=CONFIG.get().articles['poll_s'])
+    async def articles_poll(self):
+        """Posts articles added to feed since last poll to `articles` channel, from primary process only."""
+        try:
+            articles = await asyncio.to_thread(poll_articles)
+        except Exception as e:
+            Loggr.error(f"Articles poll failed {e!r}")
+            return
+        
+        if any(articles):
+            cid = CONFIG.get().articles['channel']
+            channel = self.get_channel(cid) or await self.fetch_channel(cid) # channel could be on shard in other process
+            for msg, embed in map(new_discord_post, articles):
+                _ = await channel.send(content=msg, embed=embed)
+
+    @tasks.loop(seconds=CONFIG.get().housekeeping['interval_s'])
+    async def housekeeping(self):
+        """Keeps local docs, article, and temporary files within disk budgets, from primary process only."""
+        try:
+            _ = await asyncio.to_thread(housekeep)
+        except Exception as e:
+            Loggr.error(f"Housekeeping failed {e!r}")
+
+    @articles_poll.before_loop
+    async def before_articles_poll(self):
+        await self.wait_until_ready()
+
+    @shard_report.before_loop
+    async def before_shard_report(self):
+        await self.wait_until_ready()
     
-    def cmd_pop(self, cmds:dict=CMDS):
-        """Populate client with commands from YAML file."""
+    def cmd_pop(self, cmds:dict=None):
+        """Populate client with commands from YAML file, uses current config when `cmds` is `None`."""
         Loggr.info(f"Populating commands to client.")
+        cmds = cmds or CONFIG.get().cmds
         for k,v in cmds['Global'].items():
             setattr(self, 'GLOBAL_'+k, self.tree.command(name=k, description=v['description']))
 
@@ -0,0 +1,81 @@
+"""
+Title: shards.py
+Author: Burhan Qaddoumi
+Date: 2023-10-29
+
+Requires: discord.py, numpy, requests
+"""
+from __future__ import annotations
+import queue
+import multiprocessing as mp
+from typing import Callable
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+requests = lazy_import('requests')
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+
+def recommended_shards(token:str, timeout:float=10.0) -> int:
+    """Number of shards Discord recommends for bot with `token`."""
+    resp = requests.get(GATEWAY_URL, headers={'Authorization':f"Bot {token}"}, timeout=timeout)
+    resp.raise_for_status()
+    return int(resp.json()['shards'])
+
+def shard_plan(total:int, processes:int) -> list[list[int]]:
+    """Splits shard IDs `0` to `total - 1` into contiguous ranges, one for each process, with no more processes than shards."""
+    return [r.tolist() for r in np.array_split(np.arange(total), min(max(processes, 1), total))]
+
+def merge_snapshots(snapshots:list[dict]) -> dict:
+    """
+    Combines `Metrics.snapshot()` from several processes. Counters are summed, gauges kept as-is since names include shard ID, timing counts summed with max of max. Percentiles can't be merged exactly, so p50 and p95 are count-weighted means of each process.
+    """
+    counters, gauges, timings = dict(), dict(), dict()
+    for snap in snapshots:
+        for k,v in snap['counters'].items():
+            counters[k] = counters.get(k, 0) + v
+        gauges.update(snap['gauges'])
+        for k,v in snap['timings'].items():
+            timings.setdefault(k, list()).append(v)
+
+    summary = dict()
+    for k,ts in timings.items():
+        n = sum(t['count'] for t in ts)
+        summary[k] = {'count':n, **{q:round(sum(t[q] * t['count'] for t in ts) / max(n, 1), 3) for q in ('p50', 'p95')}, 'max':max(t['max'] for t in ts)}
+
+    return {'counters':counters, 'gauges':gauges, 'timings':summary}
+
+def run_sharded(target:Callable, token:str, total:int|None, processes:int, report_s:float) -> None:
+    """
+    Runs `target(shard_ids, shard_count, metrics_queue)` in separate processes, one for each range from `shard_plan()`. Processes send `Metrics.snapshot()` to `metrics_queue` as `(shard_ids, snapshot)`, which are merged and logged every `report_s` seconds until all processes exit.
+    """
+    total = total or recommended_shards(token)
+    plan = shard_plan(total, processes)
+    ctx = mp.get_context('spawn') # fresh interpreter, no event loop or sockets inherited
+    metrics_q = ctx.Queue()
+    procs = [ctx.Process(target=target, args=(ids, total, metrics_q), name=f"shards-{ids[0]}-{ids[-1]}", daemon=False) for ids in plan]
+    Loggr.info(f"Starting {len(procs)} processes for {total} shards {[p.name for p in procs]}.")
+    _ = [p.start() for p in procs]
+
+    latest = dict()
+    try:
+        while any(p.is_alive() for p in procs):
+            try:
+                ids, snap = metrics_q.get(timeout=report_s)
+                latest[tuple(ids)] = snap
+            except queue.Empty:
+                continue
+            if len(latest) == len(procs):
+                Loggr.info(f"Shard metrics {merge_snapshots(list(latest.values()))}")
+                latest.clear()
+
+    except KeyboardInterrupt:
+        Loggr.info("Stopping shard processes.")
+        _ = [p.terminate() for p in procs]
+
+    finally:
+        _ = [p.join() for p in procs]
+        bad = {p.name:p.exitcode for p in procs if p.exitcode}
+        _ = Loggr.error(f"Shard processes exited with errors {bad}") if bad else None
@@ -0,0 +1,88 @@
+"""
+Title: sync.py
+Author: Burhan Qaddoumi
+Date: 2023-10-29
+
+Requires: discord.py
+"""
+import json
+import hashlib
+from pathlib import Path
+
+import discord
+from discord import app_commands
+
+from UltralyticsBot import PROJ_ROOT, CONFIG
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+
+GLOBAL = 'global' # manifest scope of commands for all servers, guild scopes use guild ID
+
+def command_hash(cmd:app_commands.Command|app_commands.Group|app_commands.ContextMenu, tree:app_commands.CommandTree) -> str:
+    """Stable hash of command definition sent to Discord when syncing, includes name, description, parameters, and choices (such as docs sections from `client.docs_choices`)."""
+    payload = json.dumps(cmd.to_dict(tree), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def tree_manifest(tree:app_commands.CommandTree, guild:discord.abc.Snowflake=None) -> dict[str, str]:
+    """Command name and hash for each command `tree.sync(guild=guild)` would send."""
+    return {c.name:command_hash(c, tree) for c in tree.get_commands(guild=guild)}
+
+def manifest_path() -> Path:
+    return PROJ_ROOT / CONFIG.get().sync['manifest']
+
+def read_manifest(file:Path=None) -> dict[str, dict[str, str]]:
+    """Last synced command hashes for each scope, empty when missing or unreadable so everything is synced again."""
+    file = Path(file or manifest_path())
+    try:
+        return json.loads(file.read_text('utf-8'))
+    except (OSError, ValueError):
+        return dict()
+
+def write_manifest(manifest:dict, file:Path=None) -> None:
+    """Replaces manifest file in single step, so interrupted writes keep previous manifest."""
+    file = Path(file or manifest_path())
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding='utf-8')
+    tmp.replace(file)
+
+def diff_manifest(old:dict[str, str], new:dict[str, str]) -> dict[str, list[str]]:
+    """Command names 'added', 'changed', and 'removed' in `new` compared to `old`, all empty when identical."""
+    return {
+        'added':sorted(new.keys() - old.keys()),
+        'changed':sorted(k for k in new.keys() & old.keys() if new[k] != old[k]),
+        'removed':sorted(old.keys() - new.keys()),
+        }
+
+def format_changes(changes:dict[str, list[str]]) -> str:
+    return ', '.join(f"{k} {v}" for k,v in changes.items() if any(v)) or 'no changes'
+
+async def sync_changed(tree:app_commands.CommandTree, guild:discord.abc.Snowflake=None, force:bool=False) -> dict[str, list[str]]:
+    """Syncs commands for `guild` (global commands when `None`) only when definitions differ from last synced manifest, or always when `force` is `True`. Returns differences, all empty when sync was skipped. Manifest is only updated after successful sync, exceptions from `tree.sync` are raised."""
+    scope = GLOBAL if guild is None else str(guild.id)
+    manifest = read_manifest()
+    current = tree_manifest(tree, guild)
+    changes = diff_manifest(manifest.get(scope, dict()), current)
+    if not force and not any(any(v) for v in changes.values()):
+        METRICS.incr('sync.skipped')
+        Loggr.info(f"Commands for {scope} unchanged since last sync, skipped.")
+        return changes
+
+    with METRICS.timer('sync.ms'):
+        _ = await tree.sync(guild=guild)
+    METRICS.incr('sync.calls')
+    manifest[scope] = current
+    write_manifest(manifest)
+    Loggr.info(f"Synced commands for {scope}, {format_changes(changes)}.")
+    return changes
+
+async def sync_all(client:discord.Client, force:bool=False) -> dict[str, dict[str, list[str]]]:
+    """Syncs global commands and commands copied to each server from earlier guild syncs (still joined), skipping any without changes. Returns differences for each synced scope."""
+    out = {GLOBAL:await sync_changed(client.tree, force=force)}
+    for scope in read_manifest().keys() - {GLOBAL}:
+        guild = client.get_guild(int(scope))
+        if guild is None:
+            continue
+        client.tree.copy_global_to(guild=guild)
+        out[scope] = await sync_changed(client.tree, guild, force)
+    return {k:v for k,v in out.items() if any(any(c) for c in v.values()) or force}
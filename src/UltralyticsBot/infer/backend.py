@@ -0,0 +1,66 @@
+"""
+Title: infer/backend.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy
+"""
+from __future__ import annotations
+import json
+from abc import ABC, abstractmethod
+
+from UltralyticsBot import CONFIG
+from UltralyticsBot.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+class LocalResponse:
+    """Stands in for ``requests.Response`` for results produced in-process, provides everything `ResponseMsg` uses."""
+    status_code = 200
+    reason = 'OK'
+    ok = True
+    headers = {}
+
+    def __init__(self, data:list[dict], message:str='Inference complete.') -> None:
+        self._reply = {'data':data, 'message':message, 'success':True}
+
+    def json(self) -> dict:
+        return self._reply
+
+    @property
+    def text(self) -> str:
+        return json.dumps(self._reply)
+
+    def raise_for_status(self) -> None:
+        ...
+
+def to_response_data(dets:np.ndarray, names:dict|list, imH:int, imW:int) -> list[dict]:
+    """Converts (N, 6) x1y1x2y2, score, class detections in pixels to list of dictionaries with configured response keys and normalized xcycwh, same as HUB API."""
+    if not len(dets):
+        return []
+    wh = (dets[:, 2:4] - dets[:, :2]) / (imW, imH)
+    xy = ((dets[:, :2] + dets[:, 2:4]) / 2) / (imW, imH)
+    cls = dets[:, 5].astype(int)
+    keys = CONFIG.get().response
+    return [dict(zip(keys, (names[c], round(float(s), 5), int(c), *(round(float(v), 5) for v in (*p, *q)))))
+            for c, s, p, q in zip(cls, dets[:, 4], xy, wh)]
+
+class InferBackend(ABC):
+    """
+    Interface for inference backends, results must match the HUB API reply so `ResponseMsg` and `process_result` work for all backends.
+
+    Methods
+    ---
+    supports(model) - Returns ``True`` when backend can run inference for `model`.
+
+    predict(image, imgbytes, model, conf, iou, size, **kwargs) - Runs inference, returns ``requests.Response`` or `LocalResponse`. Blocking, call from worker thread.
+    """
+    name = 'base'
+
+    @abstractmethod
+    def supports(self, model:str) -> bool:
+        ...
+
+    @abstractmethod
+    def predict(self, image:np.ndarray, imgbytes:bytes, model:str, conf:float, iou:float, size:int, **kwargs):
+        ...
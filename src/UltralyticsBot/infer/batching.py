@@ -0,0 +1,98 @@
+"""
+Title: infer/batching.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy
+"""
+from __future__ import annotations
+import time
+import asyncio
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+@dataclass
+class BatchItem:
+    image:np.ndarray
+    model:str
+    conf:float
+    iou:float
+    size:int
+    future:asyncio.Future = field(repr=False, default=None)
+    queued:float = field(default_factory=time.perf_counter)
+
+class MicroBatcher:
+    """
+    Groups concurrent local inference requests for the same model and size into single batched forward pass.
+
+    Attributes
+    ---
+    backend - ``ONNXBackend``
+        Backend providing `predict_batch(items)`, which returns one result per item in order.
+
+    max_batch - ``int``
+        Batch is run as soon as this many requests are waiting.
+
+    max_wait_ms - ``float``
+        Longest time (ms) first request in batch waits for others to arrive.
+
+    workers - ``int``
+        Threads running forward passes, batches beyond this queue in the executor.
+
+    Methods
+    ---
+    submit(image, model, conf, iou, size) - Coroutine, waits for batched inference result of single image.
+    """
+    def __init__(self, backend, max_batch:int=8, max_wait_ms:float=5.0, workers:int=1) -> None:
+        self.backend = backend
+        self.max_batch = max(int(max_batch), 1)
+        self.max_wait = max_wait_ms / 1e3
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+        self.pending:dict[tuple[str,int], list[BatchItem]] = dict()
+        self.timers:dict[tuple[str,int], asyncio.TimerHandle] = dict()
+
+    @classmethod
+    def from_cfg(cls, backend, cfg:dict) -> 'MicroBatcher':
+        return cls(backend, cfg['max_batch'], cfg['max_wait_ms'], cfg['workers'])
+
+    async def submit(self, image:np.ndarray, model:str, conf:float, iou:float, size:int):
+        loop = asyncio.get_running_loop()
+        key = (model.lower(), int(size))
+        item = BatchItem(image, key[0], float(conf), float(iou), key[1], loop.create_future())
+        batch = self.pending.setdefault(key, [])
+        batch.append(item)
+        
+        if len(batch) >= self.max_batch:
+            self.flush(key)
+        elif len(batch) == 1:
+            self.timers[key] = loop.call_later(self.max_wait, self.flush, key)
+        
+        return await item.future
+
+    def flush(self, key:tuple[str,int]) -> None:
+        """Sends all requests waiting for `key` as one batch to the worker."""
+        timer = self.timers.pop(key, None)
+        _ = timer.cancel() if timer is not None else None
+        batch = self.pending.pop(key, [])
+        if any(batch):
+            _ = asyncio.get_running_loop().create_task(self.run(batch))
+
+    async def run(self, batch:list[BatchItem]) -> None:
+        now = time.perf_counter()
+        waits = [(now - b.queued) * 1e3 for b in batch]
+        METRICS.observe('batch.size', len(batch))
+        _ = [METRICS.observe('batch.wait', w) for w in waits]
+        
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.backend.predict_batch, batch)
+        except Exception as e:
+            Loggr.error(f"Batched inference of {len(batch)} image(s) failed with {e!r}")
+            _ = [b.future.set_exception(e) for b in batch if not b.future.done()]
+        else:
+            _ = [b.future.set_result(r) for b,r in zip(batch, results) if not b.future.done()]
@@ -0,0 +1,28 @@
+"""
+Title: infer/hub.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy, requests
+"""
+from __future__ import annotations
+from typing import Callable
+
+from UltralyticsBot.infer.backend import InferBackend
+from UltralyticsBot.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+requests = lazy_import('requests')
+
+class HUBBackend(InferBackend):
+    """Inference using Ultralytics HUB API, `post` sends the request (see `cmds.actions.inference_req`) and receives endpoint as `req2` keyword."""
+    name = 'hub'
+
+    def __init__(self, post:Callable[..., requests.Response]) -> None:
+        self.post = post
+
+    def supports(self, model:str) -> bool:
+        return True # API decides
+
+    def predict(self, image:np.ndarray, imgbytes:bytes, model:str, conf:float, iou:float, size:int, **kwargs) -> requests.Response:
+        return self.post(imgbytes, confidence=str(conf), iou=str(iou), size=str(size), model=str(model), **kwargs)
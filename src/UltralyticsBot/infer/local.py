@@ -0,0 +1,157 @@
+"""
+Title: infer/local.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy, opencv-python, pyyaml, (optional) onnxruntime
+"""
+from __future__ import annotations
+import ast
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import yaml
+
+from UltralyticsBot import PROJ_ROOT
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.infer.registry import ModelRegistry
+from UltralyticsBot.infer.backend import InferBackend, LocalResponse, to_response_data
+from UltralyticsBot.infer.ops import letterbox, to_blob, decode_yolo, unletterbox
+from UltralyticsBot.utils.lazy import lazy_import
+
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
+ort = lazy_import('onnxruntime', optional=True) # fallback to OpenCV DNN when not installed
+
+NAMES_FILE = PROJ_ROOT / 'cfg/coco.yaml'
+
+def default_names() -> list[str]:
+    return yaml.safe_load(NAMES_FILE.read_text('utf-8'))['names']
+
+class Engine:
+    """Loaded ONNX model on CPU, using onnxruntime when available otherwise OpenCV DNN."""
+    def __init__(self, path:Path, engine:str='auto', threads:int=0) -> None:
+        self.path = Path(path)
+        self.engine = ('onnxruntime' if ort is not None else 'opencv') if engine == 'auto' else engine
+        self.names = None
+        self.input_size = None # fixed input size for static exports, otherwise None
+        self._lock = threading.Lock() # cv.dnn.Net is not safe to call from multiple threads
+        
+        if self.engine == 'onnxruntime':
+            assert ort is not None, "onnxruntime requested for local inference but is not installed."
+            opts = ort.SessionOptions()
+            opts.intra_op_num_threads = int(threads)
+            self.session = ort.InferenceSession(self.path.as_posix(), opts, providers=['CPUExecutionProvider'])
+            inp = self.session.get_inputs()[0]
+            self.input_name = inp.name
+            self.input_size = inp.shape[-1] if isinstance(inp.shape[-1], int) else None
+            self.static_batch = isinstance(inp.shape[0], int)
+            meta = self.session.get_modelmeta().custom_metadata_map # Ultralytics exports include class names
+            self.names = ast.literal_eval(meta['names']) if 'names' in meta else None
+        
+        else:
+            self.net = cv.dnn.readNetFromONNX(self.path.as_posix())
+            self.net.setPreferableBackend(cv.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv.dnn.DNN_TARGET_CPU)
+            self.static_batch = True # OpenCV DNN does not expose input shape, assume export default
+        
+        self.names = self.names or dict(enumerate(default_names()))
+
+    def forward(self, blob:np.ndarray) -> np.ndarray:
+        """Runs NCHW float32 blob through model, returns first output."""
+        if self.engine == 'onnxruntime':
+            return self.session.run(None, {self.input_name:blob})[0]
+        with self._lock:
+            self.net.setInput(blob)
+            return self.net.forward()
+
+class ONNXBackend(InferBackend):
+    """
+    Local CPU inference with ONNX exported YOLO detection models, results in same format as HUB API.
+
+    Attributes
+    ---
+    weights - ``Path``
+        Directory containing `<model>.onnx` files, for example `yolov8n.onnx`.
+
+    models - ``list[str]``
+        Lowercase model names allowed to run locally.
+
+    engine - ``str``
+        One of 'onnxruntime', 'opencv', or 'auto' (onnxruntime when installed).
+
+    threads - ``int``
+        Intra-op threads for onnxruntime, 0 lets onnxruntime decide.
+
+    registry - ``ModelRegistry``
+        Loaded models, bounded by `memory_mb` using weights file size times `overhead` as estimate for each model.
+
+    prewarm_models - ``list[str]``
+        Models to load at startup with `prewarm()`.
+    """
+    name = 'local'
+
+    def __init__(self,
+                 weights:str|Path='weights',
+                 models:list[str]=('yolov8n',),
+                 engine:str='auto',
+                 threads:int=0,
+                 memory_mb:float=1024.0,
+                 overhead:float=2.5,
+                 prewarm:list[str]=(),
+                 ) -> None:
+        weights = Path(weights)
+        self.weights = weights if weights.is_absolute() else PROJ_ROOT / weights
+        self.models = [m.lower() for m in models]
+        self.engine = engine
+        self.threads = threads
+        self.overhead = overhead
+        self.prewarm_models = [m.lower() for m in prewarm]
+        self.registry = ModelRegistry(
+            lambda m: Engine(self.weight_file(m), self.engine, self.threads),
+            lambda m: self.weight_file(m).stat().st_size * self.overhead / (1024 ** 2),
+            memory_mb
+            )
+
+    @classmethod
+    def from_cfg(cls, cfg:dict) -> 'ONNXBackend':
+        return cls(**cfg)
+
+    def weight_file(self, model:str) -> Path:
+        return self.weights / f"{model.lower()}.onnx"
+
+    def supports(self, model:str) -> bool:
+        return model.lower() in self.models and self.weight_file(model).exists()
+
+    def load(self, model:str) -> Engine:
+        return self.registry.get(model.lower())
+
+    def prewarm(self) -> None:
+        """Loads configured `prewarm_models` that have weights available, blocking."""
+        self.registry.prewarm([m for m in self.prewarm_models if self.supports(m)])
+
+    def predict(self, image:np.ndarray, imgbytes:bytes, model:str, conf:float, iou:float, size:int, **kwargs) -> LocalResponse:
+        return self.predict_batch([SimpleNamespace(image=image, model=model, conf=conf, iou=iou, size=size)])[0]
+
+    def predict_batch(self, items:list) -> list[LocalResponse]:
+        """Runs inference for items with `image`, `model`, `conf`, `iou`, and `size` attributes, all items must use same model and size. Forward pass is batched unless model was exported with fixed batch size."""
+        model, size = items[0].model.lower(), int(items[0].size)
+        engine = self.load(model)
+        with METRICS.timer('local.preprocess'):
+            boxed = [letterbox(it.image, engine.input_size or size) for it in items]
+            blob = to_blob([b[0] for b in boxed])
+        with METRICS.timer('local.forward'):
+            if engine.static_batch and len(items) > 1:
+                out = np.concatenate([engine.forward(blob[i:i + 1]) for i in range(len(items))])
+            else:
+                out = engine.forward(blob)
+        
+        replies = list()
+        with METRICS.timer('local.postprocess'):
+            for it, (_, ratio, pad), raw in zip(items, boxed, out):
+                imH, imW = it.image.shape[:2]
+                dets = decode_yolo(raw, len(engine.names), float(it.conf), float(it.iou))
+                data = to_response_data(unletterbox(dets, ratio, pad, imH, imW), engine.names, imH, imW)
+                replies.append(LocalResponse(data, f"Inference complete using local {model}."))
+        return replies
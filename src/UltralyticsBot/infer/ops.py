@@ -0,0 +1,94 @@
+"""
+Title: infer/ops.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy, opencv-python
+"""
+from __future__ import annotations
+
+from UltralyticsBot.utils.lazy import lazy_import
+
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
+
+PAD_COLOR = (114, 114, 114) # same as Ultralytics letterbox
+MAX_WH = 7680 # offset per class for batched class-aware NMS, larger than any image dimension
+
+def letterbox(img:np.ndarray, size:int=640, stride:int=32, color:tuple=PAD_COLOR) -> tuple[np.ndarray, float, tuple[float,float]]:
+    """Resizes image to fit in `size` x `size` keeping aspect ratio and pads to square, returns padded image, scale ratio, and padding (dw, dh) on each side."""
+    h, w = img.shape[:2]
+    size = int(np.ceil(size / stride) * stride)
+    r = min(size / h, size / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    if (new_w, new_h) != (w, h):
+        img = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv.copyMakeBorder(img, top, bottom, left, right, cv.BORDER_CONSTANT, value=color)
+    return img, r, (dw, dh)
+
+def to_blob(images:list[np.ndarray]) -> np.ndarray:
+    """Stacks BGR uint8 images into NCHW float32 RGB blob with values in range [0, 1]."""
+    return cv.dnn.blobFromImages(images, 1 / 255.0, swapRB=True)
+
+def xywh2xyxy(boxes:np.ndarray) -> np.ndarray:
+    """Convert center x, center y, width, height boxes (N, 4) to x1, y1, x2, y2 boxes."""
+    out = np.empty_like(boxes)
+    half = boxes[:, 2:4] / 2
+    out[:, :2] = boxes[:, :2] - half
+    out[:, 2:] = boxes[:, :2] + half
+    return out
+
+def box_iou(box:np.ndarray, boxes:np.ndarray) -> np.ndarray:
+    """IoU for single x1y1x2y2 `box` against all `boxes` (N, 4)."""
+    x1, y1 = np.maximum(box[0], boxes[:, 0]), np.maximum(box[1], boxes[:, 1])
+    x2, y2 = np.minimum(box[2], boxes[:, 2]), np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (area + areas - inter + 1e-9)
+
+def nms(boxes:np.ndarray, scores:np.ndarray, classes:np.ndarray, iou:float=0.45, max_det:int=300) -> np.ndarray:
+    """Class-aware greedy non-maximum suppression on x1y1x2y2 boxes, returns indices kept in descending score order. Classes are separated by offsetting boxes, so all classes run in one pass."""
+    if not len(boxes):
+        return np.zeros(0, np.int64)
+    shifted = boxes + (classes[:, None].astype(boxes.dtype) * MAX_WH)
+    order = np.argsort(-scores)
+    keep = list()
+    while order.size and len(keep) < max_det:
+        i, order = order[0], order[1:]
+        keep.append(i)
+        order = order[box_iou(shifted[i], shifted[order]) <= iou]
+    return np.asarray(keep, np.int64)
+
+def decode_yolo(output:np.ndarray, n_classes:int, conf:float=0.25, iou:float=0.45, max_candidates:int=3000, max_det:int=300) -> np.ndarray:
+    """Decodes single image raw YOLO output to (N, 6) array of x1, y1, x2, y2, score, class in network input pixels. Handles YOLOv8/YOLOv5u layout (4 + nc, anchors) and YOLOv5 layout (anchors, 5 + nc) with objectness."""
+    out = output.squeeze(0) if output.ndim == 3 else output
+    if out.shape[0] in (4 + n_classes, 5 + n_classes) and out.shape[1] not in (4 + n_classes, 5 + n_classes):
+        out = out.T # (anchors, 4 + nc)
+    
+    if out.shape[1] == 5 + n_classes: # objectness
+        cls_scores = out[:, 5:] * out[:, 4:5]
+    else:
+        cls_scores = out[:, 4:]
+    
+    classes = cls_scores.argmax(1)
+    scores = cls_scores[np.arange(len(cls_scores)), classes]
+    mask = scores >= conf
+    boxes, scores, classes = out[mask, :4], scores[mask], classes[mask]
+    if len(scores) > max_candidates:
+        top = np.argpartition(-scores, max_candidates)[:max_candidates]
+        boxes, scores, classes = boxes[top], scores[top], classes[top]
+    
+    boxes = xywh2xyxy(boxes)
+    keep = nms(boxes, scores, classes, iou, max_det)
+    return np.hstack([boxes[keep], scores[keep, None], classes[keep, None].astype(boxes.dtype)])
+
+def unletterbox(dets:np.ndarray, ratio:float, pad:tuple[float,float], imH:int, imW:int) -> np.ndarray:
+    """Maps x1y1x2y2 boxes from letterboxed input back to original image pixels, clipped to image bounds."""
+    out = dets.copy()
+    out[:, [0, 2]] = ((out[:, [0, 2]] - pad[0]) / ratio).clip(0, imW)
+    out[:, [1, 3]] = ((out[:, [1, 3]] - pad[1]) / ratio).clip(0, imH)
+    return out
@@ -0,0 +1,97 @@
+"""
+Title: infer/registry.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: 
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Any
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+
+class ModelRegistry:
+    """
+    Lazily loads models on first use and keeps loaded models in least-recently-used order, evicting oldest when estimated memory exceeds budget. Hits, misses, loads, evictions, load times, and resident memory are recorded in `METRICS` under `models.`.
+
+    Attributes
+    ---
+    loader - ``Callable[[str], Any]``
+        Loads and returns model (session) for model name.
+
+    sizer - ``Callable[[str], float]``
+        Returns estimated resident memory (MB) for model name, called before loading.
+
+    budget_mb - ``float``
+        Memory budget (MB) for all loaded models, the most recently used model is always kept even if over budget.
+
+    Methods
+    ---
+    get(model) - Returns loaded model, loading and evicting as needed.
+
+    prewarm(models) - Loads each of `models` ahead of first request.
+    """
+    def __init__(self, loader:Callable[[str], Any], sizer:Callable[[str], float], budget_mb:float=1024.0) -> None:
+        self.loader = loader
+        self.sizer = sizer
+        self.budget_mb = budget_mb
+        self.loaded:OrderedDict[str, tuple[Any, float]] = OrderedDict() # model: (session, MB)
+        self._lock = threading.Lock()
+        self._loading:dict[str, threading.Lock] = dict() # one lock per model, concurrent requests wait for single load
+
+    @property
+    def resident_mb(self) -> float:
+        return sum(mb for _, mb in self.loaded.values())
+
+    def get(self, model:str):
+        with self._lock:
+            if model in self.loaded:
+                METRICS.incr('models.hits')
+                self.loaded.move_to_end(model)
+                return self.loaded[model][0]
+            model_lock = self._loading.setdefault(model, threading.Lock())
+        
+        with model_lock:
+            with self._lock: # loaded by another thread while waiting
+                if model in self.loaded:
+                    METRICS.incr('models.hits')
+                    self.loaded.move_to_end(model)
+                    return self.loaded[model][0]
+            METRICS.incr('models.misses')
+            
+            mb = self.sizer(model)
+            with self._lock:
+                self.evict(reserve_mb=mb) # make room first, so peak memory stays within budget while loading
+            
+            t0 = time.perf_counter()
+            session = self.loader(model)
+            load_ms = (time.perf_counter() - t0) * 1e3
+            
+            with self._lock:
+                self.loaded[model] = (session, mb)
+                self.evict(keep=model) # other models loaded meanwhile
+            
+            METRICS.incr('models.loads')
+            METRICS.observe('models.load_ms', round(load_ms, 3))
+            METRICS.gauge('models.resident_mb', round(self.resident_mb, 1))
+            Loggr.info(f"Loaded {model} in {load_ms:.1f} ms, {self.resident_mb:.1f} of {self.budget_mb:.1f} MB budget in use.")
+            return session
+
+    def evict(self, keep:str=None, reserve_mb:float=0.0) -> None:
+        """Drops least recently used models other than `keep` until within budget with `reserve_mb` left for model about to load, must be called holding `_lock`."""
+        while self.resident_mb + reserve_mb > self.budget_mb and any(m != keep for m in self.loaded):
+            oldest = next(m for m in self.loaded if m != keep)
+            _ = self.loaded.pop(oldest)
+            METRICS.incr('models.evictions')
+            METRICS.gauge('models.resident_mb', round(self.resident_mb, 1))
+            Loggr.info(f"Evicted {oldest} from loaded models.")
+
+    def prewarm(self, models:list[str]) -> None:
+        for m in models:
+            try:
+                _ = self.get(m)
+            except Exception as e:
+                Loggr.error(f"Unable to prewarm {m}, error {e!r}")
@@ -0,0 +1,61 @@
+"""
+Title: infer/tiling.py
+Author: Burhan Qaddoumi
+Date: 2023-11-05
+
+Requires: numpy
+"""
+from __future__ import annotations
+
+from UltralyticsBot import CONFIG
+from UltralyticsBot.infer.ops import xywh2xyxy, nms
+from UltralyticsBot.infer.backend import to_response_data
+from UltralyticsBot.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def tile_starts(length:int, tile:int, step:int) -> np.ndarray:
+    """Offsets of fewest full size tiles covering `length` that are at most `step` apart, spread evenly so last tile ends at `length`."""
+    if length <= tile:
+        return np.zeros(1, np.int64)
+    return np.round(np.linspace(0, length - tile, -(-(length - tile) // step) + 1)).astype(np.int64)
+
+def tile_grid(h:int, w:int, tile:int=640, overlap:float=0.2) -> np.ndarray:
+    """Overlapping `tile` sized windows covering `h` by `w` image as (N, 4) x1y1x2y2 pixels, neighbouring tiles share `overlap` fraction of tile size."""
+    step = max(int(tile * (1 - overlap)), 1)
+    ys, xs = np.meshgrid(tile_starts(h, tile, step), tile_starts(w, tile, step), indexing='ij')
+    x1, y1 = xs.ravel(), ys.ravel()
+    return np.stack([x1, y1, np.minimum(x1 + tile, w), np.minimum(y1 + tile, h)], -1)
+
+def tile_scale(h:int, w:int, tile:int=640, overlap:float=0.2, max_tiles:int=12) -> float:
+    """Largest scale (at most `1.0`) for image to be covered by no more than `max_tiles` tiles."""
+    R = 1.0
+    while R > 0.01 and len(tile_grid(int(h * R), int(w * R), tile, overlap)) > max_tiles:
+        R *= 0.9
+    return round(R, 3)
+
+def merge_tiles(full_preds:list[dict], tile_preds:list[list[dict]], grid:np.ndarray, imH:int, imW:int, iou:float=0.45, edge_px:int=4, max_det:int=300) -> list[dict]:
+    """
+    Merges predictions for resized full image (`full_preds`) and each tile of `grid` for `imH` by `imW` image into single list of predictions, normalized to full image same as HUB API. Tile detections within `edge_px` of an edge shared with another tile are dropped since they're cut off, objects larger than tile overlap are found by full image prediction. Duplicates across tiles are removed with class-aware NMS at `iou`.
+    """
+    name_k, conf_k, cls_k, *xywh_k = CONFIG.get().response
+    boxes, scores, classes, names = list(), list(), list(), dict()
+    for preds, (x1, y1, x2, y2) in zip([full_preds, *tile_preds], [(0, 0, imW, imH), *grid.tolist()]):
+        if not any(preds):
+            continue
+        tw, th = x2 - x1, y2 - y1
+        xyxy = xywh2xyxy(np.array([[p[k] for k in xywh_k] for p in preds], np.float64) * (tw, th, tw, th)) + (x1, y1, x1, y1)
+        cut = (((xyxy[:, 0] <= x1 + edge_px) & (x1 > 0)) | ((xyxy[:, 1] <= y1 + edge_px) & (y1 > 0)) |
+               ((xyxy[:, 2] >= x2 - edge_px) & (x2 < imW)) | ((xyxy[:, 3] >= y2 - edge_px) & (y2 < imH)))
+        keep = ~cut
+        boxes.append(xyxy[keep] / (imW, imH, imW, imH)) # normalized, NMS class offsets are larger than any box
+        scores.append(np.fromiter((p[conf_k] for p in preds), np.float64, len(preds))[keep])
+        classes.append(np.fromiter((p[cls_k] for p in preds), np.int64, len(preds))[keep])
+        names.update({p[cls_k]:p[name_k] for p in preds})
+    if not boxes:
+        return []
+
+    boxes, scores, classes = np.concatenate(boxes), np.concatenate(scores), np.concatenate(classes)
+    idx = nms(boxes, scores, classes, iou, max_det)
+    dets = np.concatenate([boxes[idx] * (imW, imH, imW, imH), scores[idx, None], classes[idx, None]], -1)
+    return to_response_data(dets, names, imH, imW)
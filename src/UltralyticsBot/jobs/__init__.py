@@ -0,0 +1,5 @@
+'''
+Title: UltralyticsBot/jobs
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+'''
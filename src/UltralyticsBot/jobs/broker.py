@@ -0,0 +1,216 @@
+"""
+Title: jobs/broker.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires:
+"""
+import time
+import json
+import queue
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from multiprocessing import shared_memory, resource_tracker
+
+from UltralyticsBot import PROJ_ROOT
+
+HOST = socket.gethostname()
+POLL_S = 0.05 # worker poll interval for SQLite queue
+
+###-----SHARED MEMORY-----###
+
+def to_shm(data:bytes) -> str:
+    """Copies `data` to new shared memory block and returns its name, reader must call `from_shm()` which removes block."""
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    shm.buf[:len(data)] = data
+    name = shm.name
+    shm.close()
+    resource_tracker.unregister(shm._name, 'shared_memory') # reader unlinks, otherwise removed when this process exits
+    return name
+
+def from_shm(name:str, nbytes:int) -> bytes:
+    """Reads `nbytes` from shared memory block `name` then removes block."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:nbytes])
+    finally:
+        shm.close()
+        shm.unlink()
+
+def drop_shm(name:str) -> None:
+    try:
+        from_shm(name, 0)
+    except FileNotFoundError:
+        ...
+
+###-----BROKERS-----###
+
+class JobBroker(ABC):
+    """
+    Queue of predict jobs between gateway (bot) and inference workers.
+
+    Methods
+    ---
+    submit(args) - Queues job with keyword arguments `args` for `actions.predict()`, returns job ID.
+
+    fetch(timeout) - Claims next job as ``dict`` with 'id', 'args', and 'host' (of submitter) keys, ``None`` if none within `timeout` seconds.
+
+    finish(job_id, text, png, host) - Stores result text and annotated image PNG bytes (or ``None``) for job, `host` is submitter host from `fetch()`.
+
+    result(job_id) - Returns and removes result as (text, png) when job is done, otherwise ``None``.
+
+    cancel(job_id) - Removes job and any result, used when gateway stops waiting.
+
+    wait(job_id, timeout, poll_ms) - Coroutine polling `result()` until done, raises ``TimeoutError`` after `timeout` seconds.
+    """
+    @abstractmethod
+    def submit(self, args:dict) -> str:
+        ...
+
+    @abstractmethod
+    def fetch(self, timeout:float) -> dict|None:
+        ...
+
+    @abstractmethod
+    def finish(self, job_id:str, text:str, png:bytes|None, host:str=HOST) -> None:
+        ...
+
+    @abstractmethod
+    def result(self, job_id:str) -> tuple[str, bytes|None]|None:
+        ...
+
+    @abstractmethod
+    def cancel(self, job_id:str) -> None:
+        ...
+
+    async def wait(self, job_id:str, timeout:float, poll_ms:float=20.0) -> tuple[str, bytes|None]:
+        deadline = time.monotonic() + timeout
+        while (res := self.result(job_id)) is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No result for job {job_id} after {timeout} seconds.")
+            await asyncio.sleep(poll_ms / 1e3)
+        return res
+
+class MemoryBroker(JobBroker):
+    """In-process stand-in for tests and load testing, workers must run in same process (see `worker.start_thread_workers()`)."""
+    def __init__(self) -> None:
+        self.jobs = queue.Queue()
+        self.results = dict()
+        self.cancelled = set()
+        self._lock = threading.Lock()
+
+    def submit(self, args:dict) -> str:
+        job_id = uuid.uuid4().hex
+        self.jobs.put({'id':job_id, 'args':args, 'host':HOST})
+        return job_id
+
+    def fetch(self, timeout:float) -> dict|None:
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                job = self.jobs.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            with self._lock:
+                if job['id'] not in self.cancelled:
+                    return job
+                self.cancelled.discard(job['id'])
+        return None
+
+    def finish(self, job_id:str, text:str, png:bytes|None, host:str=HOST) -> None:
+        with self._lock:
+            if job_id in self.cancelled:
+                self.cancelled.discard(job_id)
+            else:
+                self.results[job_id] = (text, png)
+
+    def result(self, job_id:str) -> tuple[str, bytes|None]|None:
+        with self._lock:
+            return self.results.pop(job_id, None)
+
+    def cancel(self, job_id:str) -> None:
+        with self._lock:
+            if self.results.pop(job_id, None) is None:
+                self.cancelled.add(job_id)
+
+class SQLiteBroker(JobBroker):
+    """
+    Job queue in SQLite database file, shared by bot and worker processes on same host (or shared storage). Annotated images are passed through shared memory when worker runs on same host as submitter, otherwise stored in database. Jobs claimed longer than `lease_s` seconds ago without result are given to next worker, in case worker process died.
+    """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY, state TEXT NOT NULL, args TEXT NOT NULL, host TEXT NOT NULL,
+        claimed REAL, text TEXT, png BLOB, shm TEXT, nbytes INTEGER)"""
+
+    def __init__(self, path:str|Path, lease_s:float=300.0) -> None:
+        self.path = Path(path)
+        self.lease_s = lease_s
+        self._local = threading.local() # connections can't be shared across threads
+        with self.conn() as db:
+            _ = db.execute("PRAGMA journal_mode=WAL")
+            _ = db.execute(self.SCHEMA)
+            _ = db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    def conn(self) -> sqlite3.Connection:
+        if getattr(self._local, 'db', None) is None:
+            self._local.db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None) # autocommit, transactions are explicit
+        return self._local.db
+
+    def submit(self, args:dict) -> str:
+        job_id = uuid.uuid4().hex
+        _ = self.conn().execute("INSERT INTO jobs (id, state, args, host) VALUES (?, 'queued', ?, ?)", (job_id, json.dumps(args), HOST))
+        return job_id
+
+    def _claim(self) -> dict|None:
+        db = self.conn()
+        now = time.time()
+        _ = db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, args, host FROM jobs WHERE state = 'queued' OR (state = 'running' AND claimed < ?) ORDER BY rowid LIMIT 1",
+                (now - self.lease_s,)).fetchone()
+            if row is not None:
+                _ = db.execute("UPDATE jobs SET state = 'running', claimed = ? WHERE id = ?", (now, row[0]))
+            _ = db.execute("COMMIT")
+        except Exception:
+            _ = db.execute("ROLLBACK")
+            raise
+        return None if row is None else {'id':row[0], 'args':json.loads(row[1]), 'host':row[2]}
+
+    def fetch(self, timeout:float) -> dict|None:
+        deadline = time.monotonic() + timeout
+        while (job := self._claim()) is None and time.monotonic() < deadline:
+            time.sleep(POLL_S)
+        return job
+
+    def finish(self, job_id:str, text:str, png:bytes|None, host:str=HOST) -> None:
+        shm = to_shm(png) if png is not None and host == HOST else None
+        cur = self.conn().execute(
+            "UPDATE jobs SET state = 'done', text = ?, png = ?, shm = ?, nbytes = ? WHERE id = ? AND state = 'running'",
+            (text, None if shm else png, shm, len(png) if png is not None else None, job_id))
+        if cur.rowcount == 0 and shm is not None: # cancelled while running
+            drop_shm(shm)
+
+    def result(self, job_id:str) -> tuple[str, bytes|None]|None:
+        db = self.conn()
+        row = db.execute("SELECT text, png, shm, nbytes FROM jobs WHERE id = ? AND state = 'done'", (job_id,)).fetchone()
+        if row is None:
+            return None
+        _ = db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        text, png, shm, nbytes = row
+        return text, (from_shm(shm, nbytes) if shm else png)
+
+    def cancel(self, job_id:str) -> None:
+        db = self.conn()
+        row = db.execute("SELECT shm FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        _ = db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        _ = drop_shm(row[0]) if row is not None and row[0] else None
+
+def make_broker(cfg:dict) -> JobBroker:
+    """Creates broker from `jobs` section of `cfg/req.yaml`."""
+    assert cfg['broker'] in ('memory', 'sqlite'), f"Unknown job broker {cfg['broker']!r}, expected 'memory' or 'sqlite'."
+    return MemoryBroker() if cfg['broker'] == 'memory' else SQLiteBroker(PROJ_ROOT / cfg['path'], cfg['lease_s'])
@@ -0,0 +1,75 @@
+"""
+Title: jobs/worker.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires:
+"""
+import asyncio
+import threading
+import multiprocessing as mp
+
+from UltralyticsBot import CONFIG
+from UltralyticsBot.cmds import actions
+from UltralyticsBot.utils.logging import Loggr, REQUEST_ID
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.msgs import API_ERR_MSG
+from UltralyticsBot.utils.upstream import UpstreamClient
+from UltralyticsBot.jobs.broker import JobBroker, make_broker
+
+FETCH_S = 1.0 # longest wait for job before checking stop event
+
+async def handle(broker:JobBroker, job:dict) -> None:
+    """Runs predict for `job` and stores result text with annotated image PNG."""
+    _ = REQUEST_ID.set(job['id'])
+    try:
+        with METRICS.timer('jobs.run_ms'):
+            text, encode = await actions.predict(**job['args'])
+            png = (await asyncio.to_thread(encode)) if encode is not None else None
+    except Exception as e:
+        Loggr.error(f"Job {job['id']} failed {e!r}")
+        text, png = API_ERR_MSG.format(type(e).__name__, e), None
+
+    broker.finish(job['id'], text, png, job['host'])
+    METRICS.incr('jobs.done')
+
+async def work(broker:JobBroker, concurrency:int, stop:threading.Event) -> None:
+    """Runs up to `concurrency` jobs at once from `broker` until `stop` is set."""
+    async def runner():
+        while not stop.is_set():
+            job = await asyncio.to_thread(broker.fetch, FETCH_S)
+            if job is not None:
+                await handle(broker, job)
+
+    await asyncio.gather(*(runner() for _ in range(concurrency)))
+
+def shared_client(upstream:dict, share:int) -> UpstreamClient:
+    """Client with `1 / share` of Inference API rate limit from `upstream` config."""
+    return UpstreamClient.from_cfg({**upstream, 'rate':upstream['rate'] / share, 'burst':max(upstream['burst'] // share, 1)})
+
+def worker_main(cfg:dict, share:int=1, stop=None, cache:dict=None, upstream:dict=None) -> None:
+    """Worker process entry, creates own broker connection from `cfg` (`jobs` section of `cfg/req.yaml`) and loads local models before taking jobs. Each of `share` workers on this host gets equal part of Inference API rate limit, also after config reload. `cache` and `upstream` replace configured sections when given, used by load test."""
+    if cache is not None:
+        actions.RESULT_CACHE, actions.NEAR_DUP = actions.result_cache(cache)
+    actions.HUB_CLIENT = shared_client(upstream or CONFIG.get().upstream, share)
+    _ = CONFIG.subscribe(lambda old, new: setattr(actions, 'HUB_CLIENT', shared_client(new.upstream, share)) if new.upstream != old.upstream and upstream is None else None)
+    _ = CONFIG.watch(CONFIG.get().hot_reload['watch_s'])
+    broker = make_broker(cfg)
+    actions.prewarm_local()
+    Loggr.info(f"Job worker {mp.current_process().name} running {cfg['concurrency']} jobs at once.")
+    asyncio.run(work(broker, cfg['concurrency'], stop or threading.Event()))
+
+def start_process_workers(cfg:dict, processes:int, cache:dict=None, upstream:dict=None) -> list[mp.Process]:
+    """Starts `processes` worker processes for SQLite broker, all processes are stopped when parent exits. Workers use `cache` and `upstream` config instead of configured sections when given."""
+    assert cfg['broker'] != 'memory', "Worker processes can't use in-memory broker, use `start_thread_workers()`."
+    ctx = mp.get_context('spawn')
+    procs = [ctx.Process(target=worker_main, args=(cfg, processes, None, cache, upstream), name=f"job-worker-{i}", daemon=True) for i in range(processes)]
+    _ = [p.start() for p in procs]
+    return procs
+
+def start_thread_workers(broker:JobBroker, concurrency:int) -> tuple[threading.Thread, threading.Event]:
+    """Runs worker in background thread with own event loop in this process, for in-memory broker. Returns thread and event which stops it when set."""
+    stop = threading.Event()
+    thread = threading.Thread(target=asyncio.run, args=(work(broker, concurrency, stop),), name='job-worker', daemon=True)
+    thread.start()
+    return thread, stop
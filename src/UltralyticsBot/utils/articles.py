@@ -3,17 +3,24 @@ Title: articles.py
 Author: Burhan Qaddoumi
 Date: 2023-11-04
 
-Requires: discord.py, pyyaml, requests
+Requires: discord.py, requests
 """
-
-import datetime
+from __future__ import annotations
+import json
+import time
 from pathlib import Path
 from html.parser import HTMLParser
 from html.entities import name2codepoint
 from xml.etree import ElementTree as et
 
-import requests
-import yaml
+import discord
+
+from UltralyticsBot import PROJ_ROOT, CONFIG
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.lazy import lazy_import
+
+requests = lazy_import('requests')
 
 class MyHTMLParser(HTMLParser):
     def __init__(self, *, convert_charrefs: bool = True) -> None:
@@ -61,23 +68,24 @@ def get_intro(text:list) -> str:
     """Keeps first few sentences of content as preview, removes any 'Figure' description sentences and undesirable characters."""
     return '. '.join([s for s in ' '.join(text[:2]).split('. ') if 'Fig' not in s]).replace(FILTER, ' ')
 
-def new_discord_post(new_data:dict):
-    """When new article data found, generate and send a new Discord post."""
-    ...
-
-thrsh = 5
-articles = dict()
-run_update = False
-TODAY = datetime.datetime.now().date()
-SAVE_FORMAT = "{}_Medium_Articles.yaml"
-SAVE_PATH = Path.home() / 'Medium_Publications'
-URL = "https://ultralytics.medium.com/feed" # RSS like feed
+def new_discord_post(article:dict) -> tuple[str, discord.Embed]:
+    """Message content and embed for new `article` from `parse_article()`."""
+    embed = discord.Embed(title=article['title'],
+                          description=article['description'],
+                          colour=15665350, # same as docs embeds
+                          url=article['url'],)
+    _ = embed.set_author(name=article['author']) if article['author'] else None
+    _ = embed.set_image(url=article['image_url']) if article['image_url'] else None
+    return article['msg'], embed
+
 FILTER = u'\xa0' # non-breaking space, replace with ' ' character
+SEEN_MAX = 200 # GUIDs kept in seen-index, feed only lists recent articles
 
-form = dict(msg=None, title=None, description=None, url=None, image_url=None) # similar to discordEmbed
+form = dict(msg=None, title=None, description=None, url=None, image_url=None, author=None) # similar to discordEmbed
 
 tags = {'item':
-        {'msg':'title', # Use as 'content' for discord.Embed
+        {'guid':'guid',
+         'msg':'title', # Use as 'content' for discord.Embed
          'url':'link',
          'author':'{http://purl.org/dc/elements/1.1/}creator',
          'title':'pubDate', # Use publish data for 'title' of discord.Embed
@@ -85,42 +93,79 @@ tags = {'item':
          }
         }
 
-for iy,y in enumerate(SAVE_PATH.glob(f"*.yaml")):
-    last_chk = datetime.date.fromisoformat(y.stem.split('_')[0])
-    dT = TODAY - last_chk
-    run_update = dT.days >= thrsh
-
-    if run_update:
-        previous = yaml.safe_load(y.read_text('utf-8'))
-        break
-
-if run_update:
-    save_file = (Path.home() / SAVE_FORMAT.format(last_chk.isoformat()))
-    
-    data = requests.get(URL)
+###-----FEED STATE-----###
+
+def read_state(file:Path) -> dict:
+    """Feed state saved by `poll_articles()`, 'etag' and 'modified' validators for conditional requests and 'seen' GUIDs newest first. Empty when missing or unreadable."""
+    try:
+        return json.loads(Path(file).read_text('utf-8'))
+    except (OSError, ValueError):
+        return dict()
+
+def write_state(file:Path, state:dict) -> None:
+    file = Path(file)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_suffix('.tmp')
+    tmp.write_text(json.dumps(state, indent=2), encoding='utf-8')
+    tmp.replace(file)
+
+###-----FEED PARSING-----###
+
+def iter_items(stream) -> dict:
+    """Yields text of `tags['item']` for each feed item while `stream` (file-like) is read, so parsing stops reading when caller stops iterating. Items are cleared after use."""
+    for _, elem in et.iterparse(stream, events=('end',)):
+        if elem.tag != 'item':
+            continue
+        yield {t:elem.findtext(v) for t,v in tags['item'].items()}
+        elem.clear()
+
+def new_items(stream, seen:set[str]) -> list[dict]:
+    """Feed items newer than first already seen GUID, newest first, feed is expected to list newest items first."""
+    out = list()
+    for item in iter_items(stream):
+        guid = item['guid'] or item['url']
+        if guid in seen:
+            break
+        out.append({**item, 'guid':guid})
+    return out
+
+def parse_article(item:dict) -> dict:
+    """Article from feed `item` with preview text and first image from HTML content."""
+    parser = MyHTMLParser()
+    parser.feed(item['content'] or '')
+    article = {k:item[k] for k in form.keys() if k in item}
+    article['description'] = get_intro(parser.data)
+    article['image_url'] = next(iter(parser.fig), None)
+    return {**form, **article}
+
+###-----POLLING-----###
+
+def poll_articles(url:str=None, state_file:Path=None, timeout:float=None) -> list[dict]:
+    """Fetches feed at `url` with conditional request using validators from `state_file`, returns articles not seen before, oldest first. When nothing changed, the server replies 304 without feed. First poll only records seen items so existing articles aren't posted. Defaults from `articles` section of `cfg/req.yaml`."""
+    cfg = CONFIG.get().articles
+    url, timeout = url or cfg['url'], timeout or cfg['timeout_s']
+    state_file = state_file or PROJ_ROOT / cfg['state']
+    state = read_state(state_file)
+    headers = {k:v for k,v in [('If-None-Match', state.get('etag')), ('If-Modified-Since', state.get('modified'))] if v}
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 304:
+            METRICS.incr('articles.not_modified')
+            return list()
+        resp.raise_for_status()
+        resp.raw.decode_content = True # gzip
+        items = new_items(resp.raw, set(state.get('seen', list())))
+        validators = {'etag':resp.headers.get('ETag'), 'modified':resp.headers.get('Last-Modified')}
+
+    first = 'seen' not in state
+    seen = [i['guid'] for i in items] + state.get('seen', list())
+    write_state(state_file, {**validators, 'seen':seen[:SEEN_MAX], 'checked':time.time()})
+    METRICS.incr('articles.fetched')
+    if first:
+        Loggr.info(f"Recorded {len(items)} existing articles from {url}, only newer articles will be posted.")
+        return list()
     
-    xml = et.XML(data.text)
-    CHANNEL = next(xml.iterfind('channel'))
-
-    for n,i in enumerate(CHANNEL.findall('item')):
-        parser = MyHTMLParser()
-        n_article = form.copy()
-
-        content = {t:next(i.iterfind(v)).text for t,v in tags['item'].items()}
-        parser.feed(content['content'])
-        
-        n_article.update({k:content[k] for k in form.keys() if k in content})
-        n_article['description'] = get_intro(parser.data)
-        n_article['image_url'] = parser.fig[0]
-
-        articles.update({n:n_article})
-
-        new = articles == previous
-        if new:
-            f"No new articles found on {TODAY.isoformat()}" if new else f"New content found {TODAY.isoformat()}."
-            
-            new_discord_post(articles) # TODO finish writing this function
-
-else:
-    f"Only {dT.days} passed since previous update cycle, skipping."
-
+    articles = [parse_article(i) for i in reversed(items)]
+    _ = Loggr.info(f"New articles found {[a['msg'] for a in articles]}.") if any(articles) else None
+    METRICS.incr('articles.new', len(articles))
+    return articles
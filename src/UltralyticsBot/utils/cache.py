@@ -0,0 +1,234 @@
+"""
+Title: utils/cache.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy, opencv-python
+"""
+from __future__ import annotations
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from UltralyticsBot import PROJ_ROOT
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.lazy import lazy_import
+
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
+
+def cache_key(data:bytes, *params) -> str:
+    """Content hash of `data` with `params` (model, thresholds, size, etc.) appended."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest() + ':' + ':'.join(str(p) for p in params)
+
+def dhash(image:np.ndarray) -> int:
+    """64-bit difference hash of BGR or grayscale `image`, each bit is whether pixel of 9x8 grayscale thumbnail is brighter than its left neighbour. Unchanged by rescaling and most recompression, but not by rotation or large crops. Flat images hash to `0`."""
+    step = max(min(image.shape[:2]) // 64, 1) # every n-th pixel is enough for 9x8 thumbnail, ~20x faster than averaging all
+    small = np.ascontiguousarray(image[::step, ::step])
+    small = cv.cvtColor(small, cv.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    small = cv.resize(small, (9, 8), interpolation=cv.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), 'big')
+
+class NearDupIndex:
+    """
+    In-memory multi-index hash table of `dhash()` for recent requests, finds cache key of earlier request for near-duplicate image (screenshot, recompressed, rescaled) with same request values. Hashes are split into `max_dist + 1` chunks, so any hash within `max_dist` bits has at least one identical chunk and only entries sharing a chunk are compared. Holds at most `max_entries`, oldest are removed first.
+
+    Methods
+    ---
+    add(phash, key, aspect) - Indexes cache `key` (from `cache_key()`) for image with hash `phash` and `aspect` (width / height).
+
+    find(phash, key, aspect) - Returns indexed key with same request values as `key` for closest hash within `max_dist` bits and aspect within `aspect_tol`, otherwise ``None``.
+    """
+    def __init__(self, max_dist:int=4, max_entries:int=10000, aspect_tol:float=0.03) -> None:
+        self.max_dist, self.max_entries, self.aspect_tol = max_dist, max_entries, aspect_tol
+        self.bounds = [(i * 64 // (max_dist + 1), (i + 1) * 64 // (max_dist + 1)) for i in range(max_dist + 1)]
+        self.entries = OrderedDict() # key -> (hash, aspect)
+        self.buckets = dict() # (request values, chunk index, chunk value) -> keys
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_cfg(cls, cfg:dict) -> 'NearDupIndex':
+        return cls(cfg['max_dist'], cfg['max_entries'], cfg['aspect_tol'])
+
+    def _chunks(self, phash:int, params:str) -> list[tuple[str, int, int]]:
+        return [(params, i, (phash >> lo) & ((1 << (hi - lo)) - 1)) for i, (lo, hi) in enumerate(self.bounds)]
+
+    def add(self, phash:int, key:str, aspect:float) -> None:
+        if not phash:
+            return
+        with self._lock:
+            _ = self._remove(key) if key in self.entries else None
+            self.entries[key] = (phash, aspect)
+            for c in self._chunks(phash, key.partition(':')[2]):
+                self.buckets.setdefault(c, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key:str) -> None:
+        phash, _ = self.entries.pop(key)
+        for c in self._chunks(phash, key.partition(':')[2]):
+            bucket = self.buckets.get(c)
+            _ = bucket.discard(key) if bucket is not None else None
+            _ = self.buckets.pop(c) if bucket is not None and not bucket else None
+
+    def find(self, phash:int, key:str, aspect:float) -> str|None:
+        if not phash:
+            return None
+        best, best_d = None, self.max_dist + 1
+        with self._lock:
+            for c in self._chunks(phash, key.partition(':')[2]):
+                for k in self.buckets.get(c, ()):
+                    h, a = self.entries[k]
+                    d = (h ^ phash).bit_count()
+                    if d < best_d and abs(a - aspect) <= self.aspect_tol * aspect:
+                        best, best_d = k, d
+        return best
+
+class ResultCache:
+    """
+    Size-bounded on-disk cache in SQLite database file, kept across restarts. Writes use write-ahead log so entries are either fully written or absent after crash. File is opened on first use, which only reads total size, least recently used entries are removed by background thread when over `max_mb`, which also checkpoints the log and returns free pages to disk.
+
+    Attributes
+    ---
+    path - ``pathlib.Path``
+        Database file.
+
+    max_bytes - ``int``
+        Size budget for stored values.
+
+    total - ``int``
+        Current size of stored values in bytes.
+
+    Methods
+    ---
+    get(key) - Returns stored ``bytes`` for `key` or ``None``, marks entry as recently used.
+
+    put(key, value) - Stores ``bytes`` for `key`, replacing existing.
+
+    compact() - Removes least recently used entries until within budget, then checkpoints and vacuums free pages. Run every `compact_s` seconds and whenever budget is exceeded.
+
+    resize(max_mb) - Changes size budget, compacting when now over budget.
+
+    close() - Stops background compaction.
+    """
+    SCHEMA = "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+
+    def __init__(self, path:str|Path, max_mb:float=512.0, compact_s:float=600.0) -> None:
+        self.path = Path(path)
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self._local = threading.local() # connections can't be shared across threads
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._opened = False
+        self.total = 0
+        self._thread = threading.Thread(target=self._compactor, args=(compact_s,), name='cache-compact', daemon=True)
+
+    @classmethod
+    def from_cfg(cls, cfg:dict) -> 'ResultCache':
+        return cls(PROJ_ROOT / cfg['path'], cfg['max_mb'], cfg['compact_s'])
+
+    def conn(self) -> sqlite3.Connection:
+        if getattr(self._local, 'db', None) is None:
+            _ = self.path.parent.mkdir(parents=True, exist_ok=True) if not self._opened else None
+            self._local.db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None) # autocommit, each statement is own transaction
+            _ = self._local.db.execute("PRAGMA synchronous=NORMAL") # with WAL, last writes may be lost on power failure but never corrupted
+            _ = self._open(self._local.db) if not self._opened else None
+        return self._local.db
+
+    def _open(self, db:sqlite3.Connection) -> None:
+        """Creates table and starts background compaction, once on first connection so creating cache has no side effects."""
+        with self._lock:
+            if self._opened:
+                return
+            _ = db.execute("PRAGMA auto_vacuum=INCREMENTAL") # only applies when creating new file
+            _ = db.execute("PRAGMA journal_mode=WAL")
+            _ = db.execute(self.SCHEMA)
+            _ = db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+            self.total = db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            self._opened = True
+        Loggr.info(f"Opened result cache {self.path.as_posix()} with {self.total / 1024 ** 2:.1f} MB stored.")
+        self._thread.start()
+
+    @staticmethod
+    @contextmanager
+    def transaction(db:sqlite3.Connection):
+        """Write transaction, rolled back when exception is raised."""
+        _ = db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            _ = db.execute("ROLLBACK")
+            raise
+        _ = db.execute("COMMIT")
+
+    def get(self, key:str) -> bytes|None:
+        db = self.conn()
+        row = db.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            METRICS.incr('cache.misses')
+            return None
+        _ = db.execute("UPDATE cache SET used = ? WHERE key = ?", (time.time(), key))
+        METRICS.incr('cache.hits')
+        return row[0]
+
+    def put(self, key:str, value:bytes) -> None:
+        db = self.conn()
+        with self.transaction(db):
+            old = db.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            _ = db.execute("INSERT OR REPLACE INTO cache (key, value, size, used) VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+        with self._lock:
+            self.total += len(value) - (old[0] if old else 0)
+            over = self.total > self.max_bytes
+        _ = self._wake.set() if over else None
+
+    def compact(self) -> int:
+        """Returns number of entries removed."""
+        db = self.conn()
+        removed = 0
+        with self._lock: # other processes (job workers) may share file, recount
+            self.total = db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            excess = self.total - self.max_bytes
+        if excess > 0: # oldest entries with sizes adding up to excess
+            with self.transaction(db):
+                rows = db.execute(
+                    "SELECT key, size FROM (SELECT key, size, SUM(size) OVER (ORDER BY used) AS run FROM cache) WHERE run - size < ?",
+                    (excess,)).fetchall()
+                _ = db.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k, _ in rows])
+            removed = len(rows)
+            with self._lock:
+                self.total -= sum(s for _, s in rows)
+            METRICS.incr('cache.evictions', removed)
+
+        _ = db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        _ = db.execute("PRAGMA incremental_vacuum")
+        METRICS.gauge('cache.mb', round(self.total / 1024 ** 2, 3))
+        return removed
+
+    def resize(self, max_mb:float) -> None:
+        with self._lock:
+            self.max_bytes = int(max_mb * 1024 ** 2)
+            over = self.total > self.max_bytes
+        _ = self._wake.set() if over else None
+
+    def _compactor(self, interval:float) -> None:
+        while not self._stop.is_set():
+            _ = self._wake.wait(interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                removed = self.compact()
+                _ = Loggr.debug(f"Result cache compacted, removed {removed} entries.") if removed else None
+            except sqlite3.Error as e:
+                Loggr.warning(f"Result cache compaction failed {e!r}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        _ = self._thread.join() if self._thread.is_alive() else None
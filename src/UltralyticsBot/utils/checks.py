@@ -11,9 +11,10 @@ from urllib.parse import urlparse
 
 # from UltralyticsBot import YOLOv5_REGEX, YOLOv8_REGEX # NOTE possibly for future use
 
-MODEL_RGX = r'((yolov)(5|8)(n|s|m|l|x))'
+MODEL_RGX = r'((yolov)(5|8)(n|s|m|l|x)(-cls|-seg|-pose|-obb)?)' # task suffix only valid for YOLOv8
 URL_RGX = r"((http[s]?:\/\/)|(www))?[.]?([a-zA-Z0-9\-]+([.][a-zA-Z0-9\-]{2,63})+)([/]+[a-zA-Z0-9?$&;^~=+!,:@\-#._]*(%[0-9a-fA-F]{2})*[a-zA-Z0-9?$&;^~=+!,:@\-#._]*)*" # https://regex101.com/r/VzFmEN/2 NOTE captures most but not all URLs, anywhere in text
 IMG_EXT = ('.bmp', '.png', '.jpeg', '.jpg', '.tif', '.tiff', '.webp') # reference docs.ultralytics.com/modes/predict/#images, skipping (.mpo, .dng, .pfm)
+VID_EXT = ('.gif', '.mp4', '.mov', '.webm', '.mkv', '.avi') # animated images and videos, sampled frames are used for inference
 
 def is_link(text:str) -> bool:
     """Verify if string is a valid URL with regex and urlparse, loose-checker and could still fail."""
@@ -27,12 +28,16 @@ def is_img_link(text:str,w_ext:bool=False) -> bool|tuple[bool,str|None]:
     else:
         return is_link(text) and any(tuple(re.search(rf'({e})', text, re.IGNORECASE) for e in IMG_EXT))
 
+def is_vid_link(text:str) -> bool:
+    """Verifies string is both valid URL and contains a supported animated image or video file extension."""
+    return is_link(text) and any(re.search(rf'({re.escape(e)})\b', text, re.IGNORECASE) for e in VID_EXT)
+
 def model_chk(model_str:str) -> str:
     """Checks that model provided is conforms to standard string format, will default to YOLOv8 model if not valid version provided, and defaults to nano size if no valid model size provided."""
     if not is_link(model_str): # TODO add check for valid HUB link
         full = re.match(MODEL_RGX, model_str.lower(), re.IGNORECASE)
         if full:
-            out = full.group().lower()
+            out = full.group().lower() if full.group(3) == '8' else full.group().lower().split('-')[0]
         elif not full:
             try:
                 num = re.search(r'\d', model_str).group()
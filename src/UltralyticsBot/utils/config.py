@@ -0,0 +1,292 @@
+"""
+Title: utils/config.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: pyyaml
+"""
+import time
+import threading
+from pathlib import Path
+from typing import Callable
+from dataclasses import dataclass, fields, replace
+
+import yaml
+
+from UltralyticsBot.utils.logging import Loggr
+
+# Changes to these settings (or anything under them) are only used after restart, since they are read when creating clients, workers, or commands
+RESTART_ONLY = ('response', 'limits', 'models', 'backend.local', 'backend.batching.enabled', 'backend.batching.workers', 'cache.enabled',
+                'cache.path', 'cache.compact_s', 'cache.near_dup', 'jobs.enabled', 'jobs.broker', 'jobs.path', 'jobs.workers', 'jobs.concurrency', 'jobs.lease_s',
+                'shards', 'hot_reload', 'sync.on_start', 'articles.enabled', 'articles.poll_s',
+                'housekeeping.enabled', 'housekeeping.interval_s', 'video.concurrency', 'watchdog')
+
+class ConfigError(Exception):
+    """Raised when config files can't be read or have invalid values, current config is kept."""
+
+class FrozenDict(dict):
+    """Read-only ``dict`` for config sections. Copies made with `copy()`, `dict(d)`, or `{**d}` are regular dictionaries."""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Config values are read-only, change config files and reload instead.")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __reduce__(self): # picklable for worker processes
+        return FrozenDict, (dict(self),)
+
+def freeze(obj):
+    """Recursively converts dictionaries to ``FrozenDict`` and lists to ``tuple``."""
+    if isinstance(obj, dict):
+        return FrozenDict({k:freeze(v) for k,v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+def flatten(obj, prefix:str='') -> dict:
+    """Dotted key paths to leaf values of nested dictionaries, `cmds` is kept as single value."""
+    if not isinstance(obj, dict) or prefix == 'cmds':
+        return {prefix:obj}
+    out = dict()
+    for k,v in obj.items():
+        out.update(flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+    return out
+
+def read_yaml(file:Path) -> dict:
+    return yaml.load(Path(file).read_text('utf-8'), Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) # C parser when libyaml is available
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Validated settings from `cfg/req.yaml` and `cfg/commands.yaml`, sections are read-only (``FrozenDict``). Use `CONFIG.get()` for current config, instead of keeping references, so reloaded values are used.
+
+    Attributes
+    ---
+    default - ``FrozenDict``
+        Default inference request values.
+
+    endpoint - ``str``
+        Inference API endpoint, from `cfg/req.yaml` or `SECRETS/codes.yaml`.
+
+    response - ``tuple[str]``
+        Keys of each prediction in API response.
+
+    limits - ``FrozenDict``
+        Minimum and maximum of `conf`, `iou`, and `size` for predict commands, `size` maximum is also largest image dimension sent for inference.
+
+    max_req - ``int``
+        Largest image data (bytes) sent for inference, larger images are resized.
+
+    models - ``tuple[str]``
+        Model choices for predict slash-command.
+
+    upstream, backend, reply, cache, jobs, shards, startup, hot_reload, sync, articles, housekeeping, tiling, video, profiler, watchdog - ``FrozenDict``
+        Sections with same names in `cfg/req.yaml`.
+
+    cmds - ``FrozenDict``
+        Commands and content from `cfg/commands.yaml`.
+    """
+    default:FrozenDict
+    endpoint:str
+    response:tuple[str, ...]
+    limits:FrozenDict
+    max_req:int
+    models:tuple[str, ...]
+    upstream:FrozenDict
+    backend:FrozenDict
+    reply:FrozenDict
+    cache:FrozenDict
+    jobs:FrozenDict
+    shards:FrozenDict
+    startup:FrozenDict
+    hot_reload:FrozenDict
+    sync:FrozenDict
+    articles:FrozenDict
+    housekeeping:FrozenDict
+    tiling:FrozenDict
+    video:FrozenDict
+    profiler:FrozenDict
+    watchdog:FrozenDict
+    cmds:FrozenDict
+
+    @classmethod
+    def from_dicts(cls, req:dict, cmds:dict, secrets:dict=None) -> 'Config':
+        """Builds config from `cfg/req.yaml` and `cfg/commands.yaml` contents, `secrets` only provides fallback `endpoint`. Raises ``ConfigError`` when sections are missing or values are invalid."""
+        names = [f.name for f in fields(cls) if f.name not in ('endpoint', 'cmds')]
+        missing = [n for n in names if n not in req]
+        if any(missing):
+            raise ConfigError(f"Missing sections {missing} in request config.")
+        endpoint = req.get('endpoint') or (secrets or dict()).get('endpoint')
+        cfg = cls(**{n:freeze(req[n]) for n in names}, endpoint=endpoint, cmds=freeze(cmds))
+        cfg.validate()
+        return cfg
+
+    @classmethod
+    def load(cls, req_file:Path, cmds_file:Path, secrets:dict=None) -> 'Config':
+        try:
+            return cls.from_dicts(read_yaml(req_file), read_yaml(cmds_file), secrets)
+        except (OSError, yaml.YAMLError) as e:
+            raise ConfigError(f"Unable to read config files, {e}") from e
+
+    def validate(self) -> None:
+        """Raises ``ConfigError`` with first invalid value found."""
+        try:
+            self._check()
+        except (AssertionError, KeyError, TypeError, ValueError) as e:
+            raise ConfigError(f"Invalid config, {type(e).__name__} {e}") from e
+
+    def _check(self) -> None:
+        assert isinstance(self.endpoint, str) and self.endpoint.startswith('http'), f"endpoint must be HTTP/S URL, found {self.endpoint!r}"
+        assert len(self.response) >= 7, f"response needs name, confidence, class, and box keys, found {self.response}"
+        for k in ('conf', 'iou', 'size'):
+            lo, hi = self.limits[k]['min'], self.limits[k]['max']
+            assert 0 < lo < hi, f"limits.{k} must have 0 < min < max, found {lo}, {hi}"
+        for k, lim in (('confidence', 'conf'), ('iou', 'iou'), ('size', 'size')):
+            v = float(self.default[k])
+            assert self.limits[lim]['min'] <= v <= self.limits[lim]['max'], f"default.{k} {v} outside limits.{lim}"
+        assert self.max_req > 0, "max_req must be positive"
+        assert any(self.models), "models must not be empty"
+
+        up = self.upstream
+        assert len(up['timeout']) == 2 and all(t > 0 for t in up['timeout']), "upstream.timeout must be positive (connect, read) seconds"
+        assert up['rate'] > 0 and up['burst'] >= 1, "upstream.rate must be positive and upstream.burst at least 1"
+        assert up['retries'] >= 0 and 0 < up['backoff'] <= up['backoff_max'], "upstream.retries must not be negative and 0 < backoff <= backoff_max"
+        assert up['max_wait'] >= 0 and up['fail_threshold'] >= 1 and up['cooldown'] >= 0, "upstream.max_wait, fail_threshold, cooldown out of range"
+
+        be = self.backend
+        assert be['default'] in ('hub', 'local'), f"backend.default must be 'hub' or 'local', found {be['default']!r}"
+        assert be['local']['engine'] in ('auto', 'onnxruntime', 'opencv'), f"backend.local.engine unknown {be['local']['engine']!r}"
+        assert be['local']['memory_mb'] > 0 and be['local']['threads'] >= 0, "backend.local.memory_mb must be positive, threads not negative"
+        bt = be['batching']
+        assert bt['max_batch'] >= 1 and bt['max_wait_ms'] >= 0 and bt['workers'] >= 1, "backend.batching.max_batch and workers at least 1, max_wait_ms not negative"
+
+        assert isinstance(self.reply['progressive'], bool), "reply.progressive must be true or false"
+        assert self.cache['max_mb'] > 0 and self.cache['compact_s'] > 0, "cache.max_mb and cache.compact_s must be positive"
+        nd = self.cache['near_dup']
+        assert isinstance(nd['enabled'], bool) and 0 <= nd['max_dist'] <= 15 and nd['max_entries'] >= 1 and nd['aspect_tol'] >= 0, "cache.near_dup.max_dist must be 0-15, max_entries at least 1, aspect_tol not negative"
+        jb = self.jobs
+        assert jb['broker'] in ('memory', 'sqlite'), f"jobs.broker must be 'memory' or 'sqlite', found {jb['broker']!r}"
+        assert jb['workers'] >= 0 and jb['concurrency'] >= 1, "jobs.workers not negative and jobs.concurrency at least 1"
+        assert jb['timeout'] > 0 and jb['poll_ms'] > 0 and jb['lease_s'] > 0, "jobs.timeout, poll_ms, and lease_s must be positive"
+        assert self.shards['count'] is None or self.shards['count'] >= 1, "shards.count must be null or at least 1"
+        assert self.shards['processes'] >= 1 and self.shards['report_s'] > 0, "shards.processes at least 1 and report_s positive"
+        assert self.startup['import_target_s'] > 0 and self.startup['connect_target_s'] > 0, "startup targets must be positive"
+        assert self.hot_reload['watch_s'] >= 0, "hot_reload.watch_s must not be negative"
+        ar = self.articles
+        assert isinstance(ar['enabled'], bool) and (not ar['enabled'] or isinstance(ar['channel'], int)), "articles.enabled must be true or false, with channel ID when enabled"
+        assert ar['poll_s'] > 0 and ar['timeout_s'] > 0 and str(ar['url']).startswith('http'), "articles.poll_s and timeout_s must be positive and url HTTP/S URL"
+        hk = self.housekeeping
+        assert isinstance(hk['enabled'], bool) and hk['interval_s'] > 0 and hk['rescan_h'] > 0, "housekeeping.enabled must be true or false, interval_s and rescan_h positive"
+        for k,v in hk['dirs'].items():
+            assert all(v.get(lim) is None or v[lim] > 0 for lim in ('max_mb', 'max_age_h')), f"housekeeping.dirs.{k} max_mb and max_age_h must be positive or null"
+        tl = self.tiling
+        assert isinstance(tl['enabled'], bool) and tl['min_mp'] > 0 and tl['max_tiles'] >= 1 and tl['hub_tiles'] >= 1 and tl['edge_px'] >= 0, "tiling.enabled must be true or false, min_mp positive, max_tiles and hub_tiles at least 1, edge_px not negative"
+        assert 0 <= tl['overlap'] < 1, "tiling.overlap must be at least 0 and less than 1"
+        vd = self.video
+        assert isinstance(vd['enabled'], bool) and vd['max_mb'] > 0 and vd['max_s'] > 0 and vd['upload_mb'] > 0, "video.enabled must be true or false, max_mb, max_s, and upload_mb positive"
+        assert vd['max_frames'] >= 1 and vd['stride'] >= 1 and vd['batch'] >= 1 and vd['concurrency'] >= 1 and vd['out_size'] >= 64, "video.max_frames, stride, batch, concurrency at least 1 and out_size at least 64"
+        assert 0 <= vd['skip_diff'] <= 255 and 0 <= vd['scene_diff'] <= 255, "video.scene_diff and skip_diff must be 0-255"
+        pf = self.profiler
+        assert pf['interval_ms'] > 0 and pf['max_s'] > 0 and pf['requests'] >= 1 and pf['top'] >= 1, "profiler.interval_ms and max_s must be positive, requests and top at least 1"
+        wd = self.watchdog
+        assert isinstance(wd['enabled'], bool) and wd['interval_ms'] > 0 and wd['threshold_ms'] > 0 and wd['frames'] >= 1, "watchdog.enabled must be true or false, interval_ms and threshold_ms positive, frames at least 1"
+        assert isinstance(self.sync['on_start'], bool) and str(self.sync['manifest']).endswith('.json'), "sync.on_start must be true or false and sync.manifest JSON file"
+        assert 'Global' in self.cmds and 'DevMsgs' in self.cmds, "commands config needs Global and DevMsgs sections"
+
+    def changes(self, other:'Config') -> list[str]:
+        """Dotted keys with different values in `other`."""
+        a = flatten({f.name:getattr(self, f.name) for f in fields(self)})
+        b = flatten({f.name:getattr(other, f.name) for f in fields(other)})
+        return sorted(k for k in a.keys() | b.keys() if a.get(k) != b.get(k))
+
+class ConfigStore:
+    """
+    Holds current ``Config``, which is replaced as a whole so readers always see single consistent version. Files are read on first `get()`.
+
+    Methods
+    ---
+    get() - Returns current ``Config``.
+
+    reload() - Reads and validates files, then swaps in new config and calls subscribers. Returns changed keys, raises ``ConfigError`` and keeps current config when invalid.
+
+    replace(**changes) - Swaps in copy of current config with `changes` (sections as ``dict``), returns previous config. For load tests and experiments.
+
+    set(cfg) - Swaps in `cfg`, calling subscribers.
+
+    subscribe(fn) - Calls `fn(old, new)` after each swap, for objects created from config values.
+
+    watch(interval) - Starts background thread reloading when config files change, checked every `interval` seconds.
+    """
+    def __init__(self, req_file:Path, cmds_file:Path, secrets:Callable[[], dict]) -> None:
+        self.files = (Path(req_file), Path(cmds_file))
+        self.secrets = secrets
+        self._cfg:Config|None = None
+        self._lock = threading.RLock()
+        self._subscribers:list[Callable[[Config, Config], None]] = list()
+        self._mtimes = None
+        self._watcher = None
+
+    def _mtime(self) -> tuple:
+        return tuple(f.stat().st_mtime_ns if f.exists() else None for f in self.files)
+
+    def _read(self) -> Config:
+        mtimes = self._mtime()
+        cfg = Config.load(*self.files, self.secrets())
+        self._mtimes = mtimes
+        return cfg
+
+    def get(self) -> Config:
+        cfg = self._cfg
+        if cfg is None:
+            with self._lock:
+                self._cfg = self._cfg or self._read()
+                cfg = self._cfg
+        return cfg
+
+    def set(self, cfg:Config) -> Config:
+        with self._lock:
+            old, self._cfg = self.get(), cfg
+            for fn in self._subscribers:
+                try:
+                    fn(old, cfg)
+                except Exception as e:
+                    Loggr.error(f"Applying reloaded config with {getattr(fn, '__qualname__', fn)} failed {e!r}")
+        return old
+
+    def replace(self, **changes) -> Config:
+        cfg = replace(self.get(), **{k:freeze(v) for k,v in changes.items()})
+        cfg.validate()
+        return self.set(cfg)
+
+    def reload(self) -> list[str]:
+        with self._lock:
+            new = self._read()
+            changed = self.get().changes(new)
+            if any(changed):
+                _ = self.set(new)
+        restart = [k for k in changed if any(k == r or k.startswith(r + '.') for r in RESTART_ONLY)]
+        _ = Loggr.info(f"Config reloaded, changed {changed}.") if any(changed) else None
+        _ = Loggr.warning(f"Config changes {restart} are only used after restart.") if any(restart) else None
+        return changed
+
+    def subscribe(self, fn:Callable[[Config, Config], None]) -> Callable:
+        self._subscribers.append(fn)
+        return fn
+
+    def watch(self, interval:float) -> threading.Thread|None:
+        """No thread is started when `interval` is zero or watcher is already running."""
+        if interval <= 0 or self._watcher is not None:
+            return None
+        _ = self.get()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name='config-watch', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def _watch(self, interval:float) -> None:
+        while True: # daemon thread, ends with process
+            time.sleep(interval)
+            if self._mtime() == self._mtimes:
+                continue
+            try:
+                _ = self.reload()
+            except ConfigError as e:
+                self._mtimes = self._mtime() # don't retry until changed again
+                Loggr.error(f"Config not reloaded, keeping current. {e}")
@@ -13,7 +13,6 @@ from pathlib import Path
 
 import yaml
 import discord
-import requests
 from discord import app_commands
 
 from UltralyticsBot import BOT_ID, REPO_DIR
@@ -127,7 +126,7 @@ def fetch_gh_docs(repo:str=GH_REPO, local_docs:str=LOCAL_DOCS) -> tuple[Path, su
         cmd = ['git', 'pull']
         save_path = save_path / repo_name
     else:
-        cmd = ['git', 'clone', repo]
+        cmd = ['git', 'clone', '--depth', '1', repo] # latest docs only, history isn't used
     # proc_run = subprocess.run(cmd, cwd=save_path, capture_output=True, text=True) # "Cloning into 'ultralytics'...\n", from `.stderr`, not certain how to capture more; `returncode == 0` should be successful
     proc_run = subprocess.call(cmd, cwd=save_path.as_posix(), text=True) # blocking
     save_path = save_path / repo_name if save_path.name != repo_name else save_path # update for output
@@ -154,6 +153,10 @@ def yaml_2_embeds(file:str|Path) -> tuple[dict,dict]:
     elif category is None:
         raise Exception(f"No Docs category named matching {file.as_posix()}")
 
+def docs_cached(docs_path:Path=(Path.home() / LOCAL_DOCS)) -> bool:
+    """Checks if YAML cache from `docs_choices(True)` exists, so startup doesn't need to wait for fetching docs."""
+    return any(docs_path.glob("*.yaml"))
+
 def load_docs_cache(docs_path:Path=(Path.home() / LOCAL_DOCS)) -> tuple[dict,dict]:
     """Loads data from the path where local repo is cloned and assumes YAML cache has been created."""
     choices, embeds = {c:{} for c in CATEGORIES}, {c:{} for c in CATEGORIES}
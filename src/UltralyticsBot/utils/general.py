@@ -5,26 +5,33 @@ Date: 2023-10-10
 
 Requires: discord.py, pyyaml, numpy, requests, opencv-python
 """
+from __future__ import annotations
 import io
+import time
 # import re
 from pathlib import Path
+from urllib.parse import urlparse
 
-import requests
-import cv2 as cv
-import numpy as np
 import discord
 
 # from UltralyticsBot import BOT_ID
+from UltralyticsBot import CONFIG
 from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
 from UltralyticsBot.utils.checks import is_img_link, is_link #, URL_RGX
+from UltralyticsBot.utils.lazy import lazy_import
+from UltralyticsBot.infer.tiling import tile_grid, tile_scale
+
+requests = lazy_import('requests')
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
 
 TEMPFILE = 'detect_result' # fallback
 
 def files_age(fpath:Path, age_lim:int=24) -> bool:
-    """Check if _any_ files in path provided are older than `age_lim` in hours, default is 24 hours."""
-    times = np.array([[getattr(f.stat(), a) for a in ['st_ctime','st_mtime','st_atime']] for f in fpath.rglob("*")])
-    age = np.diff(times, axis=1) / 3600 # convert to hours
-    return bool((age > age_lim).any())
+    """Check if _any_ files in path provided are older than `age_lim` in hours, default is 24 hours. Stops at first old file found, see `utils/housekeeping.py` for cleaning up old files."""
+    oldest = time.time() - age_lim * 3600
+    return any(f.stat().st_mtime < oldest for f in Path(fpath).rglob("*") if f.is_file())
 
 def align_boxcoord(pxl_coords:list|tuple) -> str:
     """Creates string from pixel-space bounding box coordinates and right aligns coordinates."""
@@ -39,8 +46,11 @@ def data_over_limit(data:bytes, lim:int=2.0) -> bool:
     """Checks if bytes data provided is larger than limit value, default limit is 2.0 MB (2097152 bytes)"""
     return (len(data) / (1024 ** 2)) > lim
 
-def image_oversize(img:np.ndarray=None, img_dims:tuple|list=(0,0), hLim:int=1280, wLim:int=1280): # NOTE replace with values imported from YAML
+def image_oversize(img:np.ndarray=None, img_dims:tuple|list=(0,0), hLim:int=None, wLim:int=None):
+    """Checks if image is larger than `hLim` or `wLim`, which default to maximum inference size from `limits` config."""
     assert img is not None or any(img_dims), Loggr.error(f"Neither image object or dimensions provided.")
+    hLim = hLim or CONFIG.get().limits['size']['max']
+    wLim = wLim or CONFIG.get().limits['size']['max']
     height, width = img_dims if any(img_dims) else img.shape[:2]
     return (height / hLim) > 1 or (width / wLim) > 1
 
@@ -73,6 +83,18 @@ def attach_file(img:np.ndarray, encode:str='.png', name:str=TEMPFILE) -> discord
     
     return img_attachmnt
 
+MAGIC = ((b'GIF8', 0, '.gif'), (b'\x1aE\xdf\xa3', 0, '.webm'), (b'ftyp', 4, '.mp4'), (b'\x89PNG', 0, '.png'), (b'\xff\xd8\xff', 0, '.jpeg')) # signature, offset, extension
+
+def file_ext(data:bytes, default:str='.png') -> str:
+    """File extension from signature of encoded image or video `data`, `default` when unknown."""
+    return next((ext for sig, at, ext in MAGIC if data[at:at + len(sig)] == sig), default)
+
+def bytes_file(data:bytes, encode:str=None, name:str=TEMPFILE) -> discord.File:
+    """Generates Discord message file attachment from already encoded image (or annotated clip) bytes, extension is found from `data` when `encode` is `None`."""
+    encode = file_ext(data) if encode is None else encode
+    encode = encode if encode.startswith('.') else ('.' + encode)
+    return discord.File(io.BytesIO(data), f'{name}{encode}')
+
 def gen_cmd(model:str,
             source:str,
             conf:float,
@@ -112,6 +134,8 @@ def gen_cmd(model:str,
 
 class ReqImage:
     """
+    Image for inference request, only holds buffers still needed by later stages. Raw downloaded bytes are dropped after decoding when image will be resized, and source image is replaced by resized image, so at most two image buffers are held at once.
+
     Attributes
     ---
     url_good - ``bool``
@@ -121,13 +145,13 @@ class ReqImage:
         String URL for image, when URL is good and URL appears to be for an image.
 
     imdata - ``bytes`` | ``None``
-        Image from `self.image` as ``bytes`` data, or ``None`` if invalid.
+        Image data sent for inference, downloaded bytes until resized, or ``None`` if invalid or released.
 
     size - ``int`` | ``None``
-        Size (MB) of `self.imdata` or value passed from `discord.Message` when image is attached.
+        Size (MB) of downloaded data or value passed from `discord.Message` when image is attached.
 
     image - ``np.ndarry`` | ``None``
-        When URL is valid, image data retrived from link.
+        When URL is valid, image data retrived from link, replaced when resized for inference.
 
     im_ext - ``str``
         Original file extension of image retrived.
@@ -141,51 +165,107 @@ class ReqImage:
     image_error - ``bool``
         If error occurs while retriving image, will be `True` otherwise `False`.
 
+    peak_bytes - ``int``
+        Largest total of image buffers held at once, recorded as `image.peak_mb` metric by `inference_img()`.
+
+    proxy_url - ``str`` | ``None``
+        Discord media proxy URL of attachment, serves resized renditions with `width` and `height` query parameters.
+
+    fetch_ratio - ``float``
+        Scale of image fetched from `proxy_url` to attachment size, `1.0` when original was fetched.
+
     Methods
     ---
     data_size() - Returns ``float`` of `self.imdata` in MB
 
-    get_image() - Fetches data from provided URL, executed during `__init__`
+    rendition(fetch_size) - Returns media proxy URL for rendition with longest side of `fetch_size` and its scale, or (``None``, `1.0`) when attachment isn't larger or its size is unknown.
+
+    get_image(fetch_size) - Fetches data from provided URL, or smaller rendition from `rendition()` when available falling back to provided URL, with `upstream: timeout` connect and read timeouts. Executed during `__init__`, which blocks so create from worker thread in async code
 
-    inference_img(infer_size, enc, Q) - Calculates and scales `self.image` dimensions for inference as needed, repopulates `self.size`, `self.height`, `self.width`, and `self.imdata` attributes if resized.
+    inference_img(infer_size, enc, Q) - Calculates and scales `self.image` dimensions for inference as needed, repopulates `self.size`, `self.height`, `self.width`, and `self.imdata` attributes if resized. Returned ratio includes `fetch_ratio`.
 
         - infer_size ``int`` - size for inference, default 640
 
         - enc ``str`` - file extension encoding for bytes data, default '.jpeg'
 
         - Q ``int`` - percentage to compress data
+
+    tile_imgs(tile, overlap, max_tiles, enc, Q) - Cuts `self.image` into overlapping `tile` sized tiles at native resolution (scaled down only when more than `max_tiles` are needed), returns tiles with image bytes, tile windows, and scale. Call before `inference_img()`, which releases source image.
+
+    release() - Drops image buffers, for when request is finished but object is still referenced.
     """
-    def __init__(self, img_url:str, MB_lim:float|int=2.0, **kwargs) -> None:
-        self.__MBsize_limit = MB_lim # inference request size limit, default is 2 MB (2097152 bytes)
-        self.__source_url = img_url
-        self.__source_img = None
+    __slots__ = ('url_good', 'im_url', 'imdata', 'image', 'size', 'im_ext', 'height', 'width', 'image_error', 'peak_bytes', 'proxy_url', 'fetch_ratio', '_MBsize_limit', '_source_url')
+
+    def __init__(self, img_url:str, MB_lim:float|int=2.0, fetch_size:int=None, **kwargs) -> None:
+        self._MBsize_limit = MB_lim # inference request size limit, default is 2 MB (2097152 bytes)
+        self._source_url = img_url
         self.url_good, self.im_ext = is_img_link(img_url, True)
         self.im_url = img_url if self.url_good or is_img_link(img_url) else None
-        self.imdata = self.image = self.size = self.height = self.width = None
+        self.imdata = self.image = self.size = self.height = self.width = self.proxy_url = None
         self.image_error = False
+        self.peak_bytes, self.fetch_ratio = 0, 1.0
         if any(kwargs):
             _ = [setattr(self, k, v) for k,v in kwargs.items()]
-        self.get_image()
+        self.get_image(fetch_size)
     
     def data_size(self):
         """Returns the size (MB) of the retrieved data"""
         return (len(self.imdata) / (1024 ** 2))
     
-    def get_image(self):
-        # self.imdata = requests.get(self.im_url).content if self.im_url is not None else None
+    def _held(self, *extra:np.ndarray|bytes|None) -> None:
+        """Updates `peak_bytes` with buffers held now, plus `extra` buffers that exist at same time."""
+        held = sum(len(b) if isinstance(b, bytes) else b.nbytes for b in (self.imdata, self.image, *extra) if b is not None)
+        self.peak_bytes = max(self.peak_bytes, held)
+    
+    def rendition(self, fetch_size:int=None) -> tuple[str|None, float]:
+        if self.proxy_url is None or fetch_size is None or not self.height or not self.width:
+            return None, 1.0
+        R = min(fetch_size / self.height, fetch_size / self.width)
+        if R >= 1.0:
+            return None, 1.0
+        query = f"width={max(round(self.width * R), 1)}&height={max(round(self.height * R), 1)}"
+        return f"{self.proxy_url}{'&' if urlparse(self.proxy_url).query else '?'}{query}", R
+
+    def _fetch_rendition(self, fetch_size:int=None) -> np.ndarray|None:
+        """Decoded rendition from media proxy, ``None`` when not available or request fails, so original is fetched instead."""
+        url, R = self.rendition(fetch_size)
+        if url is None:
+            return None
         try:
-            self.imdata = requests.get(self.im_url).content if self.im_url is not None else None
+            resp = requests.get(url, timeout=tuple(CONFIG.get().upstream['timeout']))
+            decoded = cv.imdecode(np.frombuffer(resp.content, np.uint8), -1) if resp.status_code == 200 and resp.content else None
+        except requests.exceptions.RequestException as e:
+            decoded = None
+            Loggr.debug(f"Media proxy request failed {e!r}")
+        if decoded is None:
+            METRICS.incr('image.proxy_fallback')
+            return None
+        self.imdata, self.fetch_ratio, self.size = resp.content, R, None # size of rendition, not attachment
+        METRICS.incr('image.proxy_fetch')
+        return decoded
+
+    def get_image(self, fetch_size:int=None):
+        try:
+            decoded = self._fetch_rendition(fetch_size)
+            if decoded is None:
+                self.imdata = requests.get(self.im_url, timeout=tuple(CONFIG.get().upstream['timeout'])).content if self.im_url is not None else None # connect, read timeouts
             if self.im_url is not None and self.imdata is not None:
-                self.image = make_3ch_img(cv.imdecode(np.frombuffer(self.imdata, np.uint8), -1))
-                self.__source_img = np.copy(self.image)
+                decoded = cv.imdecode(np.frombuffer(self.imdata, np.uint8), -1) if decoded is None else decoded
+                self._held(decoded)
+                self.image = make_3ch_img(decoded)
+                self._held(decoded if self.image is not decoded else None)
                 self.height, self.width = self.image.shape[:2]
+                self.size = self.data_size() if self.size is None else self.size
+                # bytes are only sent as-is when image isn't resized, any inference size will resize when over either limit
+                if data_over_limit(self.imdata, self._MBsize_limit) or image_oversize(img_dims=(self.height, self.width)):
+                    self.imdata = None
             else:
                 self.image_error = True
-                Loggr.debug(f"Problem retrieving source image from data for URL {self.__source_url}")
+                Loggr.debug(f"Problem retrieving source image from data for URL {self._source_url}")
         
         except SyntaxError: # incorrect bytes string will raise this
             self.image_error = True
-            Loggr.error(f"Syntax error for data retrieved from URL {self.__source_url} when attempting to generate source image")
+            Loggr.error(f"Syntax error for data retrieved from URL {self._source_url} when attempting to generate source image")
 
         except requests.exceptions.RequestException as R:
             self.image_error = True
@@ -193,21 +273,38 @@ class ReqImage:
     
         except Exception as e: # all other error types
             self.image_error = True
-            Loggr.error(f"Error {e} occurred when attempting to fetch image from data for URL {self.__source_url}")
+            Loggr.error(f"Error {e} occurred when attempting to fetch image from data for URL {self._source_url}")
     
     def inference_img(self, infer_size:int=640, enc:str='.jpeg', Q:int=60) -> tuple[np.ndarray, bytes, float]:
-        """Generates inference image by resizing and compressing data as required. Returns inference image, image bytes, and resized ratio."""
+        """Generates inference image by resizing and compressing data as required. Returns inference image, image bytes, and resized ratio. Source image and data are released when resized."""
         R = 1.0
-        need2resize = data_over_limit(self.imdata, self.__MBsize_limit) or image_oversize(img_dims=(self.height, self.width), hLim=infer_size, wLim=infer_size)
-        self.size = self.data_size() if self.size is None else self.size
+        need2resize = self.imdata is None or data_over_limit(self.imdata, self._MBsize_limit) or image_oversize(img_dims=(self.height, self.width), hLim=infer_size, wLim=infer_size)
         if need2resize:
-            R = round(min(((self.__MBsize_limit / self.size)), infer_size / self.height, infer_size / self.width, 1.0), 2)
-            self.image = cv.resize(np.copy(self.image), None, None, R, R)
+            R = round(min(((self._MBsize_limit / self.size)), infer_size / self.height, infer_size / self.width, 1.0), 2)
+            resized = cv.resize(self.image, None, None, R, R) # new array, source isn't modified
+            self._held(resized)
+            self.image, self.imdata = resized, None
             enc_params = None if enc.lower() not in ['.jpeg', '.jpg'] else (cv.IMWRITE_JPEG_QUALITY, Q)
             self.imdata = cv.imencode(enc, self.image, enc_params)[1].tobytes()
             self.height, self.width = self.image.shape[:2]
 
-        return self.image, self.imdata, R
+        self._held()
+        METRICS.observe('image.peak_mb', self.peak_bytes / 1024 ** 2)
+        return self.image, self.imdata, round(R * self.fetch_ratio, 2)
+    
+    def tile_imgs(self, tile:int=640, overlap:float=0.2, max_tiles:int=12, enc:str='.jpeg', Q:int=60) -> tuple[list[tuple[np.ndarray, bytes]], np.ndarray, float]:
+        """Generates tiles for inference on large images, see `infer/tiling.py`. Returns (tile image, tile bytes) for each tile, (N, 4) x1y1x2y2 tile windows, and scale of tiled image."""
+        R = tile_scale(self.height, self.width, tile, overlap, max_tiles)
+        source = cv.resize(self.image, None, None, R, R, interpolation=cv.INTER_AREA) if R < 1.0 else self.image
+        grid = tile_grid(*source.shape[:2], tile, overlap)
+        enc_params = None if enc.lower() not in ['.jpeg', '.jpg'] else (cv.IMWRITE_JPEG_QUALITY, Q)
+        tiles = [source[y1:y2, x1:x2] for x1, y1, x2, y2 in grid.tolist()] # views, no copies
+        tiles = [(t, cv.imencode(enc, t, enc_params)[1].tobytes()) for t in tiles]
+        self._held(source if source is not self.image else None, *(b for _,b in tiles))
+        return tiles, grid, R
+
+    def release(self) -> None:
+        self.imdata = self.image = None
     
 # Large test image "https://i.imgur.com/pDNOqoa.png"
 # Normal test image "https://raw.githubusercontent.com/ultralytics/ultralytics/main/ultralytics/assets/bus.jpg"
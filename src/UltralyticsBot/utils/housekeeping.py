@@ -0,0 +1,115 @@
+"""
+Title: utils/housekeeping.py
+Author: Burhan Qaddoumi
+Date: 2023-11-04
+
+Requires:
+"""
+import os
+import json
+import time
+import shutil
+import threading
+from pathlib import Path
+from fnmatch import fnmatch
+
+from UltralyticsBot import PROJ_ROOT, CONFIG
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.docs_data import LOCAL_DOCS
+
+DISK_LOCK = threading.Lock() # held while docs are fetched or housekeeping deletes, so clone isn't removed during `git pull`
+
+def budget_path(path:str|None) -> Path:
+    """Directory for budget `path`, `None` is local docs directory, `~` is home directory, relative paths are from project root."""
+    if path is None:
+        return Path.home() / LOCAL_DOCS
+    path = Path(path).expanduser()
+    return path if path.is_absolute() else PROJ_ROOT / path
+
+def tree_size(path:Path) -> int:
+    """Total bytes of all files under directory `path`, without following links."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+def scan(path:Path, pattern:str='*', previous:dict=None, rescan_s:float=86400.0) -> dict[str, list]:
+    """
+    Top-level entries of `path` matching `pattern` as name -> [bytes, last used, scanned]. Files are checked with single `stat` call, directory sizes are reused from `previous` unless directory `mtime` changed or last scan is older than `rescan_s` seconds, since walking large directories (repo clone) is slow.
+    """
+    previous, now, out = previous or dict(), time.time(), dict()
+    if not path.is_dir():
+        return out
+    for entry in os.scandir(path):
+        if not fnmatch(entry.name, pattern):
+            continue
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        used = max(st.st_mtime, st.st_atime)
+        if not entry.is_dir(follow_symlinks=False):
+            out[entry.name] = [st.st_size, used, now]
+            continue
+        prev = previous.get(entry.name)
+        if prev is not None and prev[1] >= st.st_mtime and now - prev[2] < rescan_s:
+            out[entry.name] = [prev[0], max(prev[1], used), prev[2]]
+        else:
+            out[entry.name] = [tree_size(entry.path), used, now]
+    return out
+
+def over_budget(entries:dict[str, list], max_mb:float|None, max_age_h:float|None, keep:tuple[str]=()) -> list[str]:
+    """Entries to delete, first any older than `max_age_h` hours, then least recently used until total size is within `max_mb`. Names matching `keep` patterns are never selected, `None` disables a limit."""
+    now = time.time()
+    removable = sorted((n for n in entries if not any(fnmatch(n, k) for k in keep)), key=lambda n: entries[n][1])
+    drop = [n for n in removable if max_age_h is not None and now - entries[n][1] > max_age_h * 3600]
+    total = sum(v[0] for n,v in entries.items() if n not in drop)
+    for n in removable:
+        if max_mb is None or total <= max_mb * 1024 ** 2:
+            break
+        if n not in drop:
+            drop.append(n)
+            total -= entries[n][0]
+    return drop
+
+def remove(path:Path) -> None:
+    _ = shutil.rmtree(path, ignore_errors=True) if path.is_dir() and not path.is_symlink() else path.unlink(missing_ok=True)
+
+def read_manifest(file:Path) -> dict:
+    try:
+        return json.loads(Path(file).read_text('utf-8'))
+    except (OSError, ValueError):
+        return dict()
+
+def write_manifest(file:Path, manifest:dict) -> None:
+    file = Path(file)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding='utf-8')
+    tmp.replace(file)
+
+def housekeep(cfg:dict=None) -> dict[str, list[str]]:
+    """Updates manifest of budget directories and deletes entries over size or age budgets, using `housekeeping` section of `cfg/req.yaml` when `cfg` is `None`. Returns deleted entries for each budget."""
+    cfg = cfg or CONFIG.get().housekeeping
+    manifest_file = PROJ_ROOT / cfg['manifest']
+    manifest, removed = read_manifest(manifest_file), dict()
+    with DISK_LOCK, METRICS.timer('housekeeping.ms'):
+        for name, budget in cfg['dirs'].items():
+            path = budget_path(budget.get('path'))
+            entries = scan(path, budget.get('glob', '*'), manifest.get(name, dict()).get('entries'), cfg['rescan_h'] * 3600)
+            drop = over_budget(entries, budget.get('max_mb'), budget.get('max_age_h'), tuple(budget.get('keep', ())))
+            for n in drop:
+                remove(path / n)
+                _ = entries.pop(n)
+            manifest[name] = {'path':path.as_posix(), 'bytes':sum(v[0] for v in entries.values()), 'entries':entries}
+            METRICS.gauge(f"housekeeping.{name}_mb", round(manifest[name]['bytes'] / 1024 ** 2, 3))
+            _ = Loggr.info(f"Housekeeping removed {drop} from {path}.") if any(drop) else None
+            removed[name] = drop
+        write_manifest(manifest_file, manifest)
+    METRICS.incr('housekeeping.removed', sum(len(v) for v in removed.values()))
+    return removed
@@ -0,0 +1,32 @@
+"""
+Title: utils/lazy.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires:
+"""
+import sys
+import importlib
+import importlib.util
+from types import ModuleType
+
+class LazyModule(ModuleType):
+    """Stands in for module until first attribute is accessed, which imports it. Afterwards attributes are copied so lookups no longer go through `__getattr__`. Safe to use from multiple threads, since imports are serialized by the import system."""
+    def __getattr__(self, attr:str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name:str, optional:bool=False) -> ModuleType|None:
+    """Returns module `name` when already imported, otherwise ``LazyModule`` which imports on first use. When `optional` is ``True``, returns ``None`` if module is not installed instead of raising ``ModuleNotFoundError``. Modules using this should include `from __future__ import annotations` so type hints don't trigger the import."""
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        if optional:
+            return None
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    return LazyModule(name)
+
+def preload(*names:str) -> None:
+    """Imports modules `names` now, for warming up ``LazyModule`` dependencies in background before first use."""
+    _ = [importlib.import_module(n) for n in names]
@@ -3,16 +3,127 @@ Title: utils/logging
 Author: Burhan Qaddoumi
 Date: 2023-10-12
 
-Requires: 
+Requires:
 """
 
+import json
+import time
+import queue
+import atexit
+import threading
+import contextvars
 import logging
 import logging.config
+import logging.handlers
+import multiprocessing as mp
 from pathlib import Path
 
 import yaml
 
 from UltralyticsBot import PROJ_ROOT
+from UltralyticsBot.utils.metrics import METRICS
+
+REQUEST_ID = contextvars.ContextVar('request_id', default='-') # set for each command, copied to tasks and `asyncio.to_thread` calls
+RECORD_KEYS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_factory = logging.getLogRecordFactory()
+
+def record_factory(*args, **kwargs) -> logging.LogRecord:
+    """Adds `request_id` from current context to every record when created, before it's passed to writer thread."""
+    record = _factory(*args, **kwargs)
+    record.request_id = REQUEST_ID.get()
+    return record
+
+logging.setLogRecordFactory(record_factory)
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single line JSON objects, including `request_id` and any `extra` values."""
+    def format(self, record:logging.LogRecord) -> str:
+        out = {
+            'ts':round(record.created, 3),
+            'level':record.levelname,
+            'logger':record.name,
+            'module':record.module,
+            'func':record.funcName,
+            'request_id':getattr(record, 'request_id', '-'),
+            'msg':record.getMessage(),
+            }
+        out.update({k:v for k,v in vars(record).items() if k not in RECORD_KEYS and k not in out})
+        if record.exc_info:
+            out['exc'] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str, ensure_ascii=False)
+
+class DebugSampler(logging.Filter):
+    """Limits DEBUG records from each logger to `rate` per second with bursts up to `burst`, using token bucket. Other levels always pass. Next DEBUG record passed after drops includes `dropped` count."""
+    def __init__(self, rate:float=50.0, burst:int=200) -> None:
+        super().__init__()
+        self.rate, self.burst = rate, burst
+        self.buckets = dict() # logger name -> [tokens, last update]
+        self.dropped = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self.buckets.get(record.name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allow = tokens >= 1
+            self.buckets[record.name] = (tokens - allow, now)
+            if not allow:
+                self.dropped[record.name] = self.dropped.get(record.name, 0) + 1
+            elif self.dropped.get(record.name):
+                record.dropped = self.dropped.pop(record.name)
+        _ = METRICS.incr('log.sampled_out') if not allow else None
+        return allow
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Puts records on queue with `targets` handlers for writer thread, which formats and writes them. Records are dropped instead of blocking when queue is full."""
+    def __init__(self, q:queue.Queue, targets:list[logging.Handler]) -> None:
+        super().__init__(q)
+        self.targets = targets
+
+    def prepare(self, record:logging.LogRecord) -> tuple[logging.LogRecord, list[logging.Handler]]:
+        return record, self.targets # formatted by writer thread, not caller
+
+    def enqueue(self, item:tuple[logging.LogRecord, list[logging.Handler]]) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            METRICS.incr('log.dropped')
+
+class QueueListener(logging.handlers.QueueListener):
+    """Single writer thread for all loggers, sends each record to `targets` from its ``QueueHandler``."""
+    def handle(self, item:tuple[logging.LogRecord, list[logging.Handler]]) -> None:
+        record, targets = item
+        for h in targets:
+            if record.levelno >= h.level:
+                h.handle(record)
+
+def queue_loggers(names:list[str], maxsize:int=10000, sampler:logging.Filter=None) -> QueueListener:
+    """Moves handlers of root and `names` loggers behind ``QueueHandler`` and starts writer thread, which is stopped (after writing queued records) on exit."""
+    q = queue.Queue(maxsize)
+    for lgr in [logging.getLogger()] + [logging.getLogger(n) for n in names]:
+        targets = list(lgr.handlers)
+        if not any(targets):
+            continue
+        qh = QueueHandler(q, targets)
+        _ = qh.addFilter(sampler) if sampler is not None else None
+        _ = [lgr.removeHandler(h) for h in targets]
+        lgr.addHandler(qh)
+    listener = QueueListener(q)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def process_log_file(filename:str) -> str:
+    """Log file for current process. Spawned processes (job workers, shard groups) configure logging again and would rotate parent's file at the same time, so each writes `<stem>.<process name><suffix>` instead."""
+    name = mp.current_process().name
+    if name == 'MainProcess':
+        return filename
+    path = Path(filename)
+    return path.with_name(f"{path.stem}.{name}{path.suffix}").as_posix()
 
 try:
     config_file = next((PROJ_ROOT / 'cfg').glob("Loggr.yaml"))
@@ -23,6 +134,12 @@ if config_file is not None and config_file != []:
     config_file = config_file[0] if isinstance(config_file, list) else config_file
     config = yaml.safe_load(config_file.read_text("utf-8"))
 
+queue_cfg = config.pop('queue', dict()) # not part of `logging.config` schema
+for fmt in config.get('formatters', dict()).values(): # classes from this module can't be imported by `dictConfig` while module is loading
+    fmt['()'] = globals()[fmt['()'].rpartition('.')[-1]] if str(fmt.get('()')).startswith(__name__ + '.') else fmt.get('()')
+    _ = fmt.pop('()') if fmt['()'] is None else None
+for h in config.get('handlers', dict()).values():
+    _ = h.update(filename=process_log_file(h['filename'])) if 'filename' in h else None
 logging.config.dictConfig(config)
 Loggr = logging.getLogger('Loggr')
-
+LISTENER = queue_loggers(list(config.get('loggers', dict())), queue_cfg.get('maxsize', 10000), DebugSampler(queue_cfg.get('debug_rate', 50.0), queue_cfg.get('debug_burst', 200)))
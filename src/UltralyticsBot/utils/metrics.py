@@ -0,0 +1,60 @@
+"""
+Title: utils/metrics.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: 
+"""
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+WINDOW = 1024 # most recent observations kept per timing
+
+def percentile(values:list[float], q:float) -> float:
+    """Nearest-rank percentile for `q` in range [0, 100], returns 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+class Metrics:
+    """Thread-safe in-process counters, gauges, and rolling timing summaries."""
+    def __init__(self, window:int=WINDOW) -> None:
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = dict()
+        self.timings = defaultdict(lambda: deque(maxlen=window))
+
+    def incr(self, name:str, n:int=1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def gauge(self, name:str, value:float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name:str, value:float) -> None:
+        """Record single observation for `name`, for durations use milliseconds."""
+        with self._lock:
+            self.timings[name].append(value)
+
+    @contextmanager
+    def timer(self, name:str):
+        """Records wall-clock duration (ms) of the context as observation for `name`."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - t0) * 1e3)
+
+    def snapshot(self) -> dict:
+        """Copy of current values, timings reduced to count, p50, p95, and max."""
+        with self._lock:
+            counters, gauges = dict(self.counters), dict(self.gauges)
+            timings = {k:list(v) for k,v in self.timings.items()}
+        summary = {k:{'count':len(v), 'p50':round(percentile(v, 50), 3), 'p95':round(percentile(v, 95), 3), 'max':round(max(v, default=0.0), 3)} for k,v in timings.items()}
+        return {'counters':counters, 'gauges':gauges, 'timings':summary}
+
+METRICS = Metrics()
@@ -5,15 +5,18 @@ Date: 2023-10-29
 
 Requires: requests
 """
+from __future__ import annotations
 import re
 from typing import Callable
 
 import discord
-import requests
 
 from UltralyticsBot import GH, BOT_ID
 from UltralyticsBot.utils.general import dec2str, align_boxcoord
 from UltralyticsBot.utils.checks import is_link, is_img_link, URL_RGX
+from UltralyticsBot.utils.lazy import lazy_import
+
+requests = lazy_import('requests')
 
 NEWLINE = '\n' # use with f-strings
 BOX_LJUST = 24 # Box coordinates will always be -> '(1234, 1234, 1234, 1234)'
@@ -22,32 +25,51 @@ BOX_LJUST = 24 # Box coordinates will always be -> '(1234, 1234, 1234, 1234)'
 
 IMG_ERR_MSG = f"Error occured when fetching image, check URL and try again. Open issue and include URL on [project repo]({GH}) if continued problems with working image URL."
 API_ERR_MSG = "Error: API call failed with {} - {}" # response.status-code, response.reason
+API_BUSY_MSG = "Error: Inference API is busy right now, please wait a minute before trying again."
 IMGSZ_MSG = '**__NOTE:__** Results are for image scaled by `{}` from original size, as required for inference.\n'
 NOT_OWNER = f"This command is only for the Bot owner."
+CLIP_SIZE_MSG = "Error: clip is larger than {} MB, try a shorter clip." # video.max_mb
+CLIP_ERR_MSG = "Error: unable to read frames from clip, check it's a supported GIF or video format."
+CLIP_MSG = "Sampled {} of {} frames." # sampled, total
+MEDIA_TYPES = ('image', 'video') # attachment content types used for predict
 
 def longest(results:list[dict|str], _pad:int=2):
     """Finds the length of the longest class name string in results and adds padding spaces (2 by default)."""
     name_len = {len(n):n for n in set((r['name'] if isinstance(r, dict) else r) for r in results)}
     return sorted(name_len)[-1] + _pad
 
-def gen_title(CL:int):
-    """Generate title string for results. Requires padding length for 'class' which usually should be calculated dynamically."""
+def gen_title(CL:int, task:str='detect'):
+    """Generate title string for results. Requires padding length for 'class' which usually should be calculated dynamically. Classification results have no box column."""
+    if task == 'classify':
+        return "{} {}\n".format('class'.ljust(CL), 'conf'.ljust(4))
     return "{} {}   {}\n".format('class'.ljust(CL), 'conf'.ljust(4), 'x1y1x2y2'.ljust(BOX_LJUST))
 
 def gen_line(cls_name:str, CL:int, conf:float, x1:int, y1:int, x2:int, y2:int):
     return '{} {}  {}\n'.format(cls_name.ljust(CL), dec2str(conf), align_boxcoord([x1,y1,x2,y2]).ljust(BOX_LJUST))
 
+def gen_cls_line(cls_name:str, CL:int, conf:float):
+    return '{} {}\n'.format(cls_name.ljust(CL), dec2str(conf))
+
+def gen_clip_table(counts:dict[str, list[int]], n:int) -> str:
+    """Results table for clip, with most detections of each class in single frame and number of frames with class out of `n` sampled frames."""
+    if not any(counts):
+        return ''
+    CL = longest(list(counts))
+    rows = sorted(counts.items(), key=lambda kv: (-kv[1][1], kv[0]))
+    return '```\n{} {} {}\n'.format('class'.ljust(CL), 'max'.ljust(4), 'frames') + ''.join('{} {} {}/{}\n'.format(k.ljust(CL), str(m).ljust(4), f, n) for k,(m,f) in rows) + '```'
+
 def get_args(args:list, chr:str=" ", n:int=1) -> list[str]:
     """Split string with character `chr` and return list values after `n`, defaults are `chr=' '` (space) and `n=1`"""
     return args.split(chr)[n:]
 
 class ResponseMsg():
-    def __init__(self, api_reply:requests.models.Response, plot:bool, txt:bool, ratio:float=1.0, **kwargs) -> None:
+    def __init__(self, api_reply:requests.models.Response, plot:bool, txt:bool, ratio:float=1.0, task:str='detect', **kwargs) -> None:
         super().__init__(**kwargs)
         self.api_reply = api_reply
         self.plot = plot or not txt
         self.txt = txt
         self.ratio = ratio
+        self.task = task
         self.response()
         
     def response(self):
@@ -68,7 +90,7 @@ class ResponseMsg():
             self.msg += IMGSZ_MSG.format(self.ratio) if self.ratio != 1.0 and self.txt else ''
             # self.cls_pad = 2 if not any(self.data) else longest(self.data)
             self.msg += '```{}\n'.format(highlight) if self.txt else ''
-            self.msg += gen_title(self.cls_pad) if self.txt else ''
+            self.msg += gen_title(self.cls_pad, self.task) if self.txt else ''
             
             self.anno_im, self.result_txt = plt_fn(predictions=self.data)
             self.msg += ((self.result_txt + '```') if self.txt else ('```' if self.txt and self.result_txt != '' else ''))
@@ -103,6 +125,9 @@ class ReqMessage:
     im_height - ``int`` | ``None``
         Height in pixels of image attched to `self.msg` if any, otherwise ``None``.
 
+    proxy_url - ``str`` | ``None``
+        Discord media proxy URL of image attached to `self.msg` if any, serves resized renditions, otherwise ``None``.
+
     has_url - ``bool``
         Is `True` when text from `self.msg` contains what appears to be valid URL string, otherwise `False`.
 
@@ -113,7 +138,7 @@ class ReqMessage:
         Is `True` when `self.msg` contains text other than triggering-keywords and whitespace, otherwise `False`.
 
     has_img - ``bool``
-        Is `True` when `self.msg` has attachment with content type 'image', otherwise `False`
+        Is `True` when `self.msg` has attachment with content type 'image' or 'video', otherwise `False`
 
     bot_mention - ``bool``
         Is `True` when `self.msg` contains bot-user mention/tag, otherwise `False`.
@@ -129,7 +154,7 @@ class ReqMessage:
     def __init__(self, msg:discord.Message) -> None:
         self.msg = msg
         self.url = self.author = self.mentions = self.media = None
-        self.im_height = self.im_width = self.attached_im = self.img_size = None
+        self.im_height = self.im_width = self.attached_im = self.img_size = self.proxy_url = None
         self.has_url = self.has_media = self.has_text = self.has_img = self.bot_mention = False
         self.check_message()
         
@@ -138,7 +163,7 @@ class ReqMessage:
         self.media = self.msg.attachments if any(self.msg.attachments) else []
         
         self.has_url = is_link(self.msg.content) if self.has_text else False
-        self.has_img = (['image' in a.content_type for a in self.media]) if any(self.media) else False
+        self.has_img = any(any(t in (a.content_type or '') for t in MEDIA_TYPES) for a in self.media)
         
         self.author = self.msg.author
         self.mentions = self.msg.mentions
@@ -148,8 +173,9 @@ class ReqMessage:
             self.url = re.search(URL_RGX, self.msg.content, re.IGNORECASE).group()
         
         elif self.has_img:
-            self.attached_im = [a for a in self.media if 'image' in a.content_type][0] # only allow one image
+            self.attached_im = [a for a in self.media if any(t in (a.content_type or '') for t in MEDIA_TYPES)][0] # only allow one image or clip
             self.url = self.attached_im.url
+            self.proxy_url = getattr(self.attached_im, 'proxy_url', None)
             self.im_height, self.im_width = self.attached_im.height, self.attached_im.width
             self.img_size = self.attached_im.size / (1024 ** 2)
     
@@ -5,13 +5,17 @@ Date: 2023-10-11
 
 Requires: pyyaml, numpy, opencv-python
 """
+from __future__ import annotations
 from pathlib import Path
+from dataclasses import dataclass, field
 
-import cv2 as cv
-import numpy as np
 import yaml
 
 from UltralyticsBot import PROJ_ROOT
+from UltralyticsBot.utils.lazy import lazy_import
+
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
 
 COLORS_FILE = PROJ_ROOT / 'cfg/colors.yaml'
 
@@ -73,3 +77,141 @@ def draw_all_boxes(image:np.ndarray, boxes:np.ndarray, line_size:int=3):
     _ = [drawbox(image, b.squeeze(), line_size) for b in boxes]
     return image
 
+
+def color_idx(classes:np.ndarray) -> np.ndarray:
+    """Vectorized color index for class indices, cycling when there are more classes than colors."""
+    return np.asarray(classes, dtype=np.int64) % len(COLORS)
+
+def draw_polys(image:np.ndarray, polys:list[np.ndarray]|np.ndarray, classes:np.ndarray, line_size:int=3, closed:bool=True) -> np.ndarray:
+    """Draws polygon outlines (boxes, rotated boxes, skeleton lines), with one OpenCV call per color instead of per polygon."""
+    cidx = color_idx(classes)
+    if isinstance(polys, np.ndarray): # same number of points for every polygon, convert once
+        polys = polys.astype(np.int32).reshape(len(polys), polys.shape[1] if polys.ndim > 2 else -1, 1, 2)
+        groups = {c:list(polys[cidx == c]) for c in np.unique(cidx)}
+    else:
+        groups = {c:[np.asarray(polys[i], np.int32).reshape(-1, 1, 2) for i in np.flatnonzero(cidx == c)] for c in np.unique(cidx)}
+    for c, group in groups.items():
+        _ = cv.polylines(image, group, closed, COLORS[c], line_size)
+    return image
+
+def draw_points(image:np.ndarray, points:np.ndarray, classes:np.ndarray, radius:int=3) -> np.ndarray:
+    """Draws points (N, 2) as filled dots, each dot is a single-point polyline so one OpenCV call is used per color."""
+    cidx = color_idx(classes)
+    pts = np.asarray(points, np.int32).reshape(-1, 1, 1, 2)
+    for c in np.unique(cidx):
+        _ = cv.polylines(image, list(pts[cidx == c]), False, COLORS[c], radius * 2, cv.LINE_AA)
+    return image
+
+def boxes2polys(boxes:np.ndarray) -> np.ndarray:
+    """Converts x1y1x2y2 boxes (N, 4) to closed 4 point polygons (N, 4, 2)."""
+    x1, y1, x2, y2 = boxes.T
+    return np.stack([np.stack([x1, y1], -1), np.stack([x2, y1], -1), np.stack([x2, y2], -1), np.stack([x1, y2], -1)], 1)
+
+def rle_encode(mask:np.ndarray) -> dict:
+    """Run-length encodes binary mask in row-major order, counts alternate background and foreground starting with background."""
+    flat = np.asarray(mask, bool).ravel()
+    change = np.flatnonzero(np.diff(flat.astype(np.int8))) + 1
+    bounds = np.concatenate([[0], change, [flat.size]])
+    counts = np.diff(bounds)
+    counts = counts if not flat[0] else np.concatenate([[0], counts]) # always start with background run
+    return {'size':list(mask.shape[:2]), 'counts':counts.tolist()}
+
+@dataclass
+class MaskSet:
+    """
+    Instance masks stored compactly as polygons (pixel vertices) or run-length encoding, rasterized together only when drawing.
+
+    Attributes
+    ---
+    polygons - ``list[np.ndarray]``
+        Vertices (K, 2) int32 in pixels for each polygon instance.
+
+    rles - ``list[dict]``
+        Run-length encoded instances, see `rle_encode()`, size must match image.
+
+    classes - ``np.ndarray``
+        Class index for each instance, polygons first then RLE instances.
+
+    Methods
+    ---
+    bounds(imH, imW) - Region (x1, y1, x2, y2) containing all instances.
+
+    rasterize(imH, imW, region) - Returns single label map where pixel value is instance number + 1, 0 is background. Later instances overlap earlier.
+
+    blend(image, alpha) - Paints all instances into one overlay of their combined extent and blends it onto image once.
+    """
+    polygons:list[np.ndarray] = field(default_factory=list)
+    rles:list[dict] = field(default_factory=list)
+    classes:np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+
+    def __len__(self) -> int:
+        return len(self.polygons) + len(self.rles)
+
+    def _runs(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Flat start index, length and label for every foreground run of RLE instances."""
+        starts, lengths, ids = [np.zeros(0, np.int64)], [np.zeros(0, np.int64)], [np.zeros(0, np.int64)]
+        for i, rle in enumerate(self.rles, len(self.polygons) + 1):
+            bounds = np.cumsum(np.concatenate([[0], rle['counts']])).astype(np.int64)
+            starts.append(bounds[1:-1:2])
+            lengths.append(np.diff(bounds)[1::2])
+            ids.append(np.full(len(lengths[-1]), i, np.int64))
+        return np.concatenate(starts), np.concatenate(lengths), np.concatenate(ids)
+
+    def bounds(self, imH:int, imW:int) -> tuple[int, int, int, int]:
+        """Region (x1, y1, x2, y2) containing all instances, clipped to image."""
+        x1, y1, x2, y2 = imW, imH, 0, 0
+        pts = [np.asarray(p).reshape(-1, 2) for p in self.polygons if len(p)]
+        if pts:
+            pts = np.concatenate(pts)
+            (x1, y1), (x2, y2) = pts.min(0), pts.max(0) + 1
+        starts, lengths, _ = self._runs()
+        if len(starts): # runs may wrap rows, use full width
+            x1, y1, x2, y2 = 0, min(y1, starts.min() // imW), imW, max(y2, (starts + lengths - 1).max() // imW + 1)
+        return max(int(x1), 0), max(int(y1), 0), min(int(x2), imW), min(int(y2), imH)
+
+    def _paint(self, canvas:np.ndarray, values:list, region:tuple, imW:int) -> np.ndarray:
+        """Writes `values[i]` over pixels of instance i in draw order, `canvas` covers `region` (x1, y1, x2, y2) of image with width `imW`."""
+        x1, y1, x2, y2 = region
+        for poly, v in zip(self.polygons, values):
+            if len(poly):
+                _ = cv.fillPoly(canvas, [np.asarray(poly, np.int32).reshape(-1, 1, 2)], v, offset=(-x1, -y1))
+        
+        for rle, v in zip(self.rles, values[len(self.polygons):]): # one row-aligned mask per instance, memory stays within size of image
+            bounds = np.cumsum(np.concatenate([[0], rle['counts']])).astype(np.int64)
+            starts, ends = bounds[1:-1:2], bounds[1:-1:2] + np.diff(bounds)[1::2]
+            if not len(starts):
+                continue
+            r0, r1 = max(int(starts[0]) // imW, y1), min((int(ends[-1]) - 1) // imW + 1, y2)
+            if r1 <= r0:
+                continue
+            n, off = (r1 - r0) * imW, r0 * imW
+            keep = (ends > off) & (starts < off + n) # runs are sorted and disjoint, so clipped starts and ends stay unique
+            edges = np.zeros(n + 1, np.int8)
+            edges[np.clip(starts[keep] - off, 0, n)] = 1
+            edges[np.clip(ends[keep] - off, 0, n)] -= 1 # end equal to next start cancels
+            mask = np.cumsum(edges[:-1], dtype=np.int8).view(bool).reshape(r1 - r0, imW)[:, x1:x2]
+            np.copyto(canvas[r0 - y1:r1 - y1], np.asarray(v, canvas.dtype), where=mask.reshape(mask.shape + (1,) * (canvas.ndim - 2)))
+        
+        return canvas
+
+    def rasterize(self, imH:int, imW:int, region:tuple=None) -> np.ndarray:
+        """Single label map for `region` (default full image) where pixel value is instance number + 1, 0 is background."""
+        assert all(tuple(r['size']) == (imH, imW) for r in self.rles), f"RLE size does not match image {(imH, imW)}"
+        region = region or (0, 0, imW, imH)
+        dtype = next(t for t in (np.uint8, np.uint16, np.int32) if len(self) <= np.iinfo(t).max)
+        labels = np.zeros((region[3] - region[1], region[2] - region[0]), dtype)
+        return self._paint(labels, list(range(1, len(self) + 1)), region, imW)
+
+    def blend(self, image:np.ndarray, alpha:float=0.4) -> np.ndarray:
+        """Blends class colors of all instances onto `image` in place. Instances are painted into one overlay covering their combined extent, then blended once, memory used stays the size of the image regardless of instance count."""
+        if not len(self):
+            return image
+        imH, imW = image.shape[:2]
+        assert all(tuple(r['size']) == (imH, imW) for r in self.rles), f"RLE size does not match image {(imH, imW)}"
+        x1, y1, x2, y2 = self.bounds(imH, imW)
+        if x2 <= x1 or y2 <= y1:
+            return image
+        roi = image[y1:y2, x1:x2]
+        overlay = self._paint(roi.copy(), [COLORS[c] for c in color_idx(self.classes)], (x1, y1, x2, y2), imW)
+        _ = cv.addWeighted(overlay, alpha, roi, 1 - alpha, 0, dst=roi)
+        return image
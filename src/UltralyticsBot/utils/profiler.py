@@ -0,0 +1,125 @@
+"""
+Title: utils/profiler.py
+Author: Burhan Qaddoumi
+Date: 2023-11-06
+
+Requires:
+"""
+import sys
+import time
+import threading
+from pathlib import Path
+from collections import Counter
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+
+IDLE = {('selectors.py', 'select'), ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'), ('thread.py', '_worker')} # leaf frames of threads waiting for work, not samples of interest
+OTHER = '[other]' # stacks past `max_stacks` distinct stacks
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    Statistical profiler, background thread records stack of every other thread each `interval_ms` with `sys._current_frames()` while active. When stopped no thread runs and requests only check `active`, so overhead is negligible. Stacks of idle threads (waiting on selector, lock, or queue) are skipped.
+
+    Attributes
+    ---
+    active - ``bool``
+        Is `True` while sampling.
+
+    stacks - ``collections.Counter``
+        Samples of each collapsed stack, thread name first then outermost to innermost frame separated by `;`.
+
+    Methods
+    ---
+    start(seconds, requests) - Samples until `seconds` pass or `requests` calls of `request_done()`, whichever is first. Returns ``False`` when already active.
+
+    request_done() - Counts finished request, stops when requested number is reached.
+
+    wait(timeout) - Blocks until stopped.
+
+    stop() - Stops sampling, returns `stacks`.
+
+    collapsed() - Stacks in collapsed format with count per line, for `flamegraph.pl` or speedscope.app.
+
+    top(n) - Summary of `n` functions with most samples, self (running) and total (running or calling).
+    """
+    def __init__(self, interval_ms:float=5.0, max_stacks:int=20000) -> None:
+        self.interval, self.max_stacks = interval_ms / 1e3, max_stacks
+        self.active = False
+        self.stacks = Counter()
+        self.samples = self.duration = 0
+        self._remaining = None
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, seconds:float, requests:int=None) -> bool:
+        with self._lock:
+            if self.active:
+                return False
+            self.active, self._remaining = True, requests
+            self.stacks, self.samples = Counter(), 0
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, args=(seconds,), name='profiler', daemon=True)
+            self._thread.start()
+        Loggr.info(f"Profiler started for {f'{requests} requests or ' if requests else ''}{seconds:.0f}s.")
+        return True
+
+    def request_done(self) -> None:
+        with self._lock:
+            if not self.active or self._remaining is None:
+                return
+            self._remaining -= 1
+            _ = self._stopped.set() if self._remaining <= 0 else None
+
+    def wait(self, timeout:float=None) -> bool:
+        return self._stopped.wait(timeout)
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        _ = self._thread.join() if self._thread is not None and self._thread is not threading.current_thread() else None
+        return self.stacks
+
+    def _run(self, seconds:float) -> None:
+        own, t0 = threading.get_ident(), time.perf_counter()
+        names = {t.ident:t.name for t in threading.enumerate()}
+        while not self._stopped.wait(self.interval) and time.perf_counter() - t0 < seconds:
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (Path(frame.f_code.co_filename).name, frame.f_code.co_name) in IDLE:
+                    continue
+                stack = list()
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident:t.name for t in threading.enumerate()}
+                key = ';'.join([names.get(ident, str(ident)), *reversed(stack)])
+                self.stacks[key if key in self.stacks or len(self.stacks) < self.max_stacks else OTHER] += 1
+                self.samples += 1
+        self.duration = time.perf_counter() - t0
+        with self._lock:
+            self.active = False
+        self._stopped.set()
+        METRICS.incr('profiler.samples', self.samples)
+        Loggr.info(f"Profiler stopped after {self.duration:.1f}s with {self.samples} samples.")
+
+    def collapsed(self) -> str:
+        return '\n'.join(f"{k} {v}" for k,v in self.stacks.most_common())
+
+    def top(self, n:int=15) -> str:
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:] or [stack]
+            own[frames[-1]] += count
+            for f in set(frames):
+                total[f] += count
+        samples = max(sum(self.stacks.values()), 1)
+        lines = [f"{'self %':>6} {'total %':>7}  function"]
+        lines.extend(f"{own[f] / samples:6.1%} {total[f] / samples:7.1%}  {f}" for f,_ in own.most_common(n))
+        return '\n'.join(lines)
+
+PROFILER = SamplingProfiler() # interval set from `profiler` config when started by `$profile`
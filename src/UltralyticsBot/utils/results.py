@@ -0,0 +1,179 @@
+"""
+Title: results.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: numpy, opencv-python
+"""
+from __future__ import annotations
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+from UltralyticsBot import CONFIG, YOLOv8_REGEX
+from UltralyticsBot.utils.msgs import gen_line, gen_cls_line
+from UltralyticsBot.utils.plotting import COLORS, MaskSet, color_idx, draw_polys, draw_points, boxes2polys, xcycwh2xyxy
+from UltralyticsBot.utils.lazy import lazy_import
+
+cv = lazy_import('cv2')
+np = lazy_import('numpy')
+
+TASK_SUFFIX = {'-cls':'classify', '-seg':'segment', '-pose':'pose', '-obb':'obb'}
+SKELETON = ((16, 14), (14, 12), (17, 15), (15, 13), (12, 13), (6, 12), (7, 13), (6, 7), (6, 8), (7, 9),
+            (8, 10), (9, 11), (2, 3), (1, 2), (1, 3), (2, 4), (3, 5), (4, 6), (5, 7)) # COCO keypoints (one-based), from ultralytics/utils/plotting.py
+KPT_CONF = 0.5 # minimum keypoint visibility to draw
+TOP_K = 5
+
+def model_task(model:str) -> str:
+    """Task for model name using task suffix, 'detect' when there is no suffix or model is not a YOLOv8 name."""
+    m = re.match(YOLOv8_REGEX, str(model).lower())
+    return TASK_SUFFIX.get(m.group(2), 'detect') if m and m.group(2) else 'detect'
+
+def _column(predictions:list[dict], key:str, dtype=float) -> np.ndarray:
+    return np.fromiter((p[key] for p in predictions), dtype, len(predictions))
+
+@dataclass
+class TaskResult(ABC):
+    """Common fields for all tasks, one element per prediction."""
+    names:list[str]
+    cls:np.ndarray
+    conf:np.ndarray
+    task = 'base'
+
+    @classmethod
+    @abstractmethod
+    def decode(cls, predictions:list[dict], imH:int, imW:int) -> 'TaskResult':
+        ...
+
+    @abstractmethod
+    def table(self, class_pad:int) -> str:
+        ...
+
+    @abstractmethod
+    def draw(self, image:np.ndarray, line_size:int) -> np.ndarray:
+        ...
+
+@dataclass
+class DetectResult(TaskResult):
+    boxes:np.ndarray = field(default_factory=lambda: np.zeros((0, 4), np.int_)) # x1y1x2y2 pixels
+    task = 'detect'
+
+    @classmethod
+    def decode(cls, predictions:list[dict], imH:int, imW:int) -> 'DetectResult':
+        name_k, conf_k, cls_k, *xywh_k = CONFIG.get().response
+        xywh = np.stack([_column(predictions, k) for k in xywh_k], -1) if any(predictions) else np.zeros((0, 4), np.float64)
+        boxes = (xcycwh2xyxy(xywh) * (imW, imH, imW, imH)).astype(np.int_) # n-xcycwh -> x1y1x2y2
+        return cls([p[name_k] for p in predictions], _column(predictions, cls_k, np.int64), _column(predictions, conf_k), boxes)
+
+    def table(self, class_pad:int) -> str:
+        return ''.join(gen_line(n, class_pad, c, *b) for n, c, b in zip(self.names, self.conf, self.boxes.tolist()))
+
+    def draw(self, image:np.ndarray, line_size:int) -> np.ndarray:
+        return draw_polys(image, boxes2polys(self.boxes), self.cls, line_size)
+
+@dataclass
+class SegmentResult(DetectResult):
+    masks:MaskSet = field(default_factory=MaskSet)
+    task = 'segment'
+
+    @classmethod
+    def decode(cls, predictions:list[dict], imH:int, imW:int) -> 'SegmentResult':
+        """Polygons from `segments` are used when present, otherwise run-length encoded `rle` mask (see `plotting.rle_encode`)."""
+        det = DetectResult.decode(predictions, imH, imW)
+        is_rle = np.array([p.get('segments') is None and p.get('rle') is not None for p in predictions], bool)
+        segs = [p.get('segments') or {'x':[], 'y':[]} for p, r in zip(predictions, is_rle) if not r]
+        scale = np.array((imW, imH), np.float64)
+        if len({len(s['x']) for s in segs}) == 1: # all polygons have same number of points, convert at once
+            arr = (np.array([(s['x'], s['y']) for s in segs], np.float64).transpose(0, 2, 1) * scale).astype(np.int32)
+            polys = list(arr)
+        else:
+            polys = [(np.stack([s['x'], s['y']], -1) * scale).astype(np.int32).reshape(-1, 2) for s in segs]
+        rles = [p['rle'] for p, r in zip(predictions, is_rle) if r]
+        masks = MaskSet(polys, rles, np.concatenate([det.cls[~is_rle], det.cls[is_rle]]))
+        return cls(det.names, det.cls, det.conf, det.boxes, masks)
+
+    def draw(self, image:np.ndarray, line_size:int) -> np.ndarray:
+        image = self.masks.blend(image)
+        return super().draw(image, line_size)
+
+@dataclass
+class PoseResult(DetectResult):
+    keypoints:np.ndarray = field(default_factory=lambda: np.zeros((0, 17, 3), np.float32)) # x, y pixels and visibility
+    task = 'pose'
+
+    @classmethod
+    def decode(cls, predictions:list[dict], imH:int, imW:int) -> 'PoseResult':
+        det = DetectResult.decode(predictions, imH, imW)
+        kpts = [p.get('keypoints') or {} for p in predictions]
+        lengths = {len(k.get('x', [])) for k in kpts}
+        if len(lengths) == 1 and all('visible' in k for k in kpts): # usual case, all instances have same keypoints
+            arr = np.array([(k['x'], k['y'], k['visible']) for k in kpts], np.float32).transpose(0, 2, 1).reshape(len(kpts), -1, 3)
+        else:
+            arr = np.zeros((len(kpts), max(lengths, default=17), 3), np.float32)
+            for i, k in enumerate(kpts):
+                n = len(k.get('x', []))
+                arr[i, :n, 0], arr[i, :n, 1] = k.get('x', []), k.get('y', [])
+                arr[i, :n, 2] = k.get('visible', [1.0] * n)
+        arr[..., :2] *= (imW, imH)
+        return cls(det.names, det.cls, det.conf, det.boxes, arr)
+
+    def draw(self, image:np.ndarray, line_size:int) -> np.ndarray:
+        image = super().draw(image, line_size)
+        if not len(self.keypoints):
+            return image
+        kp = self.keypoints
+        if kp.shape[1] == 17: # skeleton only known for COCO keypoints
+            sk = np.array(SKELETON) - 1
+            a, b = kp[:, sk[:, 0]], kp[:, sk[:, 1]] # (N, L, 3)
+            ok = (a[..., 2] >= KPT_CONF) & (b[..., 2] >= KPT_CONF)
+            lines = np.stack([a[..., :2], b[..., :2]], 2)[ok] # (M, 2, 2)
+            _ = draw_polys(image, lines, np.repeat(np.arange(len(SKELETON))[None], len(kp), 0)[ok], max(line_size // 2, 1), closed=False)
+        vis = kp[..., 2] >= KPT_CONF
+        return draw_points(image, kp[..., :2][vis], np.broadcast_to(np.arange(kp.shape[1]), vis.shape)[vis], max(line_size, 2))
+
+@dataclass
+class OBBResult(TaskResult):
+    corners:np.ndarray = field(default_factory=lambda: np.zeros((0, 4, 2), np.int32)) # 4 corner points pixels
+    task = 'obb'
+
+    @classmethod
+    def decode(cls, predictions:list[dict], imH:int, imW:int) -> 'OBBResult':
+        name_k, conf_k, cls_k, *_ = CONFIG.get().response
+        box = [p.get('box') or {} for p in predictions]
+        pts = np.array([[[b.get(f'x{i}', 0.0), b.get(f'y{i}', 0.0)] for i in range(1, 5)] for b in box], np.float32).reshape(-1, 4, 2)
+        corners = (pts * (imW, imH)).astype(np.int32)
+        return cls([p[name_k] for p in predictions], _column(predictions, cls_k, np.int64), _column(predictions, conf_k), corners)
+
+    def table(self, class_pad:int) -> str:
+        """Uses axis aligned extent of rotated box, so table matches detect layout."""
+        extent = np.concatenate([self.corners.min(1), self.corners.max(1)], -1)
+        return ''.join(gen_line(n, class_pad, c, *b) for n, c, b in zip(self.names, self.conf, extent.tolist()))
+
+    def draw(self, image:np.ndarray, line_size:int) -> np.ndarray:
+        return draw_polys(image, self.corners, self.cls, line_size)
+
+@dataclass
+class ClassifyResult(TaskResult):
+    task = 'classify'
+
+    @classmethod
+    def decode(cls, predictions:list[dict], imH:int, imW:int) -> 'ClassifyResult':
+        name_k, conf_k, cls_k, *_ = CONFIG.get().response
+        conf = _column(predictions, conf_k)
+        top = np.argsort(-conf)[:TOP_K]
+        return cls([predictions[i][name_k] for i in top], _column(predictions, cls_k, np.int64)[top], conf[top])
+
+    def table(self, class_pad:int) -> str:
+        return ''.join(gen_cls_line(n, class_pad, c) for n, c in zip(self.names, self.conf))
+
+    def draw(self, image:np.ndarray, line_size:int) -> np.ndarray:
+        scale = max(image.shape[:2]) / 1000
+        for i, (n, c, k) in enumerate(zip(self.names, self.conf, color_idx(self.cls))):
+            _ = cv.putText(image, f"{n} {c:.2f}", (line_size * 4, int((i + 1) * 40 * max(scale, 0.5))), cv.FONT_HERSHEY_SIMPLEX, max(scale, 0.5), COLORS[k], max(line_size // 2, 1), cv.LINE_AA)
+        return image
+
+DECODERS:dict[str, type[TaskResult]] = {r.task:r for r in (DetectResult, SegmentResult, PoseResult, OBBResult, ClassifyResult)}
+
+def decode(task:str, predictions:list[dict], imH:int, imW:int) -> TaskResult:
+    """Decodes API predictions for `task` into arrays, unknown tasks are decoded as detect."""
+    return DECODERS.get(task, DetectResult).decode(predictions, imH, imW)
@@ -0,0 +1,75 @@
+"""
+Title: utils/startup.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires:
+"""
+import re
+import sys
+import time
+import subprocess
+from pathlib import Path
+
+from UltralyticsBot import ROOT, CONFIG
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+
+T0 = time.perf_counter() # startup clock, starts when this module is first imported so it should be imported first by `bot.py`
+PHASES = dict()
+IMPORTTIME_RGX = r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$" # self (us) | cumulative (us) | indented module name
+IMPORT_TOLERANCE = 1.25 # allowed slowdown factor vs import time baseline, importing numpy or discord extras eagerly is well over
+
+###-----RUNTIME PHASES-----###
+
+def mark(phase:str) -> float:
+    """Records seconds since `T0` when `phase` is first reached, also as `startup.<phase>_s` gauge. Later calls return first value."""
+    if phase not in PHASES:
+        PHASES[phase] = round(time.perf_counter() - T0, 4)
+        METRICS.gauge(f"startup.{phase}_s", PHASES[phase])
+    return PHASES[phase]
+
+def connected() -> bool:
+    """Marks first gateway connect and logs all startup phases, with warning when slower than `connect_target_s` from `cfg/req.yaml`. Returns ``True`` only for first connect."""
+    if 'connect' in PHASES:
+        return False
+    took, target = mark('connect'), CONFIG.get().startup['connect_target_s']
+    msg = f"Startup {', '.join(f'{k} {v:.2f}s' for k,v in PHASES.items())}, connect target {target:.2f}s."
+    _ = Loggr.info(msg) if took <= target else Loggr.warning(msg)
+    return True
+
+###-----IMPORT TIMES-----###
+
+def import_times(module:str='bot', cwd:Path=ROOT.parent) -> list[tuple[str, int, int, int]]:
+    """Imports `module` in new interpreter with `python -X importtime`, returns (name, depth, self_us, cumulative_us) for each module imported, in import order."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, f"Importing {module} failed:\n{proc.stderr[-2000:]}"
+    return [(m[4], (len(m[3]) - 1) // 2, int(m[1]), int(m[2])) for m in re.finditer(IMPORTTIME_RGX, proc.stderr, re.MULTILINE)]
+
+def import_report(rows:list[tuple[str, int, int, int]], top:int=15) -> dict:
+    """Summarizes `import_times()` as total seconds, self time of each top-level package and slowest modules by cumulative time, both limited to `top` entries."""
+    packages = dict()
+    for name, _, self_us, _ in rows:
+        pkg = name.split('.')[0]
+        packages[pkg] = packages.get(pkg, 0) + self_us
+    return {
+        'total_s':round(sum(r[2] for r in rows) / 1e6, 4),
+        'packages':{k:round(v / 1e6, 4) for k,v in sorted(packages.items(), key=lambda kv: -kv[1])[:top]},
+        'modules':{r[0]:round(r[3] / 1e6, 4) for r in sorted(rows, key=lambda r: -r[3])[:top]},
+        }
+
+def compare_import(report:dict, baseline:dict|None, target:float, tolerance:float=IMPORT_TOLERANCE) -> list[str]:
+    """Returns list of failures, when import time exceeds `baseline` (`startup` entry of benchmark baseline, from same machine) by more than `tolerance` or is over absolute `target` ceiling."""
+    total, failures = report['total_s'], list()
+    if baseline is not None and total > baseline['import_s'] * tolerance:
+        failures.append(f"import {total:.3f}s vs baseline {baseline['import_s']:.3f}s (tolerance {tolerance:.2f}x)")
+    if total > target:
+        failures.append(f"import {total:.3f}s over target {target:.3f}s")
+    return failures
+
+def format_report(report:dict, target:float=None, baseline:dict=None) -> str:
+    lines = [f"Import time {report['total_s']:.3f}s" + (f" (target {target:.3f}s)" if target is not None else '') + (f", baseline {baseline['import_s']:.3f}s" if baseline is not None else '')]
+    for title, key in [("Self time by package", 'packages'), ("Cumulative time by module", 'modules')]:
+        lines.append(f"{title}:")
+        lines.extend(f"  {k:<48} {v * 1e3:9.1f} ms" for k,v in report[key].items())
+    return '\n'.join(lines)
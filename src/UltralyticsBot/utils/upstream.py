@@ -0,0 +1,252 @@
+"""
+Title: upstream.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: requests
+"""
+from __future__ import annotations
+import time
+import random
+import threading
+from dataclasses import dataclass
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.lazy import lazy_import
+
+requests = lazy_import('requests')
+
+RETRY_CODES = (429, 500, 502, 503, 504) # response codes worth retrying
+
+class UpstreamBusy(Exception):
+    """Raised instead of sending request when API is rate limiting or the circuit breaker is open."""
+
+@dataclass
+class RateLimit:
+    """Rate limit information from response headers, values are ``None`` when header not present."""
+    limit:int|None = None
+    remaining:int|None = None
+    reset:float|None = None # seconds until window resets
+    retry_after:float|None = None # seconds
+
+    @classmethod
+    def from_headers(cls, headers:dict) -> 'RateLimit':
+        """Parses `X-RateLimit-*` and `Retry-After` headers. NOTE `Retry-After` as HTTP-date is not supported and is ignored."""
+        def num(key:str, fn=float):
+            try:
+                return fn(float(headers[key])) if key in headers else None
+            except (TypeError, ValueError):
+                return None
+        reset = num('X-RateLimit-Reset')
+        reset = (reset - time.time()) if reset is not None and reset > 1e9 else reset # epoch timestamp -> seconds from now
+        return cls(num('X-RateLimit-Limit', int), num('X-RateLimit-Remaining', int), reset, num('Retry-After'))
+
+    def wait(self) -> float:
+        """Seconds to wait before next request, zero if no limit reached."""
+        if self.retry_after is not None:
+            return max(self.retry_after, 0.0)
+        if self.remaining == 0 and self.reset is not None:
+            return max(self.reset, 0.0)
+        return 0.0
+
+class TokenBucket:
+    """Thread-safe token bucket pacing requests to `rate` per second with bursts up to `capacity`."""
+    def __init__(self, rate:float, capacity:int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.paused_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now:float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """Takes a token, returns seconds caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = (-self.tokens / self.rate) if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def refund(self) -> None:
+        """Returns token taken by `reserve()` when request was not sent."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds:float) -> None:
+        """Holds all requests for `seconds`, used when API reports rate limit exhausted."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, rejecting calls for `cooldown` seconds, then allows a single trial call (half-open)."""
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold:int=5, cooldown:float=30.0) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self._trial = None # thread sending trial request
+        self._trial_at = 0.0 # when trial request was allowed
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and (time.monotonic() - self.opened_at) >= self.cooldown:
+                self.state, self._trial, self._trial_at = self.HALF_OPEN, threading.get_ident(), time.monotonic()
+                return True # one trial request
+            return self.state == self.CLOSED
+
+    def settle(self) -> None:
+        """Reopens breaker when calling thread's trial request ended without `success()` or `failure()` (not sent or unexpected error), so next call can try again instead of all calls being rejected until restart."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._trial == threading.get_ident():
+                self.state = self.OPEN # cooldown already passed, next `allow()` gives new trial
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+
+    def failure(self, cooldown:float=None) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    METRICS.incr('upstream.breaker_open')
+                    Loggr.warning(f"Circuit breaker opened after {self.failures} failure(s).")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() + max((cooldown or 0.0) - self.cooldown, 0.0) # extend when API asks for longer wait
+
+    def retry_in(self) -> float:
+        """Seconds until breaker will allow trial request. While half-open a trial is in flight and reopens breaker when it fails, so rest of cooldown window counted from trial start is returned, at least 1 second."""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            return max(self.cooldown - (now - self.opened_at), 0.0)
+        if self.state == self.HALF_OPEN:
+            return max(self.cooldown - (now - self._trial_at), 1.0)
+        return 0.0
+
+class UpstreamClient:
+    """
+    HTTP client for inference API with pacing, retries, and circuit breaker.
+
+    Attributes
+    ---
+    timeout - ``tuple[float,float]``
+        Connect and read timeouts in seconds for each attempt.
+
+    retries - ``int``
+        Retries after first attempt for connection errors or responses with a code in `RETRY_CODES`.
+
+    backoff - ``float``
+        Base delay (seconds) for exponential backoff, doubles each retry and delay is drawn uniformly from zero to that value (full jitter).
+
+    backoff_max - ``float``
+        Maximum backoff delay in seconds.
+
+    max_wait - ``float``
+        Longest total wait (seconds) for pacing or rate limits before giving up with `UpstreamBusy`.
+
+    Methods
+    ---
+    post(url, **kwargs) - Sends POST request, returns final ``requests.Response`` or raises `UpstreamBusy` when API is unavailable.
+    """
+    def __init__(self,
+                 timeout:tuple[float,float]=(3.05, 30.0),
+                 retries:int=3,
+                 backoff:float=0.5,
+                 backoff_max:float=8.0,
+                 max_wait:float=10.0,
+                 rate:float=1.0,
+                 burst:int=5,
+                 fail_threshold:int=5,
+                 cooldown:float=30.0,
+                 ) -> None:
+        self.timeout = tuple(timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(fail_threshold, cooldown)
+        self.last_limit = RateLimit()
+        self._local = threading.local() # requests.Session is not thread-safe, one per thread
+
+    @classmethod
+    def from_cfg(cls, cfg:dict) -> 'UpstreamClient':
+        return cls(**cfg)
+
+    @property
+    def session(self) -> requests.Session:
+        if getattr(self._local, 'session', None) is None:
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def jitter(self, attempt:int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        """Sends POST to `url` with `kwargs` passed to ``requests.Session.post``, blocking while paced or backing off."""
+        if not self.breaker.allow():
+            METRICS.incr('upstream.rejected')
+            raise UpstreamBusy(f"circuit open, retry in {self.breaker.retry_in():.1f}s")
+        try:
+            return self._send(url, **kwargs)
+        finally:
+            self.breaker.settle()
+
+    def _send(self, url:str, **kwargs) -> requests.Response:
+        waited = 0.0
+        for attempt in range(self.retries + 1):
+            wait = self.bucket.reserve()
+            if waited + wait > self.max_wait:
+                self.bucket.refund()
+                METRICS.incr('upstream.rejected')
+                raise UpstreamBusy(f"rate limited, next request slot in {wait:.1f}s")
+            time.sleep(wait)
+            waited += wait
+
+            try:
+                METRICS.incr('upstream.requests')
+                with METRICS.timer('upstream.latency'):
+                    resp = self.session.post(url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                resp, error = None, e
+                Loggr.warning(f"Upstream attempt {attempt + 1} failed with {e!r}")
+            else:
+                error = None
+                self.last_limit = RateLimit.from_headers(resp.headers)
+                if resp.status_code not in RETRY_CODES:
+                    self.breaker.success()
+                    return resp
+                Loggr.warning(f"Upstream attempt {attempt + 1} returned {resp.status_code} - {resp.reason}")
+            
+            METRICS.incr(f"upstream.retryable.{resp.status_code if resp is not None else 'conn'}")
+            limit_wait = self.last_limit.wait() if resp is not None and resp.status_code == 429 else 0.0
+            if limit_wait:
+                self.bucket.pause(limit_wait)
+            
+            if attempt == self.retries:
+                break
+            delay = max(self.jitter(attempt), limit_wait)
+            if waited + delay > self.max_wait:
+                break
+            METRICS.incr('upstream.retries')
+            time.sleep(delay)
+            waited += delay
+        
+        self.breaker.failure(cooldown=limit_wait)
+        if error is not None:
+            raise error
+        if resp.status_code == 429:
+            raise UpstreamBusy(f"rate limited by API, retry after {limit_wait:.1f}s")
+        return resp
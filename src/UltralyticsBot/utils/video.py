@@ -0,0 +1,145 @@
+"""
+Title: utils/video.py
+Author: Burhan Qaddoumi
+Date: 2023-11-04
+
+Requires: numpy, opencv-python, requests
+"""
+from __future__ import annotations
+import os
+import tempfile
+import itertools
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import urlparse
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+cv = lazy_import('cv2')
+requests = lazy_import('requests')
+
+THUMB = (64, 64) # frames are compared as grayscale thumbnails
+CHUNK = 1 << 16 # download chunk bytes
+WRITERS = (('VP90', '.webm'), ('VP80', '.webm'), ('mp4v', '.mp4')) # first available codec is used for video output, Discord plays WebM inline. NOTE FFmpeg warns tag is not supported for WebM, but writer works
+GIF_MS = (20, 1000) # shortest and longest GIF frame duration (ms)
+
+class ClipTooLarge(ValueError):
+    """Raised when clip download is larger than allowed."""
+
+def fetch_clip(url:str, max_mb:float, timeout:float=30.0) -> Path:
+    """Streams clip at `url` to temporary file in chunks, so download is never held in memory. Caller removes file. Raises ``ClipTooLarge`` when over `max_mb`, no partial file is left on errors."""
+    fd, name = tempfile.mkstemp(suffix=Path(urlparse(url).path).suffix or '.mp4', prefix='clip_')
+    total, limit = 0, max_mb * 1024 ** 2
+    try:
+        with os.fdopen(fd, 'wb') as f, requests.get(url, stream=True, timeout=timeout) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(CHUNK):
+                total += len(chunk)
+                if total > limit:
+                    raise ClipTooLarge(f"Clip is over {max_mb} MB")
+                f.write(chunk)
+    except BaseException:
+        Path(name).unlink(missing_ok=True)
+        raise
+    METRICS.observe('clip.download_mb', total / 1024 ** 2)
+    return Path(name)
+
+def clip_info(path:Path) -> tuple[int, float]:
+    """Frame count and frames per second reported by container, count can be estimate or `0` when unknown."""
+    cap = cv.VideoCapture(str(path))
+    try:
+        return int(cap.get(cv.CAP_PROP_FRAME_COUNT)), (cap.get(cv.CAP_PROP_FPS) or 10.0)
+    finally:
+        cap.release()
+
+def thumb(frame:np.ndarray) -> np.ndarray:
+    return cv.resize(cv.cvtColor(frame, cv.COLOR_BGR2GRAY), THUMB, interpolation=cv.INTER_AREA).astype(np.int16)
+
+def sample_frames(path:Path, stride:int, max_frames:int, scene_diff:float, skip_diff:float, max_index:int=None) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Decodes clip at `path` one frame at a time, yields (index, frame) for every `stride`-th frame and for frames that differ from last sampled frame by at least `scene_diff` (mean absolute difference of grayscale thumbnails, 0-255), which is disabled when `0`. Candidates within `skip_diff` of last sampled frame are skipped as near-identical. Stops after `max_frames` are sampled or `max_index` frames decoded.
+    """
+    cap = cv.VideoCapture(str(path))
+    last, n, i = None, 0, -1
+    try:
+        while n < max_frames and (max_index is None or i + 1 < max_index):
+            i += 1
+            if scene_diff <= 0 and i % stride: # not candidate, skip color conversion
+                if not cap.grab():
+                    break
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            t = thumb(frame)
+            diff = float(np.abs(t - last).mean()) if last is not None else 255.0
+            if (i % stride == 0 or diff >= scene_diff > 0) and diff >= skip_diff:
+                last, n = t, n + 1
+                yield i, frame
+            else:
+                METRICS.incr('clip.skipped_frames')
+    finally:
+        cap.release()
+
+def take(frames:Iterator, n:int) -> list:
+    """Next `n` items from `frames`, fewer when exhausted."""
+    return list(itertools.islice(frames, n))
+
+def inference_frame(frame:np.ndarray, infer_size:int=640, enc:str='.jpeg', Q:int=60) -> tuple[np.ndarray, bytes, float]:
+    """Scales frame to fit `infer_size` (never enlarged) and encodes it, same as ``ReqImage.inference_img()``. Returns inference image, image bytes, and resized ratio."""
+    h, w = frame.shape[:2]
+    R = round(min(infer_size / h, infer_size / w, 1.0), 2)
+    image = cv.resize(frame, None, None, R, R) if R < 1.0 else frame
+    return image, cv.imencode(enc, image, (cv.IMWRITE_JPEG_QUALITY, Q))[1].tobytes(), R
+
+def fit(image:np.ndarray, out_size:int) -> np.ndarray:
+    """Scales `image` down so longest side is at most `out_size`."""
+    R = min(out_size / max(image.shape[:2]), 1.0)
+    return cv.resize(image, None, None, R, R, interpolation=cv.INTER_AREA) if R < 1.0 else image
+
+def _render_gif(frames:list[np.ndarray], durations:list[int]) -> bytes:
+    anim = cv.Animation()
+    anim.frames, anim.durations, anim.loop_count = frames, durations, 0
+    ok, buf = cv.imencodeanimation('.gif', anim)
+    assert ok, "Unable to encode GIF"
+    return buf.tobytes()
+
+def _render_video(frames:list[np.ndarray], fps:float) -> bytes:
+    h, w = frames[0].shape[:2]
+    for fourcc, ext in WRITERS:
+        fd, name = tempfile.mkstemp(suffix=ext, prefix='clip_out_')
+        os.close(fd)
+        try:
+            writer = cv.VideoWriter(name, cv.VideoWriter_fourcc(*fourcc), fps, (w, h))
+            if not writer.isOpened():
+                continue
+            _ = [writer.write(f) for f in frames]
+            writer.release()
+            return Path(name).read_bytes()
+        finally:
+            Path(name).unlink(missing_ok=True)
+    raise RuntimeError(f"No video writer available for {[w[0] for w in WRITERS]}")
+
+def render_clip(frames:list[tuple[int, bytes]], fps:float, gif:bool, max_mb:float, out_size:int=480) -> bytes:
+    """
+    Renders annotated frames, (index, JPEG bytes) from `take()`, as GIF keeping original timing when `gif` is `True`, otherwise as video (WebM or MP4, first writer available) at sampled frame rate. GIF encoding needs OpenCV 4.11 or newer, older versions render video instead. Output is scaled down until within `max_mb` upload limit. Returns encoded bytes.
+    """
+    gif = gif and hasattr(cv, 'imencodeanimation')
+    idx = [i for i,_ in frames]
+    gaps = [b - a for a,b in zip(idx, idx[1:])] + [max(idx[-1] - idx[-2], 1) if len(idx) > 1 else 1]
+    durations = [int(min(max(g / fps * 1e3, GIF_MS[0]), GIF_MS[1])) for g in gaps]
+    out_fps = min(max(len(idx) / max((idx[-1] + gaps[-1]) / fps, 1e-3), 1.0), 30.0)
+    size = out_size
+    while True:
+        images = [fit(cv.imdecode(np.frombuffer(b, np.uint8), cv.IMREAD_COLOR), size) for _,b in frames]
+        images = [cv.resize(im, images[0].shape[1::-1]) if im.shape != images[0].shape else im for im in images] # writers need same size
+        data = _render_gif(images, durations) if gif else _render_video(images, out_fps)
+        if len(data) <= max_mb * 1024 ** 2 or size <= 64:
+            break
+        Loggr.debug(f"Rendered clip {len(data) / 1024 ** 2:.1f} MB at {size} px over {max_mb} MB, rendering smaller.")
+        size = int(size * 0.7)
+    METRICS.observe('clip.render_mb', len(data) / 1024 ** 2)
+    return data
@@ -0,0 +1,97 @@
+"""
+Title: utils/watchdog.py
+Author: Burhan Qaddoumi
+Date: 2023-11-06
+
+Requires:
+"""
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
+from UltralyticsBot.utils.profiler import frame_label
+
+PKG_DIR = str(Path(__file__).parent.parent) # stall location is innermost frame from bot code, not library it called
+
+class LoopWatchdog:
+    """
+    Measures event loop scheduling lag and captures stack of code blocking loop. Heartbeat task on loop sleeps `interval_ms` and records how late it wakes as `loop.lag_ms`. Helper thread checks heartbeat and when loop hasn't run for `threshold_ms` past expected wake, reads stack of loop thread with `sys._current_frames()` while it's still blocked. Once loop resumes, stall is logged as warning with captured stack and duration, and recorded as `loop.stalls` and `loop.stall_ms`.
+
+    Attributes
+    ---
+    stalls - ``int``
+        Stalls detected since started.
+
+    last - ``dict``
+        Most recent stall with `ms` duration, `at` line of innermost bot frame, and `stack` innermost frame last, `None` before first stall.
+
+    Methods
+    ---
+    start() - Starts heartbeat task on running loop and helper thread, returns heartbeat task.
+
+    stop() - Stops heartbeat and helper thread.
+    """
+    def __init__(self, interval_ms:float=100.0, threshold_ms:float=250.0, frames:int=15) -> None:
+        self.interval, self.threshold, self.frames = interval_ms / 1e3, threshold_ms / 1e3, frames
+        self.stalls, self.last = 0, None
+        self._beat = time.monotonic() # when heartbeat is next expected to run
+        self._stall = None # (stack, location) captured by helper thread during stall in progress
+        self._loop_ident = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._task = self._thread = None
+
+    def start(self) -> asyncio.Task:
+        self._loop_ident, self._beat = threading.get_ident(), time.monotonic() + self.interval
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        Loggr.info(f"Loop watchdog started, stalls over {self.threshold * 1e3:.0f} ms are logged.")
+        return self._task
+
+    def stop(self) -> None:
+        self._stopped.set()
+        _ = self._task.cancel() if self._task is not None else None
+        _ = self._thread.join() if self._thread is not None and self._thread is not threading.current_thread() else None
+
+    async def _heartbeat(self) -> None:
+        while not self._stopped.is_set():
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                lag, stall = now - self._beat, self._stall
+                self._beat, self._stall = now + self.interval, None
+            METRICS.observe('loop.lag_ms', round(max(lag, 0.0) * 1e3, 3))
+            _ = self._report(lag, *stall) if stall is not None else None
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 4):
+            with self._lock:
+                if self._stall is not None or time.monotonic() - self._beat < self.threshold:
+                    continue
+            frame = sys._current_frames().get(self._loop_ident)
+            frames = list()
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            at = next((f for f in frames if f.f_code.co_filename.startswith(PKG_DIR)), frames[0] if any(frames) else None)
+            stack = [frame_label(f.f_code) for f in reversed(frames)] or ['[unknown]']
+            at = f"{at.f_code.co_name} ({Path(at.f_code.co_filename).name}:{at.f_lineno})" if at is not None else '[unknown]'
+            with self._lock:
+                if time.monotonic() - self._beat >= self.threshold: # heartbeat hasn't run meanwhile
+                    self._stall = (stack, at)
+
+    def _report(self, lag:float, stack:list[str], at:str) -> None:
+        ms = round(lag * 1e3, 1)
+        self.stalls += 1
+        self.last = {'ms':ms, 'at':at, 'stack':stack[-self.frames:]}
+        METRICS.incr('loop.stalls')
+        METRICS.observe('loop.stall_ms', ms)
+        Loggr.warning(f"Event loop blocked for {ms} ms at {at}.", extra={'stall_ms':ms, 'stack':self.last['stack']})
+
+WATCHDOG = LoopWatchdog() # thresholds set from `watchdog` config when started by client
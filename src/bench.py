@@ -0,0 +1,54 @@
+"""
+Title: bench.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: pyyaml, numpy, requests, opencv-python
+"""
+import sys
+import argparse
+from pathlib import Path
+
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.bench.pipeline import run_bench, load_baseline, save_baseline, compare, report, run_task_bench, compare_tasks, report_tasks, BASELINE_FILE, TOLERANCE
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the predict pipeline using a local stub in place of the HUB API.")
+    parser.add_argument('--rounds', type=int, default=1, help="Number of passes over the full corpus.")
+    parser.add_argument('--size', type=int, default=640, help="Inference image size.")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE, help="Baseline YAML file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Allowed slowdown factor before failing.")
+    parser.add_argument('--save', action='store_true', help="Overwrite baseline with results from this run.")
+    parser.add_argument('--tasks', action='store_true', help="Compare result processing for each task against detect reference from baseline, using per-task tolerance from baseline where given, instead of full pipeline.")
+    args = parser.parse_args()
+
+    if args.tasks:
+        results = run_task_bench()
+        print(report_tasks(results))
+        tasks = (load_baseline(args.baseline) or {}).get('tasks', {})
+        regressions = compare_tasks(results, tasks.get('detect_reference'), args.tolerance, task_tolerance=tasks.get('tolerance'))
+        if any(regressions):
+            Loggr.error(f"Task processing slower than detect:{''.join(chr(10) + '- ' + r for r in regressions)}")
+            sys.exit(1)
+        Loggr.info("All tasks within tolerance of detect.")
+        return
+
+    results = run_bench(args.rounds, args.size)
+    baseline = load_baseline(args.baseline)
+    print(report(results, baseline))
+
+    if args.save:
+        save_baseline(results, args.baseline)
+    
+    elif baseline is None:
+        Loggr.warning(f"No baseline found at {args.baseline.as_posix()}, run with --save to create one.")
+    
+    else:
+        regressions = compare(results, baseline, args.tolerance)
+        if any(regressions):
+            Loggr.error(f"Benchmark regression(s) against baseline:{''.join(chr(10) + '- ' + r for r in regressions)}")
+            sys.exit(1)
+        Loggr.info("Benchmark within tolerance of baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -5,36 +5,58 @@ Date: 2023-10-10
 
 Requires: discord.py, pyyaml, numpy, requests, opencv-python
 """
+from UltralyticsBot.utils.startup import mark, connected # first, starts startup clock
+
+import asyncio
+import threading
+from functools import partial
+
 import discord
 from discord import app_commands
 
-from UltralyticsBot import BOT_TOKEN, OWNER_ID, DEV_GUILD, BOT_ID
+from UltralyticsBot import BOT_TOKEN, OWNER_ID, DEV_GUILD, BOT_ID, CONFIG
 from UltralyticsBot.cmds.client import MyClient
-from UltralyticsBot.cmds.actions import msg_predict, im_predict, chng_status, ACTIVITIES, about, commands, help, slash_example, msgexample, fetch_embed
+from UltralyticsBot.cmds.shards import run_sharded
+from UltralyticsBot.cmds.sync import sync_changed, sync_all, format_changes
+from UltralyticsBot.jobs.broker import MemoryBroker
+from UltralyticsBot.jobs.worker import start_process_workers, start_thread_workers
+from UltralyticsBot.cmds.actions import msg_predict, im_predict, chng_status, ACTIVITIES, about, commands, help, slash_example, msgexample, fetch_embed, prewarm_local, BROKER, DEVMsgs
+from UltralyticsBot.utils.config import ConfigError
 from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.metrics import METRICS
 from UltralyticsBot.utils.msgs import NOT_OWNER, NEWLINE, get_args
-from UltralyticsBot.utils.docs_data import docs_choices
+from UltralyticsBot.utils.docs_data import docs_choices, docs_cached
 
-def main():
-    _ = docs_choices(True) # Stores information locally for client to load
-    Loggr.info("Finished fetching docs.")
+mark('imports')
+
+def run_client(shard_ids:list[int]=None, shard_count:int=None, metrics_queue=None, refresh_docs:bool=False):
+    """Runs client for `shard_ids` (all shards when `None`), docs must already be fetched to local cache and are refreshed after connecting when `refresh_docs` is `True`."""
+    if isinstance(BROKER, MemoryBroker):
+        _ = start_thread_workers(BROKER, CONFIG.get().jobs['concurrency'])
+    _ = CONFIG.watch(CONFIG.get().hot_reload['watch_s'])
 
     intent = discord.Intents.default()
     intent.message_content = True
-    client = MyClient(intents=intent)
-    # client.setup() # NOTE lets to Rate Limiting (especially when testing)
+    client = MyClient(intents=intent, shard_ids=shard_ids, shard_count=shard_count, metrics_queue=metrics_queue, refresh_docs=refresh_docs)
+    mark('client')
+    # client.setup() # NOTE runs from setup_hook, only syncs changed commands
     # client.cmd_pop() # NOTE included with class init method
     
+    @client.event
+    async def on_connect():
+        if connected() and BROKER is None: # predict runs in this process, warm up without delaying connect
+            _ = threading.Thread(target=prewarm_local, name='prewarm', daemon=True).start()
+
     @client.event
     async def on_ready():
-        Loggr.info("Client is ready, sync must be run manually.")
+        mark('ready')
+        Loggr.info("Client is ready, commands changed since last sync are synced on start, use $cmd_sync for servers.")
         client.docs_update.start()
-        # Loggr.info("Initialized client sync")
-        # await client.tree.sync() # NOTE lets to Rate Limiting (especially when testing)
 
     @client.event
     async def on_message(message:discord.Message):
         author, guild, content, mentions = [getattr(message, a) for a in ['author', 'guild', 'content', 'mentions']]
+        METRICS.incr(f"shard.{guild.shard_id if guild else 0}.messages") # direct messages go to shard 0
         is_owner = author.id == OWNER_ID
         bot_mention = any([b.id == BOT_ID for b in mentions])
         args = get_args(content)
@@ -47,29 +69,41 @@ def main():
             await message.reply(msg)
 
         elif is_owner and content.startswith("$cmd_sync"):
-            if not any(args):
+            force = 'force' in [a.lower() for a in args] # sync even when unchanged since last sync
+            if 'all' not in [a.lower() for a in args]:
                 Loggr.info(f"Syncing the client for {guild}.")
                 try:
                     Guild = await client.fetch_guild(guild.id)
                     client.tree.copy_global_to(guild=Guild)
                     # [client.tree.add_command(c, guild=guild) for c in client.tree.get_commands()]
-                    syncd_cmds = await client.tree.sync(guild=Guild)
-                    Loggr.info(f"Commands synced {[c.name for c in syncd_cmds]} to server {guild}.")
-                    await message.reply(f"Commands synced for server {NEWLINE}- {(NEWLINE + '- ').join([c.name for c in syncd_cmds])}")
+                    changes = await sync_changed(client.tree, Guild, force)
+                    await message.reply(f"Commands for server {format_changes(changes)}{'' if any(any(v) for v in changes.values()) or force else ', sync skipped'}.")
                 except Exception as e:
                     Loggr.error(f"Syncing exception {e}")
             
-            elif 'all' in [a.lower() for a in args]:
-                Loggr.info(f"Executing sync/setup for commands across all guilds.")
+            else:
+                Loggr.info(f"Executing sync/setup for changed commands across all guilds.")
                 try:
-                    syncd_cmds = await client.tree.sync()
-                    Loggr.info(f"Syncing commands: {[c.name for c in syncd_cmds]} to all servers.")
-                    await message.reply(f"Commands synced for all servers {NEWLINE}- {(NEWLINE + '- ').join([c.name for c in syncd_cmds])}")
+                    synced = await sync_all(client, force)
+                    await message.reply(f"Commands synced {NEWLINE}- {(NEWLINE + '- ').join(f'{k} {format_changes(v)}' for k,v in synced.items())}" if any(synced) else "No command changes since last sync, sync skipped.")
                 except Exception as e:
                     Loggr.error(f"Syncing exception {e}")
             
             Loggr.info(f"Docs update scheduler {'is running' if client.docs_update.is_running() else 'not running.'}")
 
+        elif is_owner and content.startswith("$reload_cfg"):
+            try:
+                changed = await asyncio.to_thread(CONFIG.reload)
+                await message.reply(f"Config reloaded, changed {NEWLINE}- {(NEWLINE + '- ').join(changed)}" if any(changed) else "Config reloaded, no changes.")
+            except ConfigError as e:
+                Loggr.error(f"Config not reloaded {e}")
+                await message.reply(f"Config not reloaded, keeping current. {e}")
+
+        elif is_owner and content.startswith("$profile"):
+            dev = DEVMsgs(OWNER_ID)
+            dev.init_cmds()
+            await dev.fire_cmd("$profile", client, message, *args)
+
         elif is_owner and content.startswith("$rm_cmd"):
             cmd = await client.tree.remove_command(command=args[0].lower(), guild=guild)
             await message.reply(f"Removed the {cmd.name} commands from server {guild.name}") if cmd is not None else await message.reply(f"No command with name {args[0].lower()}.")
@@ -245,8 +279,24 @@ def main():
     #     Loggr.info(f"Syncing commands to {interaction.guild.name} on demand.")
     #     await client.tree.sync(guild=interaction.guild)
 
-    discord_Loggr = Loggr.handlers[0] # StreamHandler
-    client.run(BOT_TOKEN, log_formatter=discord_Loggr.formatter, log_handler=discord_Loggr, log_level=10) # logging.DEBUG=10
+    client.run(BOT_TOKEN, log_handler=None) # discord.py logging configured with `discord` logger in cfg/Loggr.yaml, written from queue
+
+def main():
+    fetched = not docs_cached() # existing cache is refreshed after connecting, instead of waiting for repo fetch
+    if fetched:
+        _ = docs_choices(True) # Stores information locally for client to load
+        Loggr.info("Finished fetching docs.")
+    mark('docs')
+    target = partial(run_client, refresh_docs=not fetched)
+
+    jobs, shards = CONFIG.get().jobs, CONFIG.get().shards
+    if jobs['enabled'] and jobs['broker'] != 'memory' and jobs['workers'] > 0:
+        _ = start_process_workers(jobs, jobs['workers'])
+
+    if shards['processes'] > 1:
+        run_sharded(target, BOT_TOKEN, shards['count'], shards['processes'], shards['report_s'])
+    else:
+        target(shard_count=shards['count'])
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""
+Title: loadtest.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: discord.py, pyyaml, numpy, requests, opencv-python
+"""
+import argparse
+
+import yaml
+
+from UltralyticsBot.bench.load import run_load, breaker_check
+from UltralyticsBot.bench.mock_hub import MockConfig
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test predict commands against a local mock of the HUB API.")
+    parser.add_argument('-n', '--requests', type=int, default=100, help="Total number of predict requests.")
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="Maximum requests in flight.")
+    parser.add_argument('--slash-ratio', type=float, default=0.5, help="Fraction of requests sent as slash-commands, rest are messages.")
+    parser.add_argument('--latency', type=float, default=50.0, help="Mean mock API latency (ms).")
+    parser.add_argument('--jitter', type=float, default=10.0, help="Mock API latency standard deviation (ms).")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requests per window before HTTP 429, 0 disables.")
+    parser.add_argument('--rate-window', type=float, default=60.0, help="Rate limit window (seconds).")
+    parser.add_argument('--detections', type=int, nargs=2, default=(0, 20), metavar=('MIN', 'MAX'), help="Range of detections per reply.")
+    parser.add_argument('--progressive', action=argparse.BooleanOptionalAction, default=None, help="Send results text before annotated image, default uses 'reply' setting in cfg/req.yaml.")
+    parser.add_argument('--jobs', choices=('memory', 'sqlite'), default=None, help="Run predict commands with job workers using this broker, default uses 'jobs' setting in cfg/req.yaml.")
+    parser.add_argument('--cache', action='store_true', help="Use result cache, starting empty in temporary directory. Off by default so repeated corpus images don't measure the cache, the bot's cache is never used.")
+    parser.add_argument('--paced', action='store_true', help="Pace upstream requests with 'upstream' rate limit in cfg/req.yaml. Off by default so throughput measures the bot and not the rate limiter.")
+    parser.add_argument('--breaker-check', action='store_true', help="Only check circuit breaker recovers after trial request isn't sent or raises unexpected error, fails when stuck.")
+    args = parser.parse_args()
+    if args.breaker_check:
+        print(yaml.safe_dump(breaker_check(), sort_keys=False))
+        return
+
+    cfg = MockConfig(args.latency, args.jitter, args.error_rate, args.rate_limit, args.rate_window, tuple(args.detections))
+    print(yaml.safe_dump(run_load(args.requests, args.concurrency, cfg, args.slash_ratio, args.progressive, args.jobs, args.cache, args.paced), sort_keys=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Title: startup.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: pyyaml
+"""
+import sys
+import argparse
+from pathlib import Path
+
+from UltralyticsBot import CONFIG
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.utils.startup import import_times, import_report, compare_import, format_report, IMPORT_TOLERANCE
+from UltralyticsBot.bench.pipeline import load_baseline, save_baseline, BASELINE_FILE
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time of bot startup from `python -X importtime`, fails when slower than baseline or over 'startup' target in cfg/req.yaml.")
+    parser.add_argument('-m', '--module', type=str, default='bot', help="Module to import, relative to src directory.")
+    parser.add_argument('--top', type=int, default=15, help="Number of packages and modules to list.")
+    parser.add_argument('--target', type=float, default=CONFIG.get().startup['import_target_s'], help="Import time ceiling in seconds.")
+    parser.add_argument('--rounds', type=int, default=3, help="Imports to run, fastest is reported.")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE, help="Baseline YAML file to compare against, import time is stored under 'startup'.")
+    parser.add_argument('--tolerance', type=float, default=IMPORT_TOLERANCE, help="Allowed slowdown factor vs baseline before failing.")
+    parser.add_argument('--save', action='store_true', help="Overwrite import time baseline with result from this run.")
+    args = parser.parse_args()
+
+    report = min((import_report(import_times(args.module), args.top) for _ in range(max(args.rounds, 1))), key=lambda r: r['total_s'])
+    baseline = None if args.module != 'bot' else (load_baseline(args.baseline) or {}).get('startup') # baseline is for importing bot
+    print(format_report(report, args.target, baseline))
+    if args.save:
+        save_baseline({'startup':{'import_s':report['total_s']}}, args.baseline)
+        return
+    
+    _ = Loggr.warning(f"No import baseline found in {args.baseline.as_posix()}, run with --save to create one.") if baseline is None and args.module == 'bot' else None
+    failures = compare_import(report, baseline, args.target, args.tolerance)
+    if any(failures):
+        Loggr.error(f"Importing {args.module} too slow:{''.join(chr(10) + '- ' + f for f in failures)}")
+        sys.exit(1)
+    Loggr.info(f"Importing {args.module} within target.")
+
+if __name__ == '__main__':
+    main()
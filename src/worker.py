@@ -0,0 +1,31 @@
+"""
+Title: worker.py
+Author: Burhan Qaddoumi
+Date: 2023-10-12
+
+Requires: discord.py, pyyaml, numpy, requests, opencv-python
+"""
+import argparse
+
+from UltralyticsBot import CONFIG
+from UltralyticsBot.utils.logging import Loggr
+from UltralyticsBot.jobs.worker import start_process_workers
+
+def main():
+    jobs = CONFIG.get().jobs
+    parser = argparse.ArgumentParser(description="Run predict job workers separately from bot, uses 'jobs' settings in cfg/req.yaml.")
+    parser.add_argument('-p', '--processes', type=int, default=max(jobs['workers'], 1), help="Number of worker processes.")
+    parser.add_argument('-c', '--concurrency', type=int, default=jobs['concurrency'], help="Jobs each worker runs at once.")
+    parser.add_argument('--path', type=str, default=jobs['path'], help="SQLite queue file shared with bot, relative to project root or absolute.")
+    args = parser.parse_args()
+
+    cfg = {**jobs, 'broker':'sqlite', 'path':args.path, 'concurrency':args.concurrency}
+    procs = start_process_workers(cfg, args.processes)
+    Loggr.info(f"Started {len(procs)} job workers on {cfg['path']}.")
+    try:
+        _ = [p.join() for p in procs]
+    except KeyboardInterrupt:
+        Loggr.info("Stopping job workers.")
+
+if __name__ == '__main__':
+    main()